@@ -0,0 +1,151 @@
+"""
+Async serving mode: uvicorn asgi:app --host 0.0.0.0 --port $PORT [--workers N]
+
+The endpoints that mostly wait on SBDB, NEO, WorldPop or JPL (object detail,
+impact and missions) run as coroutines on each worker's event loop, so one
+worker holds hundreds of upstream requests in flight instead of one per
+gunicorn thread. Every other request is served by the Flask app (main:app)
+on a pool of threads, so routing, CORS and responses stay defined in main.py.
+
+Datasets and the Firestore client are loaded in a thread at startup (the
+lifespan protocol, on by default in uvicorn), so a first request never loads
+them on the event loop.
+"""
+import asyncio
+import logging
+import os
+from datetime import date
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.exceptions import HTTPException
+
+import main
+from impacts import calculate_impact_async, calculate_impact_uncertainty
+from lazy import Lazy
+from porkchop import design_missions, mission_window
+
+# Threads serving the Flask routes
+flask_app = WSGIMiddleware(main.app, workers=int(os.environ.get("threads", "8")))
+urls = main.app.url_map.bind("localhost")
+
+
+async def get_object(key: str, args: dict):
+    data = await main.fs.get_or_create_async(key, main.asteroid_collector.get_async)
+    if data is None:
+        return "", 404
+
+    return main.object_detail(data), 200
+
+
+async def get_missions(key: str, args: dict):
+    start_date = args.get('start_date', date.today().isoformat())
+    end_date = args.get('end_date')
+    engine = args.get('engine', main.mission_engine)
+
+    if engine == 'jpl':
+        return await main.mission_design.get_from_id_async(key, start_date, end_date), 200
+    if engine != 'local' or end_date is None:
+        return "Expected engine=local|jpl and an end_date", 400
+    try:
+        mjd_start, mjd_end = mission_window(start_date, end_date)
+    except ValueError as e:
+        return f"Invalid mission window: {e}", 400
+
+    data = await main.fs.get_or_create_async(key, main.asteroid_collector.get_async)
+    if data is None:
+        return "", 404
+    if data.get("sbdb") is None:
+        return "", 503
+    data = main.orbit_data(main.asteroid_collector.get_merge(data))
+
+    # The porkchop search is CPU bound, keep it off the event loop
+    return await asyncio.to_thread(design_missions, data, mjd_start, mjd_end), 200
+
+
+async def get_object_impact(key: str, args: dict):
+    lat = float(args.get('lat', 0))
+    lon = float(args.get('lon', 0))
+
+    data = await main.fs.get_or_create_async(key, main.asteroid_collector.get_async)
+    if data is None:
+        return "", 404
+    if data.get("neo") is None:
+        return "", 503
+    neo_data = main.asteroid_collector.get_merge(data)
+
+    impact = await calculate_impact_async(neo_data, lat, lon)
+
+    samples = int(args.get('samples', 0))
+    if samples > 0:
+        impact["uncertainty"] = await asyncio.to_thread(
+            calculate_impact_uncertainty, neo_data, lat, lon, samples, circles=impact["circles"],
+        )
+
+    return impact, 200
+
+
+# Flask endpoint names served by a coroutine on GET
+ASYNC_VIEWS = {
+    "get_object": get_object,
+    "get_missions": get_missions,
+    "get_object_impact": get_object_impact,
+}
+
+
+async def respond(scope, send, view, view_args: dict):
+    # Like request.args.get, the first value of a repeated parameter wins
+    args = {}
+    for name, value in parse_qsl(scope["query_string"].decode("latin-1")):
+        args.setdefault(name, value)
+
+    try:
+        body, status = await view(**view_args, args=args)
+    except Exception:
+        logging.exception(f"Exception on {scope['path']} [GET]")
+        body, status = "Internal Server Error", 500
+
+    if isinstance(body, str):
+        content, content_type = body.encode(), b"text/html; charset=utf-8"
+    else:
+        content, content_type = f"{main.app.json.dumps(body)}\n".encode(), b"application/json"
+
+    headers = [(b"content-type", content_type), (b"content-length", str(len(content)).encode())]
+    origin = dict(scope["headers"]).get(b"origin")
+    if origin is not None and origin.decode("latin-1") in main.CORS_ORIGINS:
+        headers += [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Each worker runs this after it has started, so resources that are not fork safe load here too
+            try:
+                await asyncio.to_thread(Lazy.preload)
+            except Exception as e:
+                logging.exception("Preloading failed")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["method"] == "GET":
+        try:
+            endpoint, view_args = urls.match(scope["path"], method="GET")
+        except HTTPException:
+            endpoint = None
+        view = ASYNC_VIEWS.get(endpoint)
+        if view is not None:
+            return await respond(scope, send, view, view_args)
+
+    await flask_app(scope, receive, send)
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a bounded total size and hit/miss counters.
+
+    ``maxsize`` bounds the sum of ``weigh(value)`` over all entries, so a cache
+    of numpy arrays can be bounded in bytes with ``weigh=lambda a: a.nbytes``.
+    Entries may carry an absolute ``expires_at`` (unix time) after which they
+    are treated as missing.
+    """
+
+    def __init__(self, maxsize: int, weigh: Callable[[object], int] | None = None):
+        self.maxsize = maxsize
+        self.weigh = weigh or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                value, weight, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.size -= weight
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value, expires_at: float | None = None):
+        weight = self.weigh(value)
+        if weight > self.maxsize:
+            return
+
+        with self._lock:
+            if key in self._data:
+                _, old_weight, _ = self._data.pop(key)
+                self.size -= old_weight
+            self._data[key] = (value, weight, expires_at)
+            self.size += weight
+            while self.size > self.maxsize:
+                _, (_, evicted_weight, _) = self._data.popitem(last=False)
+                self.size -= evicted_weight
+                self.evictions += 1
+
+    def get_or_set(self, key: Hashable, func: Callable[[], object]):
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "size": self.size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one.
+
+    The first caller for a key runs ``func``; callers arriving while it is in
+    flight wait for and share its result (or exception).
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], object]):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -1,28 +1,97 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 from .neo import NeoClient
 from .sbdb import SBDBClient
 
 
 class AsteroidCollector:
+    # Seconds to wait for each upstream before serving without it
+    SBDB_TIMEOUT = 10
+    NEO_TIMEOUT = 10
+
+    # Shared across collectors so upstream calls from all request threads are bounded
+    executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="asteroid-collector")
+
     def __init__(self, neo_api_key: str):
         self.neo_client = NeoClient(neo_api_key)
         self.sbdb_client = SBDBClient()
 
-    def get(self, key):
-        sbdb_data = self.sbdb_client.get(key)
-        neo_data = self.neo_client.get(key)
+    @staticmethod
+    def _get_source(client, key, deadline: float):
+        # What is left of the deadline bounds the request and its retries, time queued for a thread included
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        return client.get(key, timeout=remaining)
 
-        return {
-            "sbdb": sbdb_data,
-            "neo": neo_data,
+    def get(self, key):
+        # Fetch both sources concurrently, a slow or failing source only drops its own half
+        started = time.monotonic()
+        futures = {
+            "sbdb": (self.executor.submit(self._get_source, self.sbdb_client, key, started + self.SBDB_TIMEOUT),
+                     self.SBDB_TIMEOUT),
+            "neo": (self.executor.submit(self._get_source, self.neo_client, key, started + self.NEO_TIMEOUT),
+                    self.NEO_TIMEOUT),
         }
 
+        result = {}
+        for source, (future, timeout) in futures.items():
+            try:
+                result[source] = future.result(timeout=max(started + timeout - time.monotonic(), 0))
+            except FutureTimeoutError:
+                logging.warning(f"{source} lookup for {key} timed out after {timeout}s")
+                result[source] = None
+            except Exception:
+                logging.exception(f"{source} lookup for {key} failed")
+                result[source] = None
+
+        if all(value is None for value in result.values()):
+            return None
+        return result
+
+    async def _get_source_async(self, source: str, key: str, coroutine, timeout: float):
+        try:
+            return await asyncio.wait_for(coroutine, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{source} lookup for {key} timed out after {timeout}s")
+        except Exception:
+            logging.exception(f"{source} lookup for {key} failed")
+        return None
+
+    async def get_async(self, key):
+        # Same as get, with both sources awaited on the event loop instead of held by executor threads
+        sbdb, neo = await asyncio.gather(
+            self._get_source_async("sbdb", key, self.sbdb_client.get_async(key), self.SBDB_TIMEOUT),
+            self._get_source_async("neo", key, self.neo_client.get_async(key), self.NEO_TIMEOUT),
+        )
+        if sbdb is None and neo is None:
+            return None
+        return {"sbdb": sbdb, "neo": neo}
+
+    @staticmethod
+    def is_complete(obj: dict) -> bool:
+        return obj is not None and all(value is not None for value in obj.values())
+
     def list(self):
         return self.neo_client.list()
 
+    @property
+    def local_store(self):
+        return self.neo_client.local_store
+
+    def query(self, filters: dict | None = None, sort: str | None = None, descending: bool = False,
+              limit: int | None = None, offset: int = 0):
+        return self.neo_client.query(filters, sort, descending, limit, offset)
+
     @staticmethod
     def get_merge(obj: dict):
         new_obj = {}
         for key, value in obj.items():
-            new_obj.update(value)
+            if value is not None:
+                new_obj.update(value)
 
         return new_obj
@@ -1,42 +1,370 @@
+import asyncio
+import fcntl
 import math
+import os
+import threading
 import time
 import logging
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 
-from google.cloud import firestore
+from cache import LRUCache, SingleFlight
+from lazy import Lazy
+
+
+def _connect():
+    # firestore=0 runs without the persistent cache even where credentials are configured
+    if os.environ.get("firestore", "1") == "0":
+        return None
+
+    # The Firestore client library is slow to import and to authenticate, so both happen on first use
+    from google.cloud import firestore
+
+    try:
+        return firestore.Client()
+    except Exception:
+        logging.warn("Firestore credentials not configured, running without cache")
+        return None
 
 
 class FirestoreMiddleware:
     ASTEROID_COLLECTION = "asteroids"
     TTL = 60 * 60 * 24
+    # Upper bound on how long a payload is served from the in-process cache
+    L1_TTL = 60 * 60
+    # How long an expired payload is served from the in-process cache while it is refreshed
+    STALE_TTL = 60
+    # Refresh-ahead refreshes documents expiring within this margin, at most REFRESH_AHEAD_LIMIT per pass
+    REFRESH_MARGIN = 60 * 60
+    REFRESH_AHEAD_LIMIT = 64
 
-    def __init__(self):
-        try:
-            self.db = firestore.Client()
-            self.enabled = True
-        except Exception:
-            logging.warn("Firestore credentials not configured, running without cache")
-            self.enabled = False
+    def __init__(self, should_store: Callable[[dict], bool] | None = None):
+        # Payloads rejected by should_store (e.g. partial upstream results) are served but not persisted
+        self.should_store = should_store or (lambda payload: payload is not None)
+        self.l1 = LRUCache(maxsize=int(os.environ.get("firestore_cache_size", "1024")))
+        self.flight = SingleFlight()
+        self.firestore_reads = 0
+        self.upstream_fetches = 0
+        self.stale_served = 0
+        self.background_refreshes = 0
+        # Serve expired documents immediately and refresh them in the background
+        self.stale_while_revalidate = os.environ.get("stale_while_revalidate", "1") == "1"
+        self.refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="firestore-refresh")
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        # Loads and background refreshes of the async serving mode, on its event loop
+        self._loading = {}
+        self._background_tasks = set()
+        self._refresh_ahead_lock = None
+        # gRPC channels must not be created before a fork
+        self.client = Lazy("firestore", _connect, fork_safe=False)
+
+    @property
+    def db(self):
+        return self.client.get()
+
+    @property
+    def enabled(self) -> bool:
+        return self.client.get() is not None
 
     def get_or_create(self, key: str, func: Callable[[str], dict]):
-        if not self.enabled:
-            return func(key)
+        payload = self.l1.get(key)
+        if payload is not None:
+            return payload
 
+        # Concurrent misses on the same key share one Firestore read and upstream fetch
+        return self.flight.do(key, lambda: self._load(key, func))
+
+    def _fetch(self, key: str, func: Callable[[str], dict]):
+        self.upstream_fetches += 1
+        return func(key)
+
+    def _remember(self, key: str, payload: dict, expiration: float):
+        if payload is not None:
+            self.l1.set(key, payload, expires_at=min(expiration, time.time() + self.L1_TTL))
+
+    def _read(self, key: str):
+        """
+        Stored payload for key, remembered in the in-process cache, and whether
+        it is a stale one to refresh. (None, False) when it has to be fetched.
+        """
         now = int(time.time())
-        next_expiration = now + self.TTL
         doc_ref = self.db.collection(self.ASTEROID_COLLECTION).document(key)
+        self.firestore_reads += 1
         doc = doc_ref.get()
-        if doc.exists:
-            logging.info(f"Document {key} exists")
-            data = doc.to_dict()
-            if data.get("expiration", math.inf) > now:
-                return doc.get("payload")
-            logging.info(f"Document {key} has expired")
-
-        payload = func(key)
+        if not doc.exists:
+            return None, False
+
+        logging.info(f"Document {key} exists")
+        data = doc.to_dict()
+        expiration = data.get("expiration", math.inf)
+        if expiration > now:
+            payload = doc.get("payload")
+            self._remember(key, payload, expiration)
+            return payload, False
+        logging.info(f"Document {key} has expired")
+
+        if self.stale_while_revalidate:
+            self.stale_served += 1
+            payload = doc.get("payload")
+            self._remember(key, payload, now + self.STALE_TTL)
+            return payload, True
+        return None, False
+
+    def _load(self, key: str, func: Callable[[str], dict]):
+        if not self.enabled:
+            return self.refresh(key, func)
+
+        payload, stale = self._read(key)
+        if stale:
+            self.refresh_in_background(key, func)
+        if payload is not None:
+            return payload
+        return self._store(key, self._fetch(key, func), int(time.time()) + self.TTL)
+
+    def _store(self, key: str, payload: dict, expiration: float):
+        if not self.should_store(payload):
+            return payload
         logging.info(f"Creating document {key}")
-        doc_ref.set({
+        self.db.collection(self.ASTEROID_COLLECTION).document(key).set({
             "payload": payload,
-            "expiration": next_expiration
+            "expiration": expiration
         })
+        self._remember(key, payload, expiration)
         return payload
+
+    def _keep(self, key: str, payload: dict):
+        if self.enabled:
+            return self._store(key, payload, int(time.time()) + self.TTL)
+        if self.should_store(payload):
+            self._remember(key, payload, int(time.time()) + self.TTL)
+        return payload
+
+    def refresh(self, key: str, func: Callable[[str], dict]):
+        return self._keep(key, self._fetch(key, func))
+
+    async def get_or_create_async(self, key: str, func: Callable[[str], Awaitable[dict]]):
+        """get_or_create for the async serving mode, func is a coroutine function and Firestore runs in threads."""
+        payload = self.l1.get(key)
+        if payload is not None:
+            return payload
+
+        # Concurrent misses on the same key await one load
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.ensure_future(self._load_async(key, func))
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load_async(self, key: str, func: Callable[[str], Awaitable[dict]]):
+        if self.enabled:
+            payload, stale = await asyncio.to_thread(self._read, key)
+            if stale:
+                self._refresh_in_background_async(key, func)
+            if payload is not None:
+                return payload
+        return await self.refresh_async(key, func)
+
+    async def refresh_async(self, key: str, func: Callable[[str], Awaitable[dict]]):
+        self.upstream_fetches += 1
+        payload = await func(key)
+        if self.enabled:
+            return await asyncio.to_thread(self._keep, key, payload)
+        return self._keep(key, payload)
+
+    def _refresh_in_background_async(self, key: str, func: Callable[[str], Awaitable[dict]]):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def run():
+            try:
+                self.background_refreshes += 1
+                await self.refresh_async(key, func)
+            except Exception:
+                logging.exception(f"Background refresh of {key} failed")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        # The event loop only keeps weak references to tasks
+        task = asyncio.ensure_future(run())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def refresh_in_background(self, key: str, func: Callable[[str], dict]):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.background_refreshes += 1
+                self.refresh(key, func)
+            except Exception:
+                logging.exception(f"Background refresh of {key} failed")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        self.refresher.submit(run)
+
+    def read_document(self, collection: str, key: str):
+        """Raw document from another collection, or None if missing or Firestore is disabled."""
+        if not self.enabled:
+            return None
+        self.firestore_reads += 1
+        doc = self.db.collection(collection).document(key).get()
+        return doc.to_dict() if doc.exists else None
+
+    def write_document(self, collection: str, key: str, data: dict):
+        if self.enabled:
+            self.db.collection(collection).document(key).set(data)
+
+    # Firestore caps batched writes at 500 operations
+    BATCH_SIZE = 500
+
+    def _read_many(self, keys: list[str]) -> dict:
+        """Raw documents for keys in one get_all round trip per BATCH_SIZE keys; missing keys are left out."""
+        if not self.enabled or not keys:
+            return {}
+        collection = self.db.collection(self.ASTEROID_COLLECTION)
+        documents = {}
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            refs = [collection.document(key) for key in keys[start:start + self.BATCH_SIZE]]
+            self.firestore_reads += 1
+            for doc in self.db.get_all(refs):
+                if doc.exists:
+                    documents[doc.id] = doc.to_dict()
+        return documents
+
+    def get_many(self, keys: Iterable[str], func: Callable[[str], dict] | None = None) -> dict:
+        """
+        Payloads for many keys with one batched Firestore read.
+
+        Keys that are missing (or expired, without stale-while-revalidate) are
+        fetched concurrently with func, if given, and written back with
+        set_many. Fetches share the in-flight loads of get_or_create, so a key
+        is never fetched twice at the same time. Callers bound the number of
+        keys, every missing one is an upstream request.
+        """
+        now = int(time.time())
+        payloads = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            payload = self.l1.get(key)
+            if payload is not None:
+                payloads[key] = payload
+            else:
+                missing.append(key)
+
+        to_fetch = []
+        documents = self._read_many(missing)
+        for key in missing:
+            data = documents.get(key)
+            if data is None:
+                to_fetch.append(key)
+                continue
+            expiration = data.get("expiration", math.inf)
+            if expiration > now:
+                payloads[key] = data["payload"]
+                self._remember(key, data["payload"], expiration)
+            elif self.stale_while_revalidate and func is not None:
+                self.stale_served += 1
+                payloads[key] = data["payload"]
+                self._remember(key, data["payload"], now + self.STALE_TTL)
+                self.refresh_in_background(key, func)
+            else:
+                to_fetch.append(key)
+
+        if func is not None and to_fetch:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                fetched = dict(zip(to_fetch, pool.map(
+                    lambda key: self.flight.do(key, lambda: self._fetch(key, func)), to_fetch,
+                )))
+            self.set_many(fetched)
+            payloads.update(fetched)
+
+        return payloads
+
+    def set_many(self, payloads: dict):
+        """Store many payloads using batched writes."""
+        expiration = int(time.time()) + self.TTL
+        payloads = {key: payload for key, payload in payloads.items() if self.should_store(payload)}
+        for key, payload in payloads.items():
+            self._remember(key, payload, expiration)
+        if not self.enabled:
+            return
+
+        collection = self.db.collection(self.ASTEROID_COLLECTION)
+        items = list(payloads.items())
+        for start in range(0, len(items), self.BATCH_SIZE):
+            batch = self.db.batch()
+            for key, payload in items[start:start + self.BATCH_SIZE]:
+                batch.set(collection.document(key), {"payload": payload, "expiration": expiration})
+            batch.commit()
+
+    def _hold_lock(self, lock_path: str) -> bool:
+        # The lock is kept until the process exits, then another process can take it
+        if self._refresh_ahead_lock is None:
+            lock = open(lock_path, "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                return False
+            self._refresh_ahead_lock = lock
+        return True
+
+    def refresh_ahead_pass(self, keys: list[str], func: Callable[[str], dict]) -> list[str]:
+        """Refresh in the background the keys expiring first within REFRESH_MARGIN, and return them."""
+        deadline = time.time() + self.REFRESH_MARGIN
+        documents = self._read_many(keys)
+        # Missing documents come first
+        expirations = {key: documents[key].get("expiration", math.inf) if key in documents else -math.inf for key in keys}
+        due = sorted((key for key in keys if expirations[key] < deadline), key=expirations.get)
+        due = due[:self.REFRESH_AHEAD_LIMIT]
+        for key in due:
+            self.refresh_in_background(key, func)
+        return due
+
+    def refresh_ahead(self, keys: Iterable[str], func: Callable[[str], dict], interval: float = 15 * 60,
+                      lock_path: str | None = None):
+        """
+        Periodically refresh the stored documents of keys that expire within
+        REFRESH_MARGIN, so those objects never pay upstream latency on a request.
+
+        Only runs with Firestore, keeping the in-process cache of one worker
+        warm is not worth the upstream requests. With lock_path, only the
+        process holding an exclusive lock on that file runs the passes, so
+        preforked workers refresh once between them.
+
+        Runs in a daemon thread. On Cloud Run this needs CPU allocated outside
+        of requests, otherwise the thread is throttled between requests.
+        """
+        keys = list(dict.fromkeys(keys))
+
+        def run():
+            while True:
+                try:
+                    if self.enabled and (lock_path is None or self._hold_lock(lock_path)):
+                        self.refresh_ahead_pass(keys, func)
+                except Exception:
+                    logging.exception("Refresh-ahead pass failed")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="firestore-refresh-ahead", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {
+            **self.l1.stats(),
+            "coalesced": self.flight.coalesced,
+            "firestore_reads": self.firestore_reads,
+            "upstream_fetches": self.upstream_fetches,
+            "stale_served": self.stale_served,
+            "background_refreshes": self.background_refreshes,
+        }
@@ -0,0 +1,162 @@
+import json
+import os
+
+import numpy as np
+
+
+class AsteroidStore:
+    """
+    Columnar, indexed store of the local asteroid list.
+
+    Every field is held as a numpy column, with an id -> row index and a
+    precomputed sort order per sortable field. Filters on the sort field are
+    resolved with a binary search over that order, other filters only look at
+    the rows that survive it, and records are built only for the returned page.
+    """
+
+    NUMERIC_FIELDS = ["max_diameter_km", "closest_miss_km", "relative_velocity_km_s", "absolutemagnitude_h"]
+    STRING_FIELDS = ["id", "name", "closest_approach_date"]
+    SORT_FIELDS = NUMERIC_FIELDS + ["closest_approach_date", "name"]
+    ORBIT_FIELDS = ["a", "e", "i", "raan", "argp", "M0", "epoch"]
+
+    # Query parameter -> (column, comparison)
+    FILTERS = {
+        "min_diameter": ("max_diameter_km", ">="),
+        "max_diameter": ("max_diameter_km", "<="),
+        "min_miss_km": ("closest_miss_km", ">="),
+        "max_miss_km": ("closest_miss_km", "<="),
+        "min_velocity": ("relative_velocity_km_s", ">="),
+        "max_velocity": ("relative_velocity_km_s", "<="),
+        "min_h": ("absolutemagnitude_h", ">="),
+        "max_h": ("absolutemagnitude_h", "<="),
+        "approach_after": ("closest_approach_date", ">="),
+        "approach_before": ("closest_approach_date", "<="),
+    }
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+        self.size = len(columns["id"])
+        self.index = {str(key): row for row, key in enumerate(columns["id"])}
+        self._values = {}
+        self._missing = {}
+        self._sort_values = {}
+        self._orders = {}
+        for field in self.SORT_FIELDS:
+            values = self._sortable(field)
+            self._values[field] = values
+            self._missing[field] = np.isnat(values) if values.dtype.kind == "M" else values != values
+            # NaN/NaT sort last, so the valid values form a prefix of the order
+            self._orders[field] = np.argsort(values, kind="stable")
+            self._sort_values[field] = values[self._orders[field]]
+        self._records = None
+
+    @classmethod
+    def from_records(cls, records: list[dict]):
+        columns = {
+            field: np.array([record.get(field, np.nan) for record in records], dtype=np.float64)
+            for field in cls.NUMERIC_FIELDS
+        }
+        for field in cls.STRING_FIELDS:
+            columns[field] = np.array([str(record.get(field, "")) for record in records])
+        return cls(columns)
+
+    @classmethod
+    def from_json(cls, path: str):
+        with open(path) as f:
+            return cls.from_records(json.load(f))
+
+    @classmethod
+    def from_catalogue(cls, path: str):
+        """Memory-map a catalogue written by ingest.py; path is a version directory or its parent."""
+        latest = os.path.join(path, "LATEST")
+        if os.path.exists(latest):
+            with open(latest) as f:
+                path = os.path.join(path, f.read().strip())
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        return cls({
+            column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+            for column in manifest["columns"]
+        })
+
+    def _sortable(self, field: str) -> np.ndarray:
+        values = self.columns[field]
+        if field == "closest_approach_date":
+            return np.array([value or "NaT" for value in values.tolist()], dtype="datetime64[D]")
+        if field == "name":
+            return values
+        return values.astype(np.float64)
+
+    def _coerce(self, field: str, value):
+        if field == "closest_approach_date":
+            return np.datetime64(value, "D")
+        if field == "name":
+            return str(value)
+        return float(value)
+
+    def orbit_columns(self):
+        """SBDB element columns (AU, deg, TDB JD) of a catalogue built with ingest.py --sbdb, or None."""
+        if any(field not in self.columns for field in self.ORBIT_FIELDS):
+            return None
+        return {field: np.asarray(self.columns[field], dtype=np.float64) for field in self.ORBIT_FIELDS}
+
+    def record(self, row: int) -> dict:
+        record = {field: str(self.columns[field][row]) for field in self.STRING_FIELDS}
+        for field in self.NUMERIC_FIELDS:
+            value = float(self.columns[field][row])
+            record[field] = None if np.isnan(value) else value
+        return record
+
+    def records(self) -> list[dict]:
+        if self._records is None:
+            self._records = [self.record(row) for row in range(self.size)]
+        return self._records
+
+    def get(self, key: str):
+        row = self.index.get(key)
+        return None if row is None else self.record(row)
+
+    def query(self, filters: dict | None = None, sort: str | None = None, descending: bool = False,
+              limit: int | None = None, offset: int = 0) -> list[dict]:
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        unknown = set(filters) - set(self.FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        if sort is not None and sort not in self.SORT_FIELDS:
+            raise ValueError(f"Cannot sort on {sort}")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("limit and offset must not be negative")
+
+        if sort is None:
+            rows = np.arange(self.size)
+        else:
+            # Filters on the sort field narrow the sorted order to a contiguous range
+            values = self._sort_values[sort]
+            lo, hi = 0, self.size
+            for name, value in filters.items():
+                field, comparison = self.FILTERS[name]
+                if field != sort:
+                    continue
+                # Rows with a missing value never match a filter
+                hi = min(hi, self.size - int(self._missing[sort].sum()))
+                value = self._coerce(field, value)
+                if comparison == ">=":
+                    lo = max(lo, int(np.searchsorted(values, value, side="left")))
+                else:
+                    hi = min(hi, int(np.searchsorted(values, value, side="right")))
+            filters = {name: value for name, value in filters.items() if self.FILTERS[name][0] != sort}
+            rows = self._orders[sort][lo:max(lo, hi)]
+
+        for name, value in filters.items():
+            field, comparison = self.FILTERS[name]
+            column = self._values[field][rows]
+            value = self._coerce(field, value)
+            rows = rows[column >= value] if comparison == ">=" else rows[column <= value]
+
+        if sort is not None and descending:
+            # Keep missing values last when reversing
+            missing = self._missing[sort][rows]
+            rows = np.concatenate([rows[~missing][::-1], rows[missing]])
+
+        stop = None if limit is None else offset + limit
+        return [self.record(row) for row in rows[offset:stop].tolist()]
@@ -1,45 +1,131 @@
+import asyncio
+import json
 import logging
-from functools import lru_cache
+import os
+import time
 
-import requests
 from datetime import date
 
 
 import utils
+from cache import LRUCache
+from .transport import get_async_transport, get_transport
 
 
 class MissionDesignClient:
     AU = 149_597_870_700
-    BASE_URL = "https://ssd-api.jpl.nasa.gov/mdesign.api"
+    BASE_URL = os.environ.get("mdesign_url", "https://ssd-api.jpl.nasa.gov/mdesign.api")
+    COLLECTION = "missions"
+    TTL = 60 * 60 * 24 * 7
+    # Widest window (days) kept per object when merging a new query with a cached one
+    MAX_SPAN = 365 * 10
 
-    @lru_cache()
-    def get_from_id(self, key, date_start: date | str, date_end: date | str):
-        date_start = date.fromisoformat(date_start) if isinstance(date_start, str) else date_start
-        date_end = date.fromisoformat(date_end) if isinstance(date_end, str) else date_end
+    def __init__(self, transport=None, store=None, async_transport=None):
+        self.transport = transport
+        self.async_transport = async_transport
+        # Raw selectedMissions for the widest window fetched per object, persisted in store (FirestoreMiddleware)
+        self.store = store
+        self.cache = LRUCache(maxsize=256)
 
-        julian_start_day = utils.modified_julian_day(date_start)
-        julian_end_day = utils.modified_julian_day(date_end)
+    @property
+    def http(self):
+        return self.transport or get_transport()
 
-        span = julian_end_day - julian_start_day
+    @property
+    def async_http(self):
+        return self.async_transport or get_async_transport()
 
-        url = f"{self.BASE_URL}?sstr={key}&mjd0={julian_start_day}&span={span}&step=2&tof-min=10&tof-max={span}"
-        response = requests.get(url)
+    def _cached(self, key: str):
+        entry = self.cache.get(key)
+        if entry is None and self.store is not None:
+            entry = self.store.read_document(self.COLLECTION, key)
+            if entry is not None and entry["expiration"] > time.time():
+                self.cache.set(key, entry, expires_at=entry["expiration"])
+        if entry is None or entry["expiration"] <= time.time():
+            return None
+        return entry
 
+    def _url(self, key: str, mjd_start: int, mjd_end: int) -> str:
+        span = mjd_end - mjd_start
+        return f"{self.BASE_URL}?sstr={key}&mjd0={mjd_start}&span={span}&step=2&tof-min=10&tof-max={span}"
+
+    def _entry(self, response, mjd_start: int, mjd_end: int) -> dict:
         if response.status_code != 200:
             logging.error(f"Error: Mission Design API returned {response.status_code}. Response: {response.json()}")
 
         data = response.json()
-        parsed_missions = [MissionDesignClient.parse_mission(mission) for mission in data["selectedMissions"]]
-        parsed_missions.sort(key=lambda m: m["departure_date"])
         return {
+            "mjd_start": mjd_start,
+            "mjd_end": mjd_end,
             "dv_lowthrust": data["dv_lowthrust"],
-            "missions": [
-                mission for mission in parsed_missions
-                if mission["departure_date"] >= date_start
-                and mission["arrival_date"] <= date_end
-            ],
+            # Firestore can't store nested arrays
+            "missions": json.dumps(data["selectedMissions"]),
+            "expiration": int(time.time()) + self.TTL,
+        }
+
+    def _remember(self, key: str, entry: dict):
+        self.cache.set(key, entry, expires_at=entry["expiration"])
+        if self.store is not None:
+            self.store.write_document(self.COLLECTION, key, entry)
+        return entry
+
+    def _fetch(self, key: str, mjd_start: int, mjd_end: int):
+        response = self.http.get(self._url(key, mjd_start, mjd_end))
+        return self._remember(key, self._entry(response, mjd_start, mjd_end))
+
+    async def _fetch_async(self, key: str, mjd_start: int, mjd_end: int):
+        response = await self.async_http.get(self._url(key, mjd_start, mjd_end))
+        # Firestore calls block, keep them off the event loop
+        return await asyncio.to_thread(self._remember, key, self._entry(response, mjd_start, mjd_end))
+
+    @staticmethod
+    def _days(date_start: date | str, date_end: date | str) -> tuple[int, int]:
+        date_start = date.fromisoformat(date_start) if isinstance(date_start, str) else date_start
+        date_end = date.fromisoformat(date_end) if isinstance(date_end, str) else date_end
+        return utils.modified_julian_day(date_start), utils.modified_julian_day(date_end)
+
+    def _window(self, entry: dict, julian_start_day: int, julian_end_day: int):
+        """Window to fetch, or None when the cached entry covers the query. A cached window is widened up to MAX_SPAN."""
+        if entry is not None and entry["mjd_start"] <= julian_start_day and entry["mjd_end"] >= julian_end_day:
+            return None
+        if entry is not None:
+            wider_start = min(entry["mjd_start"], julian_start_day)
+            wider_end = max(entry["mjd_end"], julian_end_day)
+            if wider_end - wider_start <= self.MAX_SPAN:
+                return wider_start, wider_end
+        return julian_start_day, julian_end_day
+
+    @staticmethod
+    def _select(entry: dict, julian_start_day: int, julian_end_day: int) -> dict:
+        missions = [
+            mission for mission in json.loads(entry["missions"])
+            if mission[0] >= julian_start_day and mission[1] <= julian_end_day
+        ]
+        parsed_missions = [MissionDesignClient.parse_mission(mission) for mission in missions]
+        parsed_missions.sort(key=lambda m: m["departure_date"])
+        return {
+            "dv_lowthrust": entry["dv_lowthrust"],
+            "missions": parsed_missions,
         }
 
+    def get_from_id(self, key, date_start: date | str, date_end: date | str):
+        julian_start_day, julian_end_day = self._days(date_start, date_end)
+
+        # Answer from the cached window when it covers this one
+        entry = self._cached(key)
+        window = self._window(entry, julian_start_day, julian_end_day)
+        if window is not None:
+            entry = self._fetch(key, *window)
+        return self._select(entry, julian_start_day, julian_end_day)
+
+    async def get_from_id_async(self, key, date_start: date | str, date_end: date | str):
+        julian_start_day, julian_end_day = self._days(date_start, date_end)
+
+        entry = await asyncio.to_thread(self._cached, key)
+        window = self._window(entry, julian_start_day, julian_end_day)
+        if window is not None:
+            entry = await self._fetch_async(key, *window)
+        return self._select(entry, julian_start_day, julian_end_day)
 
     @staticmethod
     def parse_mission(mission):
@@ -1,35 +1,56 @@
 import logging
-import json
-from functools import lru_cache
+import os
 
-import requests
+from lazy import Lazy
+from .local_store import AsteroidStore
+from .transport import get_async_transport, get_transport
 
 
 class NeoClient:
-    BASE_URL = "https://api.nasa.gov/neo/rest/v1/"
+    BASE_URL = os.environ.get("neo_url", "https://api.nasa.gov/neo/rest/v1/")
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, transport=None, async_transport=None):
         if api_key is None:
             logging.warning("NeoClient requires a valid API key")
         self.api_key = api_key
-        with open('hazardous_asteroid_list.json') as f:
-            self.local_store = json.load(f)
+        self.transport = transport
+        self.async_transport = async_transport
+        self.store = Lazy("asteroid_store", self._load_store)
 
-    def url(self, path: str = None):
+    @staticmethod
+    def _load_store():
+        # asteroid_catalogue points at a catalogue built by ingest.py, otherwise use the bundled list
+        catalogue = os.environ.get("asteroid_catalogue")
+        if catalogue:
+            return AsteroidStore.from_catalogue(catalogue)
+        return AsteroidStore.from_json('hazardous_asteroid_list.json')
+
+    @property
+    def local_store(self) -> AsteroidStore:
+        return self.store.get()
+
+    @property
+    def http(self):
+        return self.transport or get_transport()
+
+    @property
+    def async_http(self):
+        return self.async_transport or get_async_transport()
+
+    def url(self, path: str | None = None):
         pre = self.BASE_URL
         if path is not None:
             pre = pre + path
         return pre + f"?api_key={self.api_key}"
 
-    @lru_cache()
     def list(self, start_date=None, end_date=None, use_api=False):
         if not use_api:
-            return self.local_store
+            return self.local_store.records()
 
         url = self.url("feed")
         if start_date:
             url = url + f"&start_date={start_date}"
-        response = requests.get(url).json()
+        response = self.http.get(url).json()
         neo = response["near_earth_objects"]
         computed_neo_objects = []
         for _, neo_objects in neo.items():
@@ -41,14 +62,21 @@ class NeoClient:
                 computed_neo_objects.append(neo_object)
         return computed_neo_objects
 
-    @lru_cache()
-    def get(self, key: str):
+    def merge_local(self, key: str, response: dict):
+        local_data = self.local_store.get(key)
+        if local_data is not None:
+            response.update(local_data)
+        return response
+
+    def get(self, key: str, timeout: float | None = None):
+        # Not memoized, callers go through FirestoreMiddleware's in-process cache
         url = self.url(f"neo/{key}")
-        response = requests.get(url).json()
+        return self.merge_local(key, self.http.get(url, timeout=timeout).json())
 
-        for local_data in self.local_store:
-            if local_data["id"] == key:
-                for key, value in local_data.items():
-                    response[key] = value
+    async def get_async(self, key: str):
+        url = self.url(f"neo/{key}")
+        return self.merge_local(key, (await self.async_http.get(url)).json())
 
-        return response
+    def query(self, filters: dict | None = None, sort: str | None = None, descending: bool = False,
+              limit: int | None = None, offset: int = 0):
+        return self.local_store.query(filters, sort, descending, limit, offset)
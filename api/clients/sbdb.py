@@ -1,19 +1,34 @@
-from functools import lru_cache
+import os
 
-import requests
+from .transport import get_async_transport, get_transport
 
 
 class SBDBClient:
-    BASE_URL = "https://ssd-api.jpl.nasa.gov/sbdb.api"
+    BASE_URL = os.environ.get("sbdb_url", "https://ssd-api.jpl.nasa.gov/sbdb.api")
 
-    def __init__(self):
-        pass
+    def __init__(self, transport=None, async_transport=None):
+        self.transport = transport
+        self.async_transport = async_transport
 
-    @lru_cache()
-    def get(self, key: str):
-        url = f"{self.BASE_URL}?sstr={key}"
-        response = requests.get(url).json()
+    @property
+    def http(self):
+        return self.transport or get_transport()
+
+    @property
+    def async_http(self):
+        return self.async_transport or get_async_transport()
+
+    @staticmethod
+    def parse(response: dict):
         if "message" in response and response["message"] == "specified object was not found":
             return None
-
         return response
+
+    def get(self, key: str, timeout: float | None = None):
+        # Not memoized, callers go through FirestoreMiddleware's in-process cache
+        url = f"{self.BASE_URL}?sstr={key}"
+        return self.parse(self.http.get(url, timeout=timeout).json())
+
+    async def get_async(self, key: str):
+        url = f"{self.BASE_URL}?sstr={key}"
+        return self.parse((await self.async_http.get(url)).json())
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import weakref
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker: fails fast after threshold consecutive failures
+    until cooldown seconds have passed, then lets a single probe request
+    through. The circuit closes if the probe succeeds and opens again if it
+    fails; a probe that never reports back is replaced after another cooldown.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._opened_at = {}
+        self._probe_started = {}
+        self._lock = threading.Lock()
+
+    def check(self, host: str):
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return
+            now = time.monotonic()
+            probe_started = self._probe_started.get(host)
+            if now - opened_at < self.cooldown or (probe_started is not None and now - probe_started < self.cooldown):
+                raise CircuitOpenError(f"Circuit open for {host}")
+            # Half-open: this request is the probe, the others keep failing fast until it reports
+            self._probe_started[host] = now
+
+    def record(self, host: str, ok: bool):
+        with self._lock:
+            probing = self._probe_started.pop(host, None) is not None
+            if ok:
+                self._failures[host] = 0
+                if self._opened_at.pop(host, None) is not None:
+                    logging.info(f"Closing circuit for {host}")
+                return
+            if probing:
+                logging.warning(f"Probe of {host} failed, reopening circuit")
+                self._opened_at[host] = time.monotonic()
+                return
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._failures[host] >= self.threshold:
+                logging.warning(f"Opening circuit for {host} after {self._failures[host]} failures")
+                self._opened_at[host] = time.monotonic()
+                self._failures[host] = 0
+
+
+class HttpTransport:
+    """
+    Shared HTTP transport for the upstream API clients.
+
+    One pooled keep-alive session per process, default timeouts, exponential
+    backoff retries on connection errors and 429/5xx and a per-host circuit
+    breaker that fails fast after FAILURE_THRESHOLD consecutive failures until
+    COOLDOWN has passed. A timeout passed to get() bounds the whole call,
+    retries and backoff included, so a caller with a deadline is not held
+    past it.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    FAILURE_THRESHOLD = 5
+    COOLDOWN = 30
+    BACKOFF = 0.5
+
+    def __init__(self, timeout: float | None = None, retries: int | None = None, pool_maxsize: int = 16):
+        self.timeout = timeout if timeout is not None else float(os.environ.get("http_timeout", "10"))
+        self.retries = retries if retries is not None else int(os.environ.get("http_retries", "3"))
+
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.circuit = CircuitBreaker(self.FAILURE_THRESHOLD, self.COOLDOWN)
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.BACKOFF * 2 ** attempt
+
+    def get(self, url: str, params: dict | None = None, timeout: float | None = None) -> requests.Response:
+        host = urlsplit(url).netloc
+        self.circuit.check(host)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        def retry_after(delay: float) -> bool:
+            # Only wait for another attempt that can start before the deadline
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                return False
+            time.sleep(delay)
+            return True
+
+        for attempt in range(self.retries + 1):
+            attempt_timeout = self.timeout
+            if deadline is not None:
+                attempt_timeout = max(min(attempt_timeout, deadline - time.monotonic()), 0.01)
+            try:
+                response = self.session.get(url, params=params, timeout=attempt_timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries or not retry_after(self._backoff(attempt)):
+                    self.circuit.record(host, ok=False)
+                    raise
+                continue
+            except requests.RequestException:
+                self.circuit.record(host, ok=False)
+                raise
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                break
+            if not retry_after(self._backoff(attempt, response)):
+                break
+        self.circuit.record(host, ok=response.status_code not in self.RETRY_STATUSES)
+        return response
+
+
+class AsyncHttpTransport:
+    """
+    HttpTransport for coroutines, used by the async serving mode (asgi.py).
+
+    One httpx connection pool per event loop holds up to max_connections
+    upstream requests in flight. Retries, backoff and the circuit breaker
+    behave as in HttpTransport.
+    """
+
+    RETRY_STATUSES = HttpTransport.RETRY_STATUSES
+    FAILURE_THRESHOLD = HttpTransport.FAILURE_THRESHOLD
+    COOLDOWN = HttpTransport.COOLDOWN
+    BACKOFF = HttpTransport.BACKOFF
+
+    def __init__(self, timeout: float | None = None, retries: int | None = None, max_connections: int | None = None):
+        # httpx is only needed in the async serving mode
+        import httpx
+
+        self.timeout = timeout if timeout is not None else float(os.environ.get("http_timeout", "10"))
+        self.retries = retries if retries is not None else int(os.environ.get("http_retries", "3"))
+        max_connections = max_connections or int(os.environ.get("http_max_connections", "512"))
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=64),
+            timeout=self.timeout,
+        )
+        self.circuit = CircuitBreaker(self.FAILURE_THRESHOLD, self.COOLDOWN)
+
+    _backoff = HttpTransport._backoff
+
+    async def get(self, url: str, params: dict | None = None, timeout: float | None = None):
+        import httpx
+
+        host = urlsplit(url).netloc
+        self.circuit.check(host)
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.get(url, params=params, timeout=timeout or self.timeout)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    self.circuit.record(host, ok=False)
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                break
+            await asyncio.sleep(self._backoff(attempt, response))
+        self.circuit.record(host, ok=response.status_code not in self.RETRY_STATUSES)
+        return response
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code: int = 200, headers: dict | None = None):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    @property
+    def text(self) -> str:
+        return json.dumps(self.payload)
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeTransport:
+    """
+    Offline transport returning canned JSON.
+
+    Routes are matched by the longest URL prefix; every call is recorded in
+    ``calls`` as (url, params). A callable payload is called with (url, params)
+    and may return a FakeResponse to pick the status and headers per call.
+    """
+
+    def __init__(self, routes: dict | None = None):
+        self.routes = {}
+        self.calls = []
+        for prefix, payload in (routes or {}).items():
+            self.add(prefix, payload)
+
+    def add(self, prefix: str, payload, status_code: int = 200):
+        self.routes[prefix] = (payload, status_code)
+
+    def get(self, url: str, params: dict | None = None, timeout: float | None = None) -> FakeResponse:
+        self.calls.append((url, params))
+        matches = [prefix for prefix in self.routes if url.startswith(prefix)]
+        if not matches:
+            return FakeResponse({"message": f"No fake route for {url}"}, 404)
+        payload, status_code = self.routes[max(matches, key=len)]
+        if callable(payload):
+            payload = payload(url, params)
+            if isinstance(payload, FakeResponse):
+                return payload
+        return FakeResponse(payload, status_code)
+
+
+class FakeAsyncTransport(FakeTransport):
+    """FakeTransport for the async clients, optionally answering after latency seconds."""
+
+    def __init__(self, routes: dict | None = None, latency: float = 0):
+        super().__init__(routes)
+        self.latency = latency
+
+    async def get(self, url: str, params: dict | None = None, timeout: float | None = None) -> FakeResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return super().get(url, params, timeout)
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
+
+
+def set_transport(transport):
+    """Replace the shared transport, e.g. with a FakeTransport to run offline."""
+    global _transport
+    _transport = transport
+
+
+# httpx pools are bound to the event loop they were created on
+_async_transports = weakref.WeakKeyDictionary()
+_async_transport = None
+
+
+def get_async_transport():
+    if _async_transport is not None:
+        return _async_transport
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = _async_transports[loop] = AsyncHttpTransport()
+    return transport
+
+
+def set_async_transport(transport):
+    """Replace the async transport of every event loop, e.g. with a FakeAsyncTransport."""
+    global _async_transport
+    _async_transport = transport
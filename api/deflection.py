@@ -0,0 +1,107 @@
+import numpy as np
+
+from cache import LRUCache
+from encounters import AU_KM
+from orbits import EARTH_ELEMENTS, orbit_elements, propagate_kepler_state, state_to_elements
+
+M_S_TO_AU_DAY = 86400 / (AU_KM * 1000)
+
+# Directions of the delta-v in the object's orbital frame at the time of deflection
+DIRECTIONS = ("along-track", "radial", "normal")
+
+# The deflected encounter is searched within SEARCH_DAYS of the nominal one, sampled every SEARCH_STEP days
+SEARCH_DAYS = 10
+SEARCH_STEP = 0.5
+
+# Default sweep, and the largest sweep per axis
+DEFAULT_DV_M_S = np.logspace(-4, -1, 16)
+DEFAULT_LEAD_DAYS = np.linspace(30, 3650, 16)
+MAX_GRID = 128
+
+DEFLECTION_CACHE = LRUCache(maxsize=128)
+
+
+def _closest(elements, epoch0, center):
+    """
+    Closest distance to Earth (AU) and its epoch, near ``center``, for arrays
+    of elements: a sampled scan around center, then bisection on d·v.
+    """
+    earth = orbit_elements(EARTH_ELEMENTS)
+    # Trailing axis for the sampled epochs
+    elements = [np.asarray(x, dtype=np.float64)[..., None] for x in elements]
+    epoch0 = np.asarray(epoch0, dtype=np.float64)[..., None]
+
+    def relative(epochs):
+        r, v = propagate_kepler_state(*elements, epoch0, epochs)
+        r_earth, v_earth = propagate_kepler_state(*earth[:6], earth[6] + earth[7], epochs)
+        return r - r_earth, v - v_earth
+
+    offsets = np.arange(-SEARCH_DAYS, SEARCH_DAYS + SEARCH_STEP / 2, SEARCH_STEP)
+    d, _ = relative(center + offsets)
+    nearest = np.linalg.norm(d, axis=-1).argmin(axis=-1)[..., None]
+
+    # Bracket the sampled minimum by its neighbours, the distance has a single minimum in between
+    lo = center + offsets[np.maximum(nearest - 1, 0)]
+    hi = center + offsets[np.minimum(nearest + 1, len(offsets) - 1)]
+    for _ in range(40):
+        mid = (lo + hi) / 2
+        d, v = relative(mid)
+        falling = (d * v).sum(-1) < 0
+        lo, hi = np.where(falling, mid, lo), np.where(falling, hi, mid)
+
+    epochs = (lo + hi) / 2
+    d, _ = relative(epochs)
+    return np.linalg.norm(d, axis=-1)[..., 0], epochs[..., 0]
+
+
+def deflection_map(data, encounter_jd: float, dv_m_s, lead_days, direction: str = "along-track") -> dict:
+    """
+    Miss distance at an encounter after a delta-v, for every combination of
+    delta-v (m/s, signed) and lead time (days before the encounter).
+
+    Every deflected state is turned back into elements and re-propagated on
+    a two-body orbit, all in one batch; Earth's gravitational focusing is not
+    included. Returns the nominal encounter and (lead, dv) grids in km.
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown direction {direction}, expected one of {', '.join(DIRECTIONS)}")
+    dv = np.asarray(dv_m_s, dtype=np.float64)
+    lead = np.asarray(lead_days, dtype=np.float64)
+    if dv.ndim != 1 or lead.ndim != 1 or not (0 < len(dv) <= MAX_GRID and 0 < len(lead) <= MAX_GRID):
+        raise ValueError(f"Expected between 1 and {MAX_GRID} delta-v and lead time values")
+    if np.any(lead <= 0):
+        raise ValueError("Lead times must be positive")
+
+    elements = orbit_elements(data)
+    key = (elements, float(encounter_jd), tuple(dv.tolist()), tuple(lead.tolist()), direction)
+    result = DEFLECTION_CACHE.get(key)
+    if result is not None:
+        return result
+
+    a, e, i, raan, argp, M0, jd1, jd2 = elements
+    nominal_distance, nominal_jd = _closest((a, e, i, raan, argp, M0), jd1 + jd2, float(encounter_jd))
+
+    # State at every deflection epoch, then the delta-v along the chosen axis
+    deflected_at = nominal_jd - lead
+    r, v = propagate_kepler_state(a, e, i, raan, argp, M0, jd1 + jd2, deflected_at)
+    if direction == "along-track":
+        axis = v
+    elif direction == "radial":
+        axis = r
+    else:
+        axis = np.cross(r, v)
+    axis = axis / np.linalg.norm(axis, axis=-1)[..., None]
+    v_new = v[:, None, :] + (dv * M_S_TO_AU_DAY)[None, :, None] * axis[:, None, :]
+    r_new = np.broadcast_to(r[:, None, :], v_new.shape)
+
+    new_elements = state_to_elements(r_new, v_new)
+    distance, _ = _closest(new_elements, deflected_at[:, None], nominal_jd)
+
+    result = {
+        "nominal_miss_distance_km": float(nominal_distance * AU_KM),
+        "nominal_jd_tdb": float(nominal_jd),
+        "miss_distance_km": distance * AU_KM,
+        "miss_distance_change_km": (distance - nominal_distance) * AU_KM,
+    }
+    DEFLECTION_CACHE.set(key, result)
+    return result
@@ -0,0 +1,69 @@
+import json
+import zlib
+
+import numpy as np
+
+# format query parameter -> little-endian dtype (None for JSON)
+POSITION_FORMATS = {"json": None, "f32": "<f4", "f64": "<f8"}
+
+
+class PositionEncoder:
+    """
+    Encode successive (N, 3) blocks of positions as one response body.
+
+    ``fmt`` is a JSON list of [x, y, z] rows or a packed little-endian
+    float32/float64 buffer in row-major order. With ``delta`` every row after
+    the first holds the difference from the previous row (carried across
+    blocks), which a client undoes with a cumulative sum; deltas are taken in
+    float64 before any narrowing. With ``gzip`` the output is a single gzip
+    stream, compressed block by block.
+    """
+
+    def __init__(self, fmt: str = "json", delta: bool = False, gzip: bool = False):
+        if fmt not in POSITION_FORMATS:
+            raise ValueError(f"Unknown format {fmt}, expected one of {', '.join(POSITION_FORMATS)}")
+        self.dtype = POSITION_FORMATS[fmt]
+        self.delta = delta
+        self._previous = None
+        self._started = False
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    def _pack(self, block: np.ndarray) -> bytes:
+        if self.dtype is not None:
+            return block.astype(self.dtype).tobytes()
+        rows = json.dumps(block.tolist(), separators=(",", ":"))[1:-1]
+        if not rows:
+            return b""
+        prefix = "," if self._started else ""
+        self._started = True
+        return (prefix + rows).encode()
+
+    def encode(self, block: np.ndarray) -> bytes:
+        block = np.asarray(block, dtype=np.float64)
+        if self.delta and len(block):
+            # The very first row stays absolute
+            previous = np.zeros((1, 3)) if self._previous is None else self._previous
+            self._previous = block[-1:]
+            block = np.diff(block, axis=0, prepend=previous)
+        return self._compress(self._pack(block))
+
+    def _compress(self, data: bytes) -> bytes:
+        return data if self._compressor is None else self._compressor.compress(data)
+
+    def header(self) -> bytes:
+        return self._compress(b"[" if self.dtype is None else b"")
+
+    def finish(self) -> bytes:
+        data = self._compress(b"]" if self.dtype is None else b"")
+        if self._compressor is not None:
+            data += self._compressor.flush()
+        return data
+
+    def stream(self, blocks):
+        """Yield the encoded body for an iterable of position blocks."""
+        yield self.header()
+        for block in blocks:
+            data = self.encode(block)
+            if data:
+                yield data
+        yield self.finish()
@@ -0,0 +1,245 @@
+import os
+
+import numpy as np
+
+from cache import LRUCache
+from orbits import ASTROPY, EARTH_ELEMENTS, orbit_elements, perifocal_basis, propagate_kepler_state
+
+AU_KM = 149597870.7
+AU_PER_DAY_KM_S = AU_KM / 86400
+
+# Eccentric anomaly samples per orbit in the coarse MOID scan, and local minima refined per object
+MOID_GRID = 72
+MOID_CANDIDATES = 4
+# Objects per block in moid_many, bounds the (block, grid, grid) distance table
+MOID_BLOCK = 1024
+
+# Sampling step in days of the close-approach scan
+APPROACH_STEP = 1.0
+
+# MOID against Earth per element set (a, e, i, raan, argp), and close approaches per object and window
+MOID_CACHE = LRUCache(maxsize=int(os.environ.get("moid_cache_size", "65536")))
+APPROACH_CACHE = LRUCache(maxsize=256)
+
+
+def _ellipse(a, e, i, raan, argp):
+    # r(E) = A cos(E) + B sin(E) - C for eccentric anomaly E
+    a, e = np.asarray(a, dtype=np.float64), np.asarray(e, dtype=np.float64)
+    P, Q = perifocal_basis(i, raan, argp)
+    b = a * np.sqrt(1 - e**2)
+    return a[..., None] * P, b[..., None] * Q, (a * e)[..., None] * P
+
+
+EARTH_ELLIPSE = _ellipse(*(EARTH_ELEMENTS[name] for name in ("a", "e", "i", "raan", "argp")))
+
+
+def _point(ellipse, E):
+    A, B, C = ellipse
+    return A * np.cos(E)[..., None] + B * np.sin(E)[..., None] - C
+
+
+def _distance(ellipse, other, u, v):
+    return np.sqrt(((_point(ellipse, u) - _point(other, v)) ** 2).sum(-1))
+
+
+def _refine(ellipse, other, u, v, tol=1e-12, max_iter=30):
+    """
+    Newton iterations for a zero of the gradient of the distance between the
+    points at eccentric anomalies u and v. Steps are clipped, and halved
+    until the distance does not grow, so every pair ends at a local minimum.
+    Pairs drop out of the iteration once converged.
+    """
+    f = _distance(ellipse, other, u, v)
+    active = np.arange(len(u))
+
+    for _ in range(max_iter):
+        # A single other orbit (1-D parts) is shared by every pair
+        part_1 = tuple(part[active] for part in ellipse)
+        part_2 = tuple(part if part.ndim == 1 else part[active] for part in other)
+        (A1, B1, C1), (A2, B2, C2) = part_1, part_2
+        u_a, v_a, f_a = u[active], v[active], f[active]
+
+        r1, r2 = _point(part_1, u_a), _point(part_2, v_a)
+        r1_u = B1 * np.cos(u_a)[:, None] - A1 * np.sin(u_a)[:, None]
+        r2_v = B2 * np.cos(v_a)[:, None] - A2 * np.sin(v_a)[:, None]
+        r1_uu, r2_vv = -(r1 + C1), -(r2 + C2)
+        d = r1 - r2
+
+        # Gradient and Hessian of |d|² / 2
+        g_u = (d * r1_u).sum(-1)
+        g_v = -(d * r2_v).sum(-1)
+        h_uu = (r1_u * r1_u).sum(-1) + (d * r1_uu).sum(-1)
+        h_vv = (r2_v * r2_v).sum(-1) - (d * r2_vv).sum(-1)
+        h_uv = -(r1_u * r2_v).sum(-1)
+        det = h_uu * h_vv - h_uv**2
+
+        # Newton where the Hessian is positive definite, a scaled gradient step elsewhere
+        convex = (det > 0) & (h_uu > 0)
+        safe_det = np.where(convex, det, 1.0)
+        scale = np.abs(h_uu) + np.abs(h_vv) + 1e-30
+        step_u = np.where(convex, -(h_vv * g_u - h_uv * g_v) / safe_det, -g_u / scale)
+        step_v = np.where(convex, -(h_uu * g_v - h_uv * g_u) / safe_det, -g_v / scale)
+        clip = np.minimum(1.0, 0.1 / np.maximum(np.hypot(step_u, step_v), 1e-300))
+        step_u, step_v = step_u * clip, step_v * clip
+
+        accepted = np.zeros(len(active), dtype=bool)
+        for _ in range(8):
+            f_new = _distance(part_1, part_2, u_a + step_u, v_a + step_v)
+            better = ~accepted & (f_new <= f_a)
+            u_a, v_a = np.where(better, u_a + step_u, u_a), np.where(better, v_a + step_v, v_a)
+            f_a = np.where(better, f_new, f_a)
+            accepted |= better
+            if accepted.all():
+                break
+            step_u, step_v = np.where(accepted, step_u, step_u / 2), np.where(accepted, step_v, step_v / 2)
+
+        u[active], v[active], f[active] = u_a, v_a, f_a
+        # Converged, or stuck where no shorter step improves the distance
+        active = active[accepted & (np.hypot(step_u, step_v) >= tol)]
+        if not len(active):
+            break
+    return f
+
+
+def _moid_block(ellipse, other):
+    """MOID of a block of N ellipses against one other: a coarse grid scan, then refinement of the best minima."""
+    anomalies = np.linspace(0, 2 * np.pi, MOID_GRID, endpoint=False)
+    r1 = _point(tuple(part[:, None, :] for part in ellipse), anomalies)
+    r2 = _point(other, anomalies)
+    d2 = (r1**2).sum(-1)[:, :, None] + (r2**2).sum(-1)[None, None, :] - 2 * r1 @ r2.T
+
+    # Local minima, along the object's orbit, of its closest distance to the other orbit
+    closest = d2.min(axis=2)
+    partner = d2.argmin(axis=2)
+    is_minimum = (closest <= np.roll(closest, 1, axis=1)) & (closest <= np.roll(closest, -1, axis=1))
+    closest = np.where(is_minimum, closest, np.inf)
+    candidates = np.argsort(closest, axis=1)[:, :MOID_CANDIDATES]
+
+    rows = np.repeat(np.arange(len(closest)), candidates.shape[1])
+    columns = candidates.ravel()
+    distance = _refine(
+        tuple(part[rows] for part in ellipse), other,
+        anomalies[columns], anomalies[partner[rows, columns]],
+    )
+    distance = np.where(np.isfinite(closest[rows, columns]), distance, np.inf)
+    return distance.reshape(len(closest), -1).min(axis=1)
+
+
+def moid_many(a, e, i, raan, argp) -> np.ndarray:
+    """
+    Minimum orbit intersection distance in AU to Earth for arrays of elements
+    (AU and degrees). Open orbits (e >= 1) and missing elements give NaN.
+    """
+    elements = np.stack(np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (a, e, i, raan, argp))), axis=-1)
+    elements = np.atleast_2d(elements)
+    result = np.full(len(elements), np.nan)
+
+    keys = list(map(tuple, elements.tolist()))
+    todo = []
+    for row, key in enumerate(keys):
+        cached = MOID_CACHE.get(key)
+        if cached is not None:
+            result[row] = cached
+        elif np.all(np.isfinite(elements[row])) and 0 <= elements[row, 1] < 1:
+            todo.append(row)
+
+    for first in range(0, len(todo), MOID_BLOCK):
+        rows = np.array(todo[first:first + MOID_BLOCK])
+        result[rows] = _moid_block(_ellipse(*elements[rows].T), EARTH_ELLIPSE)
+        for row in rows.tolist():
+            MOID_CACHE.set(keys[row], float(result[row]))
+
+    return result
+
+
+def moid(data) -> float:
+    """MOID in AU to Earth for an orbit dict as accepted by orbits.orbit_elements."""
+    a, e, i, raan, argp = orbit_elements(data)[:5]
+    return float(moid_many(a, e, i, raan, argp)[0])
+
+
+def close_approaches(data, start, days=3650, max_au=0.2) -> list[dict]:
+    """
+    Close approaches to Earth within ``days`` of ``start``, closer than ``max_au``.
+
+    Relative distance is sampled every APPROACH_STEP days and every minimum is
+    refined by bisection on the sign of d·v (the derivative of the squared
+    distance). Both bodies are on unperturbed two-body orbits, so results are
+    indicative and drift for encounters decades away or very deep ones.
+    """
+    elements = orbit_elements(data)
+    key = (elements, start, float(days), float(max_au))
+    approaches = APPROACH_CACHE.get(key)
+    if approaches is not None:
+        return approaches
+
+    a, e, i, raan, argp, M0, jd1, jd2 = elements
+    earth = orbit_elements(EARTH_ELEMENTS)
+    _, Time = ASTROPY.get()
+    start_jd = Time(start, scale="tdb").jd
+
+    def relative(epochs):
+        r, v = propagate_kepler_state(a, e, i, raan, argp, M0, jd1 + jd2, epochs)
+        r_earth, v_earth = propagate_kepler_state(*earth[:6], earth[6] + earth[7], epochs)
+        return r - r_earth, v - v_earth
+
+    epochs = start_jd + np.arange(0, days + APPROACH_STEP, APPROACH_STEP)
+    d, v = relative(epochs)
+    rate = (d * v).sum(-1)
+
+    # The distance has a minimum wherever d·v turns from negative to positive
+    lo = epochs[:-1][(rate[:-1] < 0) & (rate[1:] >= 0)]
+    hi = lo + APPROACH_STEP
+    for _ in range(40):
+        mid = (lo + hi) / 2
+        d, v = relative(mid)
+        falling = (d * v).sum(-1) < 0
+        lo, hi = np.where(falling, mid, lo), np.where(falling, hi, mid)
+
+    epochs = (lo + hi) / 2
+    d, v = relative(epochs)
+    distance = np.linalg.norm(d, axis=-1)
+    speed = np.linalg.norm(v, axis=-1)
+    close = distance <= max_au
+
+    approaches = []
+    if close.any():
+        dates = Time(epochs[close], format="jd", scale="tdb").utc.isot
+        for epoch, date, distance_au, speed_au in zip(epochs[close], dates, distance[close], speed[close]):
+            approaches.append({
+                "date": str(date)[:19],
+                "jd_tdb": float(epoch),
+                "distance_au": float(distance_au),
+                "distance_km": float(distance_au * AU_KM),
+                "relative_velocity_km_s": float(speed_au * AU_PER_DAY_KM_S),
+            })
+
+    APPROACH_CACHE.set(key, approaches)
+    return approaches
+
+
+def rank_by_moid(store, limit: int | None = None, max_au: float | None = None):
+    """
+    Records of a catalogue with orbital elements (ingest.py --sbdb), with
+    ``moid_au``/``moid_km`` added, closest first. None if the store has no
+    element columns.
+    """
+    if limit is not None and limit < 0:
+        raise ValueError("limit must be non-negative")
+    columns = store.orbit_columns()
+    if columns is None:
+        return None
+
+    moids = moid_many(*(columns[name] for name in ("a", "e", "i", "raan", "argp")))
+    rows = np.flatnonzero(~np.isnan(moids))
+    if max_au is not None:
+        rows = rows[moids[rows] <= max_au]
+    rows = rows[np.argsort(moids[rows], kind="stable")][:limit]
+
+    ranked = []
+    for row in rows.tolist():
+        record = store.record(row)
+        record["moid_au"] = float(moids[row])
+        record["moid_km"] = float(moids[row] * AU_KM)
+        ranked.append(record)
+    return ranked
@@ -0,0 +1,42 @@
+"""
+Production server settings: gunicorn --config gunicorn.conf.py main:app
+
+The app is imported once in the master with every dataset preloaded (the
+asteroid store, land index, Earth ephemeris and population raster are numpy
+arrays, memory maps or GEOS geometries), then workers are forked and share
+those pages copy-on-write. gc.freeze() moves everything allocated up to the
+fork out of the collector's reach, so collections in a worker don't write
+to (and thereby copy) the shared pages.
+"""
+import gc
+import os
+
+# Read by main.py: load every Lazy resource at import, and start background threads per worker
+# (refresh-ahead only does its passes in the worker holding its lock)
+os.environ.setdefault("preload", "1")
+os.environ["preload_app"] = "1"
+
+bind = f":{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("workers", os.cpu_count() or 1))
+threads = int(os.environ.get("threads", "4"))
+worker_class = "gthread"
+preload_app = True
+
+# gthread workers heartbeat from their main loop, so long or streamed requests don't trip this
+timeout = int(os.environ.get("worker_timeout", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    # Called in the master after the app is loaded and before the first fork
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import main
+    from lazy import Lazy
+
+    if os.environ.get("preload") == "1":
+        Lazy.preload()
+    main.start_background_tasks()
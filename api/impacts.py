@@ -1,15 +1,82 @@
-import geopandas as gpd
+import os
+
 import math
-from shapely.geometry import Point
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+from lazy import Lazy
+
+from population import POPULATION_RASTER, get_population_many, get_population_rings, get_population_rings_async
+
+# Bulk density (kg/m³) of every impactor until it is derived from the spectral type
+DENSITY = 3000
+# Monte Carlo impact model: bulk density range (kg/m³) with the deterministic
+# DENSITY as mode, and relative 1-sigma spread of the impact velocity. Neither
+# NeoWs nor the SBDB object data give an uncertainty of the relative velocity,
+# the spread stands for the entry geometry rather than for the orbit.
+DENSITY_RANGE = (1500, DENSITY, 5000)
+VELOCITY_SIGMA = 0.05
+MAX_SAMPLES = 1_000_000
+# NeoWs diameter bounds assume albedos of 0.25 and 0.05, so the maximum is sqrt(5) times the minimum
+DIAMETER_SPREAD = math.sqrt(5)
+# Smallest diameter (m) sampled, below it the estimates are not physical
+MIN_DIAMETER = 1.0
+# Heavy-damage radii the local raster is queried at for the casualty spread
+CASUALTY_RADII = 8
+# Most scenarios or impact points in one batch request
+MAX_BATCH_SIZE = 10_000
+UNCERTAINTY_FIELDS = [
+    "energy_megaton",
+    "radius_extreme_km",
+    "radius_heavy_km",
+    "radius_medium_km",
+    "radius_light_km",
+    "thermal_radius_third_deg_km",
+    "crater_radius",
+]
+
+
+class LandIndex:
+    """
+    Point-in-land lookup over a Natural Earth land shapefile.
+
+    Polygons are prepared and indexed in an STRtree once, so each lookup only
+    runs the exact containment test against polygons whose bounding box
+    contains the point. Works the same for the 110m and 10m land files.
+    """
 
-from population import get_population_worldpop
+    def __init__(self, path):
+        # geopandas is only needed to read the shapefile
+        import geopandas as gpd
 
-LAND_DATA = gpd.read_file("ne_110m_land.shp")
+        self.geometries = gpd.read_file(path).geometry.values.to_numpy()
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def contains_many(self, lats, lons):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        points = shapely.points(lons.ravel(), lats.ravel())
+
+        point_idx, geom_idx = self.tree.query(points)
+        hit = shapely.contains(self.geometries[geom_idx], points[point_idx])
+
+        on_land = np.zeros(points.shape, dtype=bool)
+        on_land[point_idx[hit]] = True
+        return on_land.reshape(lats.shape)
+
+
+# Set land_data=ne_10m_land.shp to use the higher resolution coastline
+LAND_INDEX = Lazy("land_index", lambda: LandIndex(os.environ.get("land_data", "ne_110m_land.shp")))
 
 
 def is_on_land(lat, lon):
-    point = Point(lon, lat)
-    return LAND_DATA.contains(point).any()
+    return bool(LAND_INDEX.get().contains_many(lat, lon))
+
+
+def is_on_land_many(lats, lons):
+    return LAND_INDEX.get().contains_many(lats, lons)
 
 
 def get_feasibility(diameter):
@@ -26,6 +93,7 @@ def get_feasibility(diameter):
 
 
 def simulate_impact(diameter, density, velocity):
+    """Impact effects for scalars or NumPy arrays of diameter (m), density (kg/m³) and velocity (km/s)."""
     radius = diameter / 2
     volume = (4/3) * 3.1415 * radius**3
     mass = density * volume
@@ -49,7 +117,7 @@ def simulate_impact(diameter, density, velocity):
     Fwood = 1_464_400.0  # dry wood ignites (~35 cal/cm²)
 
     def r_for_fluence(F):
-        return math.sqrt(E_th / (4 * math.pi * F)) / 1000.0
+        return np.sqrt(E_th / (4 * math.pi * F)) / 1000.0
 
     r_th_1deg = r_for_fluence(F1)
     r_th_2deg = r_for_fluence(F2)
@@ -76,21 +144,28 @@ def simulate_impact(diameter, density, velocity):
     }
 
 
-def calculate_impact(data, lat, lon):
+def impact_parameters(data):
+    """Diameter (m), density (kg/m³) and velocity (km/s) of the impactor described by merged NEO data."""
     diameter = float(data["estimated_diameter"]["meters"]["estimated_diameter_max"])
     velocity = float(data["relative_velocity_km_s"])
-    density = 3000  # TODO
+    return diameter, DENSITY, velocity
+
+
+def _check_batch_size(size):
+    if size > MAX_BATCH_SIZE:
+        raise ValueError(f"at most {MAX_BATCH_SIZE} scenarios per batch, got {size}")
+
+
+def _impact_circles(data, lat, lon):
+    diameter, density, velocity = impact_parameters(data)
     on_land = is_on_land(lat, lon)
 
     calculations = simulate_impact(diameter, density, velocity)
-    energy_megaton = calculations["energy_megaton"]
     radius_extreme_km = calculations["radius_extreme_km"]
     radius_heavy_km = calculations["radius_heavy_km"]
     radius_medium_km = calculations["radius_medium_km"]
     radius_light_km = calculations["radius_light_km"]
 
-    population = get_population_worldpop(lon, lat, radius_heavy_km * 1000)
-
     circles = []
 
     circles.append({"lat": lat, "lon": lon, "radius": radius_light_km * 1000, "note": "Low impact", "color": "green"})
@@ -101,9 +176,145 @@ def calculate_impact(data, lat, lon):
         circles.append(
             {"lat": lat, "lon": lon, "radius": radius_extreme_km * 1000, "note": "Asteroid impact", "color": "red"})
 
+    return circles, calculations["energy_megaton"]
+
+
+def _impact_result(circles, energy_megaton, population):
+    # Circles are ordered from largest to smallest, population lookups want them sorted ascending
+    for circle, cumulative, ring in zip(reversed(circles), population["cumulative"], population["rings"]):
+        circle["casualties"] = cumulative
+        circle["casualties_ring"] = ring
+
     return {
-        "casualties": population,
+        "casualties": circles[2]["casualties"],
         "other": "You should probably take cover",
         "circles": circles,
         "energy_megaton": energy_megaton,
     }
+
+
+def calculate_impact(data, lat, lon):
+    circles, energy_megaton = _impact_circles(data, lat, lon)
+    population = get_population_rings(lon, lat, [circle["radius"] for circle in reversed(circles)])
+    return _impact_result(circles, energy_megaton, population)
+
+
+async def calculate_impact_async(data, lat, lon):
+    """calculate_impact, awaiting the population lookup (WorldPop) instead of blocking on it."""
+    circles, energy_megaton = _impact_circles(data, lat, lon)
+    population = await get_population_rings_async(lon, lat, [circle["radius"] for circle in reversed(circles)])
+    return _impact_result(circles, energy_megaton, population)
+
+
+def simulate_impact_batch(diameter, density, velocity):
+    """Columnar simulate_impact over broadcastable sequences of scenarios."""
+    diameter, density, velocity = np.broadcast_arrays(
+        np.asarray(diameter, dtype=np.float64),
+        np.asarray(density, dtype=np.float64),
+        np.asarray(velocity, dtype=np.float64),
+    )
+    _check_batch_size(diameter.size)
+    calculations = simulate_impact(diameter, density, velocity)
+    return {key: np.asarray(value).tolist() for key, value in calculations.items()}
+
+
+def calculate_impact_batch(data, lats, lons, population=False):
+    """
+    calculate_impact for one object over many impact points, returned as columns.
+
+    Casualties (population=True) come from one batched lookup in the local
+    population raster, get_population_many raises RuntimeError without one.
+    """
+    diameter, density, velocity = impact_parameters(data)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.ndim != 1 or lats.shape != lons.shape:
+        raise ValueError("lat and lon must be lists of the same length")
+    _check_batch_size(lats.size)
+
+    calculations = simulate_impact(diameter, density, velocity)
+    result = {
+        "lat": lats.tolist(),
+        "lon": lons.tolist(),
+        "on_land": is_on_land_many(lats, lons).tolist(),
+        "energy_megaton": calculations["energy_megaton"],
+        "radius_extreme_km": calculations["radius_extreme_km"],
+        "radius_heavy_km": calculations["radius_heavy_km"],
+        "radius_medium_km": calculations["radius_medium_km"],
+        "radius_light_km": calculations["radius_light_km"],
+    }
+    if population:
+        result["casualties"] = get_population_many(lons, lats, calculations["radius_heavy_km"] * 1000).tolist()
+    return result
+
+
+def _interpolate_casualties(radius_m, radii, cumulative):
+    # Log-radius interpolation between sorted rings, scaled with the area below the smallest one
+    radii = np.asarray(radii, dtype=np.float64)
+    cumulative = np.asarray(cumulative, dtype=np.float64)
+    casualties = np.interp(np.log(np.maximum(radius_m, radii[0])), np.log(radii), cumulative)
+    return np.where(radius_m < radii[0], cumulative[0] * (radius_m / radii[0]) ** 2, casualties)
+
+
+def calculate_impact_uncertainty(data, lat, lon, samples, seed=None, circles=None):
+    """
+    Monte Carlo spread of the impact outcome for ``samples`` draws.
+
+    Diameter is drawn log-uniformly between the NEO min/max estimates, density
+    from a triangular distribution over DENSITY_RANGE and velocity from a normal
+    distribution around the relative velocity. All draws are evaluated at once
+    through simulate_impact.
+
+    Casualties are interpolated from population rings. With the local raster
+    these span the sampled heavy-damage radii. Otherwise every ring would be
+    another WorldPop task, so the rings already looked up for the impact
+    ``circles`` (from calculate_impact) are reused, and radii beyond the
+    largest circle are clamped to it.
+    """
+    samples = min(int(samples), MAX_SAMPLES)
+    rng = np.random.default_rng(seed)
+    diameters = data["estimated_diameter"]["meters"]
+    d_max = max(float(diameters["estimated_diameter_max"]), MIN_DIAMETER)
+    d_min = float(diameters.get("estimated_diameter_min", 0))
+    # A missing or zero lower bound would be log(0)
+    if not MIN_DIAMETER <= d_min <= d_max:
+        d_min = max(d_max / DIAMETER_SPREAD, MIN_DIAMETER)
+    velocity = float(data["relative_velocity_km_s"])
+
+    diameter = np.exp(rng.uniform(np.log(d_min), np.log(d_max), samples))
+    density = rng.triangular(*DENSITY_RANGE, samples)
+    velocity = np.abs(rng.normal(velocity, velocity * VELOCITY_SIGMA, samples))
+
+    calculations = simulate_impact(diameter, density, velocity)
+
+    percentiles = [5, 50, 95]
+    result = {"samples": samples}
+    for field in UNCERTAINTY_FIELDS:
+        p5, p50, p95 = np.percentile(calculations[field], percentiles)
+        result[field] = {"p5": p5, "p50": p50, "p95": p95}
+
+    radius_heavy_m = calculations["radius_heavy_km"] * 1000
+    if POPULATION_RASTER.get() is not None:
+        radii = np.geomspace(radius_heavy_m.min(), radius_heavy_m.max(), CASUALTY_RADII)
+        population = get_population_rings(lon, lat, radii.tolist())["cumulative"]
+    else:
+        if circles is None:
+            circles = calculate_impact(data, lat, lon)["circles"]
+        radii = [circle["radius"] for circle in reversed(circles)]
+        population = [circle["casualties"] for circle in reversed(circles)]
+    casualties = _interpolate_casualties(radius_heavy_m, radii, population)
+    p5, p50, p95 = np.percentile(casualties, percentiles)
+    result["casualties"] = {"p5": p5, "p50": p50, "p95": p95}
+
+    return result
+
+
+def calculate_casualty_grid(data, lats, lons):
+    """Casualties within the heavy-impact radius and the land mask for every point of a lat/lon grid."""
+    diameter, density, velocity = impact_parameters(data)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    calculations = simulate_impact(diameter, density, velocity)
+    casualties = get_population_many(lons, lats, calculations["radius_heavy_km"] * 1000)
+    return casualties.reshape(lats.shape), is_on_land_many(lats, lons)
@@ -0,0 +1,284 @@
+"""
+Catalogue ingestion: python ingest.py <out_dir> [options]
+
+Streams NEO browse (or feed) pages and, optionally, SBDB orbital elements,
+keeps one row per object in an append-only state file so an interrupted run
+resumes where it stopped, and finally writes a versioned columnar catalogue
+that AsteroidStore.from_catalogue memory-maps at startup.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from clients.local_store import AsteroidStore
+from clients.neo import NeoClient
+from clients.sbdb import SBDBClient
+from clients.transport import get_transport
+
+# Same endpoints as the API clients, including the neo_url/sbdb_url overrides
+NEO_URL = NeoClient.BASE_URL
+SBDB_URL = SBDBClient.BASE_URL
+
+# SBDB element name -> catalogue column
+ELEMENT_COLUMNS = {"e": "e", "a": "a", "i": "i", "om": "raan", "w": "argp", "ma": "M0"}
+ORBIT_COLUMNS = list(ELEMENT_COLUMNS.values()) + ["epoch"]
+
+
+class RateLimiter:
+    """Spaces requests at least ``interval`` seconds apart across threads, and backs off when the quota runs low."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._next - now, 0)
+            self._next = max(self._next, now) + self.interval
+        if delay:
+            time.sleep(delay)
+
+    def observe(self, response):
+        remaining = getattr(response, "headers", {}).get("X-RateLimit-Remaining")
+        if remaining is not None and int(remaining) < 50:
+            # Spread what is left of the hourly quota over the rest of the hour
+            with self._lock:
+                self.interval = max(self.interval, 3600 / max(int(remaining), 1))
+
+
+def closest_earth_approach(neo_object: dict, since: str | None = None):
+    """
+    Closest of the Earth approaches, only those on or after the ISO date
+    ``since`` if given. Browse returns an object's whole approach history,
+    centuries of it, so without a cutoff this can be long past.
+    """
+    approaches = [
+        event for event in neo_object.get("close_approach_data", [])
+        if event["orbiting_body"] == "Earth" and (since is None or event["close_approach_date"] >= since)
+    ]
+    if not approaches:
+        return None
+    return min(approaches, key=lambda event: float(event["miss_distance"]["kilometers"]))
+
+
+def to_record(neo_object: dict, since: str | None = None):
+    closest = closest_earth_approach(neo_object, since)
+    if closest is None:
+        return None
+    return {
+        "id": neo_object["id"],
+        "name": neo_object["name"],
+        "absolutemagnitude_h": float(neo_object["absolute_magnitude_h"]),
+        "max_diameter_km": float(neo_object["estimated_diameter"]["meters"]["estimated_diameter_max"]),
+        "closest_approach_date": closest["close_approach_date"],
+        "closest_miss_km": float(closest["miss_distance"]["kilometers"]),
+        "relative_velocity_km_s": float(closest["relative_velocity"]["kilometers_per_second"]),
+    }
+
+
+class Ingestion:
+    def __init__(self, out_dir: str, api_key: str, hazardous_only=True, with_sbdb=False,
+                 workers=4, interval=0.5, since: date | None = None):
+        self.out_dir = out_dir
+        # Browsed objects are listed with their closest Earth approach from this date on
+        self.since = (since or date.today()).isoformat()
+        self.api_key = api_key
+        self.hazardous_only = hazardous_only
+        self.with_sbdb = with_sbdb
+        self.workers = workers
+        self.limiter = RateLimiter(interval)
+        self.http = get_transport()
+
+        self.state_dir = os.path.join(out_dir, "state")
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.records_path = os.path.join(self.state_dir, "records.jsonl")
+        self.progress_path = os.path.join(self.state_dir, "progress.json")
+
+        # Only ids are kept in memory, records are streamed to records.jsonl
+        self.seen = set()
+        if os.path.exists(self.records_path):
+            with open(self.records_path) as f:
+                for line in f:
+                    self.seen.add(json.loads(line)["id"])
+        self.progress = {}
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                self.progress = json.load(f)
+
+    def _get(self, url: str, params: dict | None = None):
+        self.limiter.wait()
+        response = self.http.get(url, params=params)
+        self.limiter.observe(response)
+        response.raise_for_status()
+        return response.json()
+
+    def _save_progress(self, **progress):
+        self.progress.update(progress)
+        tmp = self.progress_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.progress, f)
+        os.replace(tmp, self.progress_path)
+
+    def _sbdb_elements(self, key: str) -> dict:
+        data = self._get(SBDB_URL, {"sstr": key})
+        orbit = data.get("orbit")
+        if orbit is None:
+            return {}
+        elements = {element["name"]: element["value"] for element in orbit["elements"]}
+        row = {column: float(elements[name]) for name, column in ELEMENT_COLUMNS.items() if name in elements}
+        row["epoch"] = float(orbit["epoch"])
+        return row
+
+    def _append(self, neo_objects: list[dict], pool: ThreadPoolExecutor, since: str | None = None):
+        records = []
+        for neo_object in neo_objects:
+            if neo_object["id"] in self.seen:
+                continue
+            if self.hazardous_only and not neo_object.get("is_potentially_hazardous_asteroid", False):
+                continue
+            record = to_record(neo_object, since)
+            if record is not None:
+                records.append(record)
+
+        if self.with_sbdb and records:
+            for record, elements in zip(records, pool.map(lambda r: self._sbdb_elements(r["id"]), records)):
+                record.update(elements)
+
+        with open(self.records_path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+                self.seen.add(record["id"])
+        return len(records)
+
+    def browse(self, max_pages: int | None = None, size: int = 20):
+        page = self.progress.get("next_page", 0)
+        total_pages = self.progress.get("total_pages")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            last_page = min(total_pages or max_pages or float("inf"), max_pages or float("inf"))
+            while page < last_page:
+                # Fetch a window of pages concurrently, then commit them in order
+                pages = range(page, int(min(page + self.workers, last_page)))
+                results = list(pool.map(
+                    lambda p: self._get(f"{NEO_URL}neo/browse", {"page": p, "size": size, "api_key": self.api_key}),
+                    pages,
+                ))
+                for result in results:
+                    total_pages = result["page"]["total_pages"]
+                    last_page = min(total_pages, max_pages or total_pages)
+                    added = self._append(result["near_earth_objects"], pool, since=self.since)
+                    page += 1
+                    self._save_progress(next_page=page, total_pages=total_pages)
+                    logging.info(f"Page {page}/{total_pages}: {added} new, {len(self.seen)} total")
+
+    def feed(self, start: date, weeks: int):
+        # A resumed run continues from the week it stopped at, relative to the original start date
+        start = date.fromisoformat(self.progress.get("feed_start", start.isoformat()))
+        self._save_progress(feed_start=start.isoformat())
+        done = self.progress.get("feed_weeks_done", 0)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for week in range(done, weeks):
+                week_start = start + timedelta(days=7 * week)
+                result = self._get(f"{NEO_URL}feed", {
+                    "start_date": week_start.isoformat(),
+                    "end_date": (week_start + timedelta(days=6)).isoformat(),
+                    "api_key": self.api_key,
+                })
+                neo_objects = [obj for objects in result["near_earth_objects"].values() for obj in objects]
+                # Feed objects only carry their approaches within the requested week
+                added = self._append(neo_objects, pool)
+                self._save_progress(feed_weeks_done=week + 1)
+                logging.info(f"Week of {week_start}: {added} new, {len(self.seen)} total")
+
+    def write_catalogue(self, json_path: str | None = None) -> str:
+        """Write records.jsonl as a new catalogue version, streaming rows into memory-mapped columns."""
+        count = 0
+        widths = {field: 1 for field in AsteroidStore.STRING_FIELDS}
+        with open(self.records_path) as f:
+            for line in f:
+                record = json.loads(line)
+                count += 1
+                for field in widths:
+                    widths[field] = max(widths[field], len(str(record.get(field, ""))))
+
+        version = datetime.now().strftime("%Y%m%d%H%M%S")
+        version_dir = os.path.join(self.out_dir, version)
+        os.makedirs(version_dir)
+
+        numeric_fields = AsteroidStore.NUMERIC_FIELDS + (ORBIT_COLUMNS if self.with_sbdb else [])
+        dtypes = {field: np.dtype(np.float64) for field in numeric_fields}
+        dtypes.update({field: np.dtype(f"<U{width}") for field, width in widths.items()})
+        columns = {
+            field: np.lib.format.open_memmap(os.path.join(version_dir, f"{field}.npy"), mode="w+",
+                                             dtype=dtype, shape=(count,))
+            for field, dtype in dtypes.items()
+        }
+
+        with open(self.records_path) as f:
+            for row, line in enumerate(f):
+                record = json.loads(line)
+                for field, column in columns.items():
+                    default = "" if field in widths else np.nan
+                    column[row] = record.get(field, default)
+        for column in columns.values():
+            column.flush()
+
+        with open(os.path.join(version_dir, "manifest.json"), "w") as f:
+            json.dump({"version": version, "count": count, "columns": list(columns)}, f)
+        with open(os.path.join(self.out_dir, "LATEST"), "w") as f:
+            f.write(version)
+
+        if json_path is not None:
+            # Also refresh the legacy hazardous_asteroid_list.json format
+            with open(self.records_path) as f, open(json_path, "w") as out:
+                json.dump([
+                    {field: record[field] for field in AsteroidStore.STRING_FIELDS + AsteroidStore.NUMERIC_FIELDS}
+                    for record in map(json.loads, f)
+                ], out)
+
+        return version_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local asteroid catalogue from NEO and SBDB")
+    parser.add_argument("out_dir")
+    parser.add_argument("--source", choices=["browse", "feed"], default="browse")
+    parser.add_argument("--max-pages", type=int, default=None)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--weeks", type=int, default=100)
+    parser.add_argument("--since", type=date.fromisoformat, default=None,
+                        help="Browse: list the closest approach from this date on (default today)")
+    parser.add_argument("--all", action="store_true", help="Include non-hazardous objects")
+    parser.add_argument("--sbdb", action="store_true", help="Add SBDB orbital elements")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--interval", type=float, default=0.5, help="Minimum seconds between requests")
+    parser.add_argument("--json", default=None, help="Also write the list as JSON to this path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ingestion = Ingestion(
+        args.out_dir,
+        os.environ.get("neo_api_key", "DEMO_KEY"),
+        hazardous_only=not args.all,
+        with_sbdb=args.sbdb,
+        workers=args.workers,
+        interval=args.interval,
+        since=args.since,
+    )
+    if args.source == "browse":
+        ingestion.browse(max_pages=args.max_pages)
+    else:
+        ingestion.feed(args.start_date, args.weeks)
+    print(ingestion.write_catalogue(args.json))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+
+
+class Lazy:
+    """
+    Heavy dependency or dataset that is loaded on first use.
+
+    Every instance is registered by name, so the readiness endpoint can report
+    what has been loaded (and how long it took), and preload() can warm all of
+    them before serving traffic. Resources holding connections are not
+    ``fork_safe`` and are left for each worker when preloading before a fork.
+    """
+
+    registry: dict[str, "Lazy"] = {}
+
+    def __init__(self, name: str, loader: Callable[[], object], fork_safe: bool = True):
+        self.name = name
+        self.loader = loader
+        self.fork_safe = fork_safe
+        self.loaded = False
+        self.load_seconds = None
+        self._value = None
+        self._lock = threading.Lock()
+        Lazy.registry[name] = self
+
+    def get(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    started = time.perf_counter()
+                    self._value = self.loader()
+                    self.load_seconds = time.perf_counter() - started
+                    self.loaded = True
+                    logging.info(f"Loaded {self.name} in {self.load_seconds:.3f}s")
+        return self._value
+
+    @classmethod
+    def status(cls) -> dict:
+        return {
+            name: {"loaded": lazy.loaded, "load_seconds": lazy.load_seconds}
+            for name, lazy in cls.registry.items()
+        }
+
+    @classmethod
+    def preload(cls, fork_safe_only: bool = False):
+        for lazy in list(cls.registry.values()):
+            if lazy.fork_safe or not fork_safe_only:
+                lazy.get()
+
+
+def process_uptime():
+    """Seconds since this process started, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
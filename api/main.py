@@ -1,17 +1,36 @@
+import itertools
+import json
+import logging
 import os
+import tempfile
 from datetime import date, datetime
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 
-from impacts import calculate_impact, get_feasibility
+from cache import LRUCache
+from impacts import (
+    DENSITY,
+    calculate_casualty_grid,
+    calculate_impact,
+    calculate_impact_batch,
+    calculate_impact_uncertainty,
+    get_feasibility,
+    simulate_impact_batch,
+)
 from clients.firestore import FirestoreMiddleware
 from clients.asteroid_collector import AsteroidCollector
+from clients.local_store import AsteroidStore
 from clients.mission_design import MissionDesignClient
-from orbits import compute_earth_orbit, compute_orbit
-import astropy.units as u
-from astropy.time import Time
+from deflection import DEFAULT_DV_M_S, DEFAULT_LEAD_DAYS, deflection_map
+from encoding import PositionEncoder
+from encounters import AU_KM, close_approaches, moid, rank_by_moid
+from lazy import Lazy, process_uptime
+from orbits import ORBIT_CACHE, earth_position_chunks, earth_positions, orbit_position_chunks, orbit_positions
+from porkchop import design_missions, mission_window
+from tiles import heatmap_png, tile_grid
+import utils
 
 
 # Setup Clients and API Keys
@@ -20,8 +39,34 @@ env = os.environ.get("env", "development").lower()
 neo_api_key = os.environ.get("neo_api_key", None)
 
 asteroid_collector = AsteroidCollector(neo_api_key)
-mission_design = MissionDesignClient()
-fs = FirestoreMiddleware()
+fs = FirestoreMiddleware(should_store=AsteroidCollector.is_complete)
+mission_design = MissionDesignClient(store=fs)
+heatmap_tiles = LRUCache(maxsize=64 * 1024 * 1024, weigh=len)
+
+# Mission design engine used unless a request picks one with ?engine=local|jpl
+mission_engine = os.environ.get("mission_engine", "jpl")
+
+# Orbit windows longer than this are streamed in chunks instead of being built in memory
+orbit_stream_steps = int(os.environ.get("orbit_stream_steps", "100000"))
+
+
+# Objects kept warm by refresh-ahead, the curated hazardous list rather than the whole catalogue
+refresh_ahead_list = os.environ.get("refresh_ahead_list", "hazardous_asteroid_list.json")
+# Workers of one server share this lock, only the one holding it refreshes
+refresh_ahead_lock = os.environ.get("refresh_ahead_lock", os.path.join(tempfile.gettempdir(), "refresh_ahead.lock"))
+
+
+def start_background_tasks():
+    # Keep the curated hazardous list warm so its objects never wait on SBDB/NEO
+    if os.environ.get("refresh_ahead", "0") == "1":
+        with open(refresh_ahead_list) as f:
+            keys = [obj["id"] for obj in json.load(f)]
+        fs.refresh_ahead(keys, asteroid_collector.get, lock_path=refresh_ahead_lock)
+
+
+# Threads don't survive a fork, a preforking server starts them in each worker instead (gunicorn.conf.py)
+if os.environ.get("preload_app", "0") != "1":
+    start_background_tasks()
 
 
 class UpdatedJSONProvider(DefaultJSONProvider):
@@ -34,9 +79,49 @@ class UpdatedJSONProvider(DefaultJSONProvider):
 
 # Setup app and Cors
 
+CORS_ORIGINS = ["http://www.defending.earth", "https://www.defending.earth"]
+
 app = Flask(__name__)
 app.json = UpdatedJSONProvider(app)
-CORS(app, origins=["http://www.defending.earth", "https://www.defending.earth"])
+CORS(
+    app,
+    origins=CORS_ORIGINS,
+    expose_headers=["X-Grid-Shape", "X-Orbit-Shape", "X-Orbit-Delta"],
+)
+
+
+# Optionally load every heavy dependency and dataset before serving traffic. Ahead of a fork only
+# what can be shared is loaded, workers load the rest after forking (gunicorn.conf.py)
+if os.environ.get("preload", "0") == "1":
+    Lazy.preload(fork_safe_only=os.environ.get("preload_app", "0") == "1")
+
+STARTUP_SECONDS = process_uptime()
+first_request_seconds = None
+logging.info(f"Started in {STARTUP_SECONDS}s")
+
+
+@app.after_request
+def track_first_request(response):
+    global first_request_seconds
+    if first_request_seconds is None:
+        first_request_seconds = process_uptime()
+        logging.info(f"First request served {first_request_seconds}s after process start")
+    return response
+
+
+# What has been loaded so far, and cold-start timings (seconds since process start). Ready, and 200
+# instead of 503, once every Lazy resource has loaded: at startup with preload=1, on demand otherwise
+@app.route("/api/ready/", methods=["GET"])
+def get_ready():
+    resources = Lazy.status()
+    preloaded = all(resource["loaded"] for resource in resources.values())
+    return {
+        "ready": preloaded,
+        "preloaded": preloaded,
+        "resources": resources,
+        "startup_seconds": STARTUP_SECONDS,
+        "first_request_seconds": first_request_seconds,
+    }, 200 if preloaded else 503
 
 
 # Redirect to www if we're in prod
@@ -50,10 +135,69 @@ def get_api():
     return "Hello, Space!"
 
 
-# List objects
+@app.route("/api/cache/stats/", methods=["GET"])
+def get_cache_stats():
+    return {
+        "asteroids": fs.stats(),
+        "orbits": ORBIT_CACHE.stats(),
+        "heatmap_tiles": heatmap_tiles.stats(),
+    }, 200
+
+
+def object_detail(data: dict) -> dict:
+    # The payload may be shared through the in-process cache, don't modify it in place
+    data = dict(data)
+
+    # A partial payload (one upstream unavailable) is served without the parts that need it
+    if data.get("neo") is not None:
+        diameter = float(data["neo"]["estimated_diameter"]["meters"]["estimated_diameter_max"])
+        feasibility = get_feasibility(diameter)
+        data["feasibility"] = {"feasibility": feasibility}
+    return asteroid_collector.get_merge(data)
+
+
+# Most objects returned with their detail by one ?expand=1 request
+MAX_EXPAND = 50
+
+
+# List objects, optionally filtered (e.g. ?min_diameter=&max_miss_km=), sorted
+# (?sort=closest_approach_date&order=desc) and paginated (?limit=&offset=).
+# With ?expand=1 the detail of every listed object is returned, uncached objects
+# are fetched upstream so this needs a limit of at most MAX_EXPAND.
 @app.route("/api/objects/", methods=["GET"])
 def list_objects():
-    return asteroid_collector.list(), 200
+    filters = {name: request.args[name] for name in AsteroidStore.FILTERS if name in request.args}
+    sort = request.args.get('sort')
+    limit = request.args.get('limit')
+    offset = request.args.get('offset', '0')
+    expand = request.args.get('expand') == '1'
+
+    if not offset.isdigit() or (limit is not None and not limit.isdigit()):
+        return "limit and offset must be non-negative integers", 400
+    limit = int(limit) if limit is not None else None
+    offset = int(offset)
+    if expand and not (limit is not None and 0 < limit <= MAX_EXPAND):
+        return f"expand=1 needs a limit between 1 and {MAX_EXPAND}", 400
+
+    if filters or sort or limit is not None or offset:
+        try:
+            objects = asteroid_collector.query(
+                filters,
+                sort=sort,
+                descending=request.args.get('order') == 'desc',
+                limit=limit,
+                offset=offset,
+            )
+        except ValueError as e:
+            return str(e), 400
+    else:
+        objects = asteroid_collector.list()
+
+    if not expand:
+        return objects, 200
+
+    payloads = fs.get_many([obj["id"] for obj in objects], asteroid_collector.get)
+    return [object_detail(payloads[obj["id"]]) for obj in objects if payloads.get(obj["id"]) is not None], 200
 
 
 # Detailed object
@@ -63,12 +207,7 @@ def get_object(key: str):
     if data is None:
         return "", 404
 
-    diameter = float(data["neo"]["estimated_diameter"]["meters"]["estimated_diameter_max"])
-    feasibility = get_feasibility(diameter)
-    data["feasibility"] = {"feasibility": feasibility}
-    data = asteroid_collector.get_merge(data)
-
-    return data, 200
+    return object_detail(data), 200
 
 
 # Detailed object
@@ -76,42 +215,199 @@ def get_object(key: str):
 def get_missions(key: str):
     start_date = request.args.get('start_date', date.today().isoformat())
     end_date = request.args.get('end_date')
-    data = mission_design.get_from_id(key, start_date, end_date)
-
-    return data, 200
+    engine = request.args.get('engine', mission_engine)
+
+    if engine == 'jpl':
+        return mission_design.get_from_id(key, start_date, end_date), 200
+    if engine != 'local' or end_date is None:
+        return "Expected engine=local|jpl and an end_date", 400
+    try:
+        mjd_start, mjd_end = mission_window(start_date, end_date)
+    except ValueError as e:
+        return f"Invalid mission window: {e}", 400
+
+    # Porkchop search in process, from the object's SBDB elements
+    data = fs.get_or_create(key, asteroid_collector.get)
+    if data is None:
+        return "", 404
+    if data.get("sbdb") is None:
+        return "", 503
+    data = orbit_data(asteroid_collector.get_merge(data))
+
+    return design_missions(data, mjd_start, mjd_end), 200
+
+
+def orbit_response(steps: int, positions, chunks):
+    """
+    Positions as a JSON list, or with ?format=f32|f64 as a packed little-endian
+    (steps, 3) buffer. ?delta=1 sends row differences, and the body is gzipped
+    when the client accepts it. Windows over orbit_stream_steps are streamed.
+    """
+    fmt = request.args.get('format', 'json')
+    delta = request.args.get('delta') == '1'
+    stream = steps > orbit_stream_steps
+    if fmt == 'json' and not delta and not stream:
+        return positions().tolist(), 200
+
+    gzip = 'gzip' in request.accept_encodings
+    try:
+        encoder = PositionEncoder(fmt, delta=delta, gzip=gzip)
+    except ValueError as e:
+        return str(e), 400
+
+    headers = {"X-Orbit-Shape": f"{steps},3", "Vary": "Accept-Encoding"}
+    if delta:
+        headers["X-Orbit-Delta"] = "1"
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    mimetype = "application/json" if fmt == 'json' else "application/octet-stream"
+
+    if not stream:
+        return Response(b"".join(encoder.stream([positions()])), mimetype=mimetype, headers=headers)
+
+    # Compute the first chunk up front so bad input fails before the response starts
+    blocks = chunks()
+    first = next(blocks, None)
+    blocks = itertools.chain([] if first is None else [first], blocks)
+    return Response(encoder.stream(blocks), mimetype=mimetype, headers=headers)
+
+
+def orbit_data(neo_data: dict) -> dict:
+    # SBDB elements in AU, deg and Julian date
+    orbit = neo_data["orbit"]["elements"]
+    return {
+        "e": float(orbit[0]["value"]),
+        "a": float(orbit[1]["value"]),
+        "i": float(orbit[3]["value"]),
+        "raan": float(orbit[4]["value"]),
+        "argp": float(orbit[5]["value"]),
+        "M0": float(orbit[6]["value"]),
+        "epoch0": float(neo_data["orbit"]["epoch"]),
+    }
 
 
+# Orbit positions in AU, see orbit_response for the available encodings
 @app.route("/api/objects/<key>/orbit/", methods=["GET"])
 def get_object_orbit(key: str):
     data = fs.get_or_create(key, asteroid_collector.get)
     if data is None:
         return "", 404
+    if data.get("sbdb") is None:
+        return "", 503
     neo_data = asteroid_collector.get_merge(data)
 
     start_date = request.args.get('start_date', '2020-01-01')
     steps = int(request.args.get('steps', '100'))
-    orbit = neo_data["orbit"]["elements"]
+    data = orbit_data(neo_data)
+    start = f"{start_date}T00:00:00"
 
-    data = {
-        "e": float(orbit[0]["value"]),
-        "a": float(orbit[1]["value"]) * u.AU,
-        "i": float(orbit[3]["value"]) * u.deg,
-        "raan": float(orbit[4]["value"]) * u.deg,
-        "argp": float(orbit[5]["value"]) * u.deg,
-        "M0": float(orbit[6]["value"]) * u.deg,
-        "epoch0": Time(float(neo_data["orbit"]["epoch"]), format='jd'),
-    }
-    orbit = compute_orbit(data, start=f"{start_date}T00:00:00", steps=steps)
+    return orbit_response(
+        steps,
+        lambda: orbit_positions(data, start, steps=steps),
+        lambda: orbit_position_chunks(data, start, steps=steps),
+    )
+
+
+# MOID to Earth and the close approaches in the next ?years (default 10) closer than ?max_au (default 0.2)
+@app.route("/api/objects/<key>/encounters/", methods=["GET"])
+def get_object_encounters(key: str):
+    data = fs.get_or_create(key, asteroid_collector.get)
+    if data is None:
+        return "", 404
+    if data.get("sbdb") is None:
+        return "", 503
+    data = orbit_data(asteroid_collector.get_merge(data))
 
-    return orbit, 200
+    start_date = request.args.get('start_date', date.today().isoformat())
+    years = min(float(request.args.get('years', 10)), 100)
+    max_au = float(request.args.get('max_au', 0.2))
+
+    moid_au = moid(data)
+    return {
+        "moid_au": moid_au,
+        "moid_km": moid_au * AU_KM,
+        "close_approaches": close_approaches(data, f"{start_date}T00:00:00", days=years * 365.25, max_au=max_au),
+    }, 200
+
+
+# Catalogue objects ranked by MOID to Earth, optionally ?max_au= and ?limit=
+@app.route("/api/objects/moid/", methods=["GET"])
+def get_moid_ranking():
+    limit = request.args.get('limit')
+    max_au = request.args.get('max_au')
+    if limit is not None and not limit.isdigit():
+        return "limit must be a non-negative integer", 400
+    try:
+        max_au = float(max_au) if max_au is not None else None
+    except ValueError:
+        return "max_au must be a number", 400
+    ranked = rank_by_moid(
+        asteroid_collector.local_store,
+        limit=int(limit) if limit is not None else None,
+        max_au=max_au,
+    )
+    if ranked is None:
+        return "The asteroid catalogue has no orbital elements, build it with ingest.py --sbdb", 503
+    return ranked, 200
+
+
+def float_list(name: str, default) -> list[float]:
+    value = request.args.get(name)
+    return list(default) if value is None else [float(item) for item in value.split(",")]
+
+
+# Miss distance at an encounter after a deflection, swept over comma separated ?dv= (m/s) and
+# ?lead_days= values with the delta-v along ?direction=along-track|radial|normal. The encounter is
+# the one nearest ?encounter_date=, or the closest approach in the next ?years (default 30).
+@app.route("/api/objects/<key>/deflection/", methods=["GET"])
+def get_object_deflection(key: str):
+    data = fs.get_or_create(key, asteroid_collector.get)
+    if data is None:
+        return "", 404
+    if data.get("sbdb") is None:
+        return "", 503
+    data = orbit_data(asteroid_collector.get_merge(data))
+
+    try:
+        dv = float_list('dv', DEFAULT_DV_M_S)
+        lead_days = float_list('lead_days', DEFAULT_LEAD_DAYS)
+        direction = request.args.get('direction', 'along-track')
+        encounter_date = request.args.get('encounter_date')
+        if encounter_date is not None:
+            encounter_jd = utils.modified_julian_day(encounter_date) + 2400000.5
+        else:
+            years = min(float(request.args.get('years', 30)), 100)
+            approaches = close_approaches(data, f"{date.today().isoformat()}T00:00:00", days=years * 365.25, max_au=float("inf"))
+            if not approaches:
+                return "No close approach in the window", 404
+            encounter_jd = min(approaches, key=lambda approach: approach["distance_au"])["jd_tdb"]
+        result = deflection_map(data, encounter_jd, dv, lead_days, direction)
+    except ValueError as e:
+        return str(e), 400
+
+    return {
+        "direction": direction,
+        "dv_m_s": dv,
+        "lead_days": lead_days,
+        "nominal_jd_tdb": result["nominal_jd_tdb"],
+        "nominal_miss_distance_km": result["nominal_miss_distance_km"],
+        # Rows are lead times, columns delta-v values
+        "miss_distance_km": result["miss_distance_km"].tolist(),
+        "miss_distance_change_km": result["miss_distance_change_km"].tolist(),
+    }, 200
 
 
 @app.route("/api/earth/orbit/", methods=["GET"])
 def get_earth_orbit():
     start_date = request.args.get('start_date', '2020-01-01')
     steps = int(request.args.get('steps', '366'))
+    start = f"{start_date}T00:00:00"
 
-    return compute_earth_orbit(start=f"{start_date}T00:00:00", steps=steps), 200
+    return orbit_response(
+        steps,
+        lambda: earth_positions(start, steps=steps),
+        lambda: earth_position_chunks(start, steps=steps),
+    )
 
 
 @app.route("/api/objects/<key>/impact/", methods=["GET"])
@@ -122,13 +418,83 @@ def get_object_impact(key: str):
     data = fs.get_or_create(key, asteroid_collector.get)
     if data is None:
         return "", 404
+    if data.get("neo") is None:
+        return "", 503
     neo_data = asteroid_collector.get_merge(data)
 
     impact = calculate_impact(neo_data, lat, lon)
 
+    # Opt-in Monte Carlo spread over diameter, density and velocity
+    samples = int(request.args.get('samples', 0))
+    if samples > 0:
+        impact["uncertainty"] = calculate_impact_uncertainty(neo_data, lat, lon, samples, circles=impact["circles"])
+
     return (impact, 200)
 
 
+# Many impact scenarios in one request, either columns of diameter/density/velocity
+# or one object ("key") over columns of lat/lon
+@app.route("/api/impacts/batch", methods=["POST"])
+def post_impacts_batch():
+    body = request.get_json(silent=True) or {}
+
+    try:
+        if "key" in body:
+            data = fs.get_or_create(body["key"], asteroid_collector.get)
+            if data is None:
+                return "", 404
+            if data.get("neo") is None:
+                return "", 503
+            neo_data = asteroid_collector.get_merge(data)
+            result = calculate_impact_batch(neo_data, body["lat"], body["lon"], bool(body.get("population", False)))
+        else:
+            result = simulate_impact_batch(body["diameter"], body.get("density", DENSITY), body["velocity"])
+    except (KeyError, TypeError, ValueError) as e:
+        return f"Invalid batch request: {e}", 400
+    except RuntimeError as e:
+        # Casualties for many points need the local population raster
+        return str(e), 503
+
+    return result, 200
+
+
+# Casualty heatmap tile z/x/y for an object, as a PNG or a raw little-endian float32 grid
+@app.route("/api/objects/<key>/heatmap/<int:z>/<int:x>/<int:y>", methods=["GET"])
+def get_object_heatmap(key: str, z: int, x: int, y: int):
+    fmt = request.args.get('format', 'png')
+    size = min(int(request.args.get('size', '64')), 256)
+    if fmt not in ("png", "f32") or size < 1 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return "", 400
+
+    mimetype = "image/png" if fmt == "png" else "application/octet-stream"
+    headers = {"X-Grid-Shape": f"{size},{size}"}
+    cache_key = (key, z, x, y, size, fmt)
+    tile = heatmap_tiles.get(cache_key)
+    if tile is not None:
+        return Response(tile, mimetype=mimetype, headers=headers)
+
+    data = fs.get_or_create(key, asteroid_collector.get)
+    if data is None:
+        return "", 404
+    if data.get("neo") is None:
+        return "", 503
+    neo_data = asteroid_collector.get_merge(data)
+
+    lats, lons = tile_grid(z, x, y, size)
+    try:
+        casualties, on_land = calculate_casualty_grid(neo_data, lats, lons)
+    except RuntimeError as e:
+        return str(e), 503
+
+    if fmt == "png":
+        tile = heatmap_png(casualties, on_land)
+    else:
+        tile = casualties.astype("<f4").tobytes()
+    heatmap_tiles.set(cache_key, tile)
+
+    return Response(tile, mimetype=mimetype, headers=headers)
+
+
 if __name__ == "__main__":
     PORT = int(os.getenv("PORT")) if os.getenv("PORT") else 8080
     app.run(host="127.0.0.1", port=PORT, debug=True)
@@ -1,114 +1,412 @@
-from functools import lru_cache
+import os
 
 import numpy as np
-import astropy.units as u
-from astropy.constants import G, M_sun
-from astropy.time import Time
 
+from cache import LRUCache
+from lazy import Lazy
 
-def generate_epochs(start_epoch, dt=1, n_steps=10):
-    dt_days = (dt * u.day).to(u.day).value
-    offsets = np.arange(n_steps) * dt_days
-    return [start_epoch + offset * u.day for offset in offsets]
+# Gravitational parameter (Sun) in AU³/day², (G * M_sun).to(u.AU**3 / u.day**2)
+MU_SUN = 0.00029591220819207774
 
 
-@lru_cache(maxsize=10000)
-def propagateKeplerToHeliocentricXYZ(a, e, i, raan, argp, M0, epoch0, epoch):
+def _import_astropy():
+    import astropy.units as u
+    from astropy.time import Time
+    return u, Time
+
+
+# astropy is only needed to parse epochs, so it is imported on first use
+ASTROPY = Lazy("astropy", _import_astropy)
+
+# Propagated orbits keyed on plain float elements and the epoch window, bounded in bytes
+ORBIT_CACHE = LRUCache(
+    maxsize=int(os.environ.get("orbit_cache_bytes", str(64 * 1024 * 1024))),
+    weigh=lambda positions: positions.nbytes,
+)
+
+
+def solve_kepler(M, e, tol=1e-12, max_iter=50):
     """
-    Propagate a Keplerian orbit around the Sun using Astropy.
+    Solve Kepler's equation ``M = E - e sin(E)`` for an array of mean anomalies.
+
+    Newton iterations run on the whole array at once and stop as soon as the
+    largest correction drops below ``tol``.
+    """
+    M = np.asarray(M, dtype=np.float64)
+    E = M + e * np.sin(M)
+    for _ in range(max_iter):
+        delta = (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+        E = E - delta
+        if np.max(np.abs(delta), initial=0.0) < tol:
+            break
+    return E
+
+
+def propagate_kepler(a, e, i, raan, argp, M0, epoch0, epochs):
+    """
+    Propagate a Keplerian orbit around the Sun for many epochs at once.
 
     Parameters
     ----------
-    a : ~astropy.units.Quantity
-        Semi-major axis (e.g. in AU)
+    a : float
+        Semi-major axis in AU
     e : float
         Eccentricity
-    i : ~astropy.units.Quantity
-        Inclination
-    raan : ~astropy.units.Quantity
-        Right ascension of ascending node
-    argp : ~astropy.units.Quantity
-        Argument of periapsis
-    M0 : ~astropy.units.Quantity
-        Mean anomaly at epoch0
-    epoch0 : ~astropy.time.Time
-        Reference epoch
-    epoch : ~astropy.time.Time
-        Target epoch
+    i, raan, argp, M0 : float
+        Inclination, right ascension of ascending node, argument of periapsis
+        and mean anomaly at epoch0, all in degrees
+    epoch0 : float
+        Reference epoch in days (e.g. a TDB Julian date)
+    epochs : array_like
+        Target epochs in days, on the same time axis as epoch0
 
     Returns
     -------
-    r_xyz : ~astropy.units.Quantity
-        Heliocentric position vector [x, y, z] in AU
+    r_xyz : ~numpy.ndarray
+        (N, 3) array of heliocentric positions in AU
     """
+    epochs = np.asarray(epochs, dtype=np.float64)
 
-    # Gravitational parameter (Sun) in AU³/day²
-    mu = (G * M_sun).to(u.AU**3 / u.day**2).value
+    n = np.sqrt(MU_SUN / a**3)
+    M = np.deg2rad(M0) + n * (epochs - epoch0)
+    # Wrap to [-pi, pi) so Newton starts close to the root for long windows
+    M = np.remainder(M + np.pi, 2 * np.pi) - np.pi
 
-    # Mean motion (rad/day)
-    n = np.sqrt(mu / a.to(u.AU).value**3)
+    E = solve_kepler(M, e)
 
-    # Time since epoch0 [days]
-    dt = (epoch - epoch0).to(u.day).value
+    nu = 2 * np.arctan2(np.sqrt(1 + e) * np.sin(E / 2),
+                        np.sqrt(1 - e) * np.cos(E / 2))
+    r_mag = a * (1 - e * np.cos(E))
 
-    # Mean anomaly at target epoch
-    M = np.deg2rad(M0.value) + n * dt
+    Ω = np.deg2rad(raan)
+    ω = np.deg2rad(argp)
+    i_rad = np.deg2rad(i)
 
-    # --- Solve Kepler's equation for E ---
-    E = M.copy()
-    for _ in range(20):
-        E -= (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+    r_xyz = np.empty(epochs.shape + (3,))
+    r_xyz[..., 0] = r_mag * (np.cos(Ω) * np.cos(ω + nu) - np.sin(Ω) * np.sin(ω + nu) * np.cos(i_rad))
+    r_xyz[..., 1] = r_mag * (np.sin(Ω) * np.cos(ω + nu) + np.cos(Ω) * np.sin(ω + nu) * np.cos(i_rad))
+    r_xyz[..., 2] = r_mag * (np.sin(i_rad) * np.sin(ω + nu))
+    return r_xyz
 
-    # True anomaly
-    nu = 2 * np.arctan2(np.sqrt(1 + e) * np.sin(E / 2),
-                        np.sqrt(1 - e) * np.cos(E / 2))
 
-    # Radius
-    r_mag = a.to(u.AU).value * (1 - e * np.cos(E))
+def perifocal_basis(i, raan, argp):
+    """
+    Unit vectors P (towards periapsis) and Q (90° ahead in the orbit plane) in
+    the heliocentric ecliptic frame, for angles in degrees. Returns two
+    arrays of shape ``np.shape(i) + (3,)``.
+    """
+    Ω, ω, i_rad = np.deg2rad(raan), np.deg2rad(argp), np.deg2rad(i)
+    P = np.stack([
+        np.cos(Ω) * np.cos(ω) - np.sin(Ω) * np.sin(ω) * np.cos(i_rad),
+        np.sin(Ω) * np.cos(ω) + np.cos(Ω) * np.sin(ω) * np.cos(i_rad),
+        np.sin(ω) * np.sin(i_rad),
+    ], axis=-1)
+    Q = np.stack([
+        -np.cos(Ω) * np.sin(ω) - np.sin(Ω) * np.cos(ω) * np.cos(i_rad),
+        -np.sin(Ω) * np.sin(ω) + np.cos(Ω) * np.cos(ω) * np.cos(i_rad),
+        np.cos(ω) * np.sin(i_rad),
+    ], axis=-1)
+    return P, Q
+
+
+def propagate_kepler_state(a, e, i, raan, argp, M0, epoch0, epochs):
+    """
+    Heliocentric position (AU) and velocity (AU/day) at many epochs.
+
+    Same arguments as propagate_kepler, but every element may also be an
+    array broadcasting against ``epochs``, so many orbits can be propagated
+    together. Returns two arrays of shape ``broadcast shape + (3,)``.
+    """
+    a, e, M0, epoch0, epochs = np.broadcast_arrays(*map(np.asarray, (a, e, M0, epoch0, epochs)))
+    P, Q = perifocal_basis(i, raan, argp)
+
+    n = np.sqrt(MU_SUN / a**3)
+    M = np.deg2rad(M0) + n * (epochs - epoch0)
+    M = np.remainder(M + np.pi, 2 * np.pi) - np.pi
+    E = solve_kepler(M, e)
+
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    b = a * np.sqrt(1 - e**2)
+    E_dot = n / (1 - e * cos_E)
+    r = (a * (cos_E - e))[..., None] * P + (b * sin_E)[..., None] * Q
+    v = (-a * sin_E * E_dot)[..., None] * P + (b * cos_E * E_dot)[..., None] * Q
+    return r, v
+
+
+def state_to_elements(r, v, mu=MU_SUN):
+    """
+    Osculating elements for arrays of heliocentric states, the inverse of
+    propagate_kepler_state for closed orbits.
+
+    r and v are (..., 3) in AU and AU/day; returns a (AU), e, and i, raan,
+    argp, M (deg) at the epoch of the state, each of shape ``r.shape[:-1]``.
+    """
+    r, v = np.asarray(r, dtype=np.float64), np.asarray(v, dtype=np.float64)
+    r_norm = np.linalg.norm(r, axis=-1)
+    h = np.cross(r, v)
+    h_unit = h / np.linalg.norm(h, axis=-1)[..., None]
+    e_vec = ((v * v).sum(-1) - mu / r_norm)[..., None] * r - (r * v).sum(-1)[..., None] * v
+    e_vec /= mu
+    e = np.linalg.norm(e_vec, axis=-1)
+    a = 1 / (2 / r_norm - (v * v).sum(-1) / mu)
+
+    i = np.arccos(np.clip(h_unit[..., 2], -1, 1))
+    raan = np.arctan2(h_unit[..., 0], -h_unit[..., 1])
+    node = np.stack([np.cos(raan), np.sin(raan), np.zeros_like(raan)], axis=-1)
+    argp = np.arctan2((e_vec * np.cross(h_unit, node)).sum(-1), (e_vec * node).sum(-1))
+    nu = np.arctan2((h_unit * np.cross(e_vec, r)).sum(-1), (e_vec * r).sum(-1))
+    E = np.arctan2(np.sqrt(1 - e**2) * np.sin(nu), e + np.cos(nu))
+    M = E - e * np.sin(E)
+    return a, e, np.rad2deg(i), np.rad2deg(raan), np.rad2deg(argp), np.rad2deg(M)
+
+
+def _to_float(value, unit: str) -> float:
+    # Elements may be astropy Quantities or plain floats already in AU/deg
+    if hasattr(value, "to"):
+        u, _ = ASTROPY.get()
+        return float(value.to(getattr(u, unit)).value)
+    return float(value)
+
+
+def orbit_elements(data):
+    """
+    Convert an orbit dict into plain floats (AU, deg, TDB JD as two parts).
+
+    Elements may be Quantities or floats; epoch0 may be a Time or a (UTC) Julian date.
+    """
+    _, Time = ASTROPY.get()
+    epoch0 = data["epoch0"]
+    epoch0 = Time(epoch0, scale="tdb") if isinstance(epoch0, Time) else Time(float(epoch0), format="jd").tdb
+    return (
+        _to_float(data["a"], "AU"),
+        float(data["e"]),
+        _to_float(data["i"], "deg"),
+        _to_float(data["raan"], "deg"),
+        _to_float(data["argp"], "deg"),
+        _to_float(data["M0"], "deg"),
+        float(epoch0.jd1),
+        float(epoch0.jd2),
+    )
+
+
+def _start_offset(elements, start) -> float:
+    # Offset of start from epoch0 in days, keeping the two-part JD for precision
+    _, Time = ASTROPY.get()
+    start_time = Time(start, scale="tdb")
+    return (start_time.jd1 - elements[6]) + (start_time.jd2 - elements[7])
+
+
+def orbit_positions(data, start, dt=1, steps=1000):
+    elements = orbit_elements(data)
+    key = (elements, start, float(dt), int(steps))
+
+    positions = ORBIT_CACHE.get(key)
+    if positions is None:
+        a, e, i, raan, argp, M0, _, _ = elements
+        days = _start_offset(elements, start) + np.arange(steps) * float(dt)
 
-    # --- Convert to heliocentric inertial coordinates ---
-    Ω = np.deg2rad(raan.value)
-    ω = np.deg2rad(argp.value)
-    i_rad = np.deg2rad(i.value)
+        positions = propagate_kepler(a, e, i, raan, argp, M0, 0.0, days)
+        positions.flags.writeable = False
+        ORBIT_CACHE.set(key, positions)
 
-    x = r_mag * (np.cos(Ω) * np.cos(ω + nu) - np.sin(Ω) * np.sin(ω + nu) * np.cos(i_rad))
-    y = r_mag * (np.sin(Ω) * np.cos(ω + nu) + np.cos(Ω) * np.sin(ω + nu) * np.cos(i_rad))
-    z = r_mag * (np.sin(i_rad) * np.sin(ω + nu))
+    return positions
 
-    return np.array([x, y, z]) * u.AU
+
+def orbit_position_chunks(data, start, dt=1, steps=1000, chunk=16384):
+    """Yield the positions of orbit_positions in blocks of at most ``chunk`` rows, without caching the window."""
+    elements = orbit_elements(data)
+    a, e, i, raan, argp, M0, _, _ = elements
+    offset = _start_offset(elements, start)
+    for first in range(0, steps, chunk):
+        days = offset + np.arange(first, min(first + chunk, steps)) * float(dt)
+        yield propagate_kepler(a, e, i, raan, argp, M0, 0.0, days)
 
 
 def compute_orbit(data, start, dt=1, steps=1000):
-    epochs = generate_epochs(Time(start, scale="tdb"), dt=dt, n_steps=steps)
-
-    orbit = []
-    for epoch in epochs:
-        position = propagateKeplerToHeliocentricXYZ(
-            a=data["a"],
-            e=data["e"],
-            i=data["i"],
-            raan=data["raan"],
-            argp=data["argp"],
-            M0=data["M0"],
-            epoch0=Time(data["epoch0"], scale="tdb"),
-            epoch=epoch,
+    return orbit_positions(data, start, dt, steps).tolist()
+
+
+# AU, deg and Julian date
+EARTH_ELEMENTS = {
+    "a": 1.00000018,
+    "e": 0.01671123,
+    "i": -0.00054346,
+    "raan": -11.26064,
+    "argp": 114.20783,
+    "M0": -2.48284,
+    "epoch0": 2451545.0,
+}
+
+
+class EarthEphemeris:
+    """
+    Daily table of Earth heliocentric positions over a span of years.
+
+    Windows that line up with whole days are answered by slicing the table;
+    fractional steps are filled in with cubic interpolation between days.
+    """
+
+    def __init__(self, start_year=1900, end_year=2200):
+        u, Time = ASTROPY.get()
+        self.start = Time(f"{start_year}-01-01T00:00:00", scale="tdb")
+        end = Time(f"{end_year + 1}-01-01T00:00:00", scale="tdb")
+        n_days = int(round((end - self.start).to(u.day).value)) + 1
+
+        a, e, i, raan, argp, M0, epoch0_jd1, epoch0_jd2 = orbit_elements(EARTH_ELEMENTS)
+        offset = (self.start.jd1 - epoch0_jd1) + (self.start.jd2 - epoch0_jd2)
+        self.table = propagate_kepler(a, e, i, raan, argp, M0, 0.0, offset + np.arange(n_days))
+        self.table.flags.writeable = False
+
+    def window(self, start, dt=1, steps=366):
+        """Return an (steps, 3) array of positions, or None if the window is outside the table."""
+        _, Time = ASTROPY.get()
+        start = Time(start, scale="tdb")
+        first = (start.jd1 - self.start.jd1) + (start.jd2 - self.start.jd2)
+        dt = float(dt)
+        last = first + (steps - 1) * dt
+
+        first_day = round(first)
+        if abs(first - first_day) < 1e-9 and dt.is_integer() and dt > 0:
+            stop = first_day + (steps - 1) * int(dt) + 1
+            if first_day < 0 or stop > len(self.table):
+                return None
+            return self.table[first_day:stop:int(dt)]
+
+        if min(first, last) < 1 or max(first, last) > len(self.table) - 3:
+            return None
+        return self._interpolate(first + np.arange(steps) * dt)
+
+    def _interpolate(self, days):
+        # Catmull-Rom spline through the four surrounding daily samples
+        k = np.floor(days).astype(np.intp)
+        t = (days - k)[:, None]
+        p0, p1, p2, p3 = self.table[k - 1], self.table[k], self.table[k + 1], self.table[k + 2]
+        return 0.5 * (
+            2 * p1
+            + (p2 - p0) * t
+            + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t**2
+            + (3 * p1 - p0 - 3 * p2 + p3) * t**3
         )
-        orbit.append((float(position[0].value), float(position[1].value), float(position[2].value)))
 
-    return orbit
+
+EARTH_EPHEMERIS = Lazy("earth_ephemeris", lambda: EarthEphemeris(
+    start_year=int(os.environ.get("earth_ephemeris_start", "1900")),
+    end_year=int(os.environ.get("earth_ephemeris_end", "2200")),
+))
+
+
+def earth_positions(start, dt=1, steps=366):
+    positions = EARTH_EPHEMERIS.get().window(start, dt, steps)
+    if positions is None:
+        positions = orbit_positions(EARTH_ELEMENTS, start, dt, steps)
+    return positions
+
+
+def earth_position_chunks(start, dt=1, steps=366, chunk=16384):
+    positions = EARTH_EPHEMERIS.get().window(start, dt, steps)
+    if positions is None:
+        yield from orbit_position_chunks(EARTH_ELEMENTS, start, dt, steps, chunk)
+        return
+    for first in range(0, steps, chunk):
+        yield positions[first:first + chunk]
 
 
-@lru_cache()
 def compute_earth_orbit(start, dt=1, steps=366):
-    data = {
-        "a": 1.00000018 * u.AU,
-        "e": 0.01671123,
-        "i": -0.00054346 * u.deg,
-        "raan": -11.26064 * u.deg,
-        "argp": 114.20783 * u.deg,
-        "M0": -2.48284 * u.deg,
-        "epoch0": Time(2451545.0, format='jd'),
-    }
-
-    orbit = compute_orbit(data, start, dt, steps)
-    return orbit
+    return earth_positions(start, dt, steps).tolist()
+
+
+def _stumpff(z):
+    # C(z) and S(z), with series near zero where the closed forms lose precision
+    C, S = np.empty_like(z), np.empty_like(z)
+    pos, neg = z > 1e-6, z < -1e-6
+    small = ~(pos | neg)
+    s = np.sqrt(z[pos])
+    C[pos], S[pos] = (1 - np.cos(s)) / z[pos], (s - np.sin(s)) / s**3
+    s = np.sqrt(-z[neg])
+    C[neg], S[neg] = (np.cosh(s) - 1) / -z[neg], (np.sinh(s) - s) / s**3
+    C[small], S[small] = 1 / 2 - z[small] / 24, 1 / 6 - z[small] / 120
+    return C, S
+
+
+def lambert(r1, r2, tof, mu=MU_SUN, tol=1e-11, max_iter=60):
+    """
+    Solve Lambert's problem for many transfers at once (single revolution, prograde).
+
+    Parameters
+    ----------
+    r1, r2 : array_like
+        (..., 3) start and end positions in AU
+    tof : array_like
+        Times of flight in days, broadcasting against r1[..., 0]
+
+    Returns
+    -------
+    v1, v2 : ~numpy.ndarray
+        (..., 3) velocities in AU/day at r1 and r2, NaN where no transfer was found
+
+    Uses universal variables, with Newton iterations on z kept inside a
+    bisection bracket so every transfer converges or is flagged.
+    """
+    r1, r2, tof = np.asarray(r1, dtype=np.float64), np.asarray(r2, dtype=np.float64), np.asarray(tof, dtype=np.float64)
+    shape = np.broadcast_shapes(r1.shape[:-1], r2.shape[:-1], tof.shape)
+    r1, r2 = np.broadcast_to(r1, shape + (3,)).reshape(-1, 3), np.broadcast_to(r2, shape + (3,)).reshape(-1, 3)
+    tof = np.broadcast_to(tof, shape).ravel()
+
+    r1_norm, r2_norm = np.linalg.norm(r1, axis=-1), np.linalg.norm(r2, axis=-1)
+    cos_dnu = np.clip((r1 * r2).sum(-1) / (r1_norm * r2_norm), -1, 1)
+    # Prograde: the transfer angle exceeds pi when the motion would be retrograde about +z
+    dnu = np.arccos(cos_dnu)
+    dnu = np.where(np.cross(r1, r2)[:, 2] < 0, 2 * np.pi - dnu, dnu)
+    A = np.sin(dnu) * np.sqrt(r1_norm * r2_norm / (1 - cos_dnu + 1e-300))
+    sqrt_mu_t = np.sqrt(mu) * tof
+
+    def y_of(z, rows):
+        C, S = _stumpff(z)
+        return r1_norm[rows] + r2_norm[rows] + A[rows] * (z * S - 1) / np.sqrt(C), C, S
+
+    lo = np.full(len(tof), -50.0)
+    hi = np.full(len(tof), 4 * np.pi**2 - 1e-9)
+    z = np.zeros(len(tof))
+    converged = np.zeros(len(tof), dtype=bool)
+    active = np.flatnonzero(np.isfinite(A) & (tof > 0))
+
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        z_a = z[active]
+        y, C, S = y_of(z_a, active)
+        valid = y > 0
+        y_safe = np.where(valid, y, 1.0)
+        F = np.where(valid, (y_safe / C) ** 1.5 * S + A[active] * np.sqrt(y_safe) - sqrt_mu_t[active], -1.0)
+
+        # Time of flight grows with z, so F brackets the root
+        lo[active] = np.where(F < 0, z_a, lo[active])
+        hi[active] = np.where(F >= 0, z_a, hi[active])
+        done = valid & (np.abs(F) <= tol * sqrt_mu_t[active])
+        converged[active[done]] = True
+
+        near_zero = np.abs(z_a) < 1e-6
+        z_safe = np.where(near_zero, 1.0, z_a)
+        dF = np.where(
+            near_zero,
+            np.sqrt(2) / 40 * y_safe**1.5 + A[active] / 8 * (np.sqrt(y_safe) + A[active] * np.sqrt(1 / (2 * y_safe))),
+            (y_safe / C) ** 1.5 * (1 / (2 * z_safe) * (C - 3 * S / (2 * C)) + 3 * S**2 / (4 * C))
+            + A[active] / 8 * (3 * S / C * np.sqrt(y_safe) + A[active] * np.sqrt(C / y_safe)),
+        )
+        newton = z_a - F / np.where(dF != 0, dF, np.nan)
+        # Fall back to bisection when Newton leaves the bracket or the point is invalid
+        inside = valid & np.isfinite(newton) & (newton > lo[active]) & (newton < hi[active])
+        z[active] = np.where(done, z_a, np.where(inside, newton, (lo[active] + hi[active]) / 2))
+        active = active[~done]
+
+    v1 = np.full(r1.shape, np.nan)
+    v2 = np.full(r2.shape, np.nan)
+    ok = np.flatnonzero(converged)
+    if len(ok):
+        y, _, _ = y_of(z[ok], ok)
+        f = 1 - y / r1_norm[ok]
+        g = A[ok] * np.sqrt(y / mu)
+        g_dot = 1 - y / r2_norm[ok]
+        v1[ok] = (r2[ok] - f[:, None] * r1[ok]) / g[:, None]
+        v2[ok] = (g_dot[:, None] * r2[ok] - r1[ok]) / g[:, None]
+    return v1.reshape(shape + (3,)), v2.reshape(shape + (3,))
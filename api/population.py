@@ -1,10 +1,19 @@
+import asyncio
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+import numpy as np
 import shapely.geometry
 import shapely.ops
 import json
 
+from clients.transport import get_async_transport, get_transport
+from lazy import Lazy
+
+EARTH_RADIUS_M = 6_371_008.8
+
 
 def circle_geojson(lon, lat, radius_meters, num_points=32):
     # approximate circle as polygon
@@ -22,7 +31,16 @@ def circle_geojson(lon, lat, radius_meters, num_points=32):
     return shapely.geometry.mapping(poly)
 
 
-def get_population_worldpop(lon, lat, radius_m, year=2020, api_key=None):
+WORLDPOP_STATS_URL = os.environ.get("worldpop_stats_url", "https://api.worldpop.org/v1/services/stats")
+WORLDPOP_TASKS_URL = os.environ.get("worldpop_tasks_url", "https://www.api.worldpop.org/v1/tasks/")
+# WorldPop tasks are polled up to WORLDPOP_POLLS times, WORLDPOP_POLL_INTERVAL seconds apart
+WORLDPOP_POLLS = 5
+WORLDPOP_POLL_INTERVAL = 1
+# Submits and polls of several rings run concurrently, so they take about as long as one
+WORLDPOP_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="worldpop")
+
+
+def _worldpop_params(lon, lat, radius_m, year, api_key):
     poly_geojson = circle_geojson(lon, lat, radius_m)
     params = {
         "dataset": "wpgppop",
@@ -31,17 +49,292 @@ def get_population_worldpop(lon, lat, radius_m, year=2020, api_key=None):
     }
     if api_key:
         params["key"] = api_key
-    url = "https://api.worldpop.org/v1/services/stats"
-    init_resp = requests.get(url, params=params)
+    return params
+
+
+def _submit_worldpop_task(lon, lat, radius_m, year=2020, api_key=None):
+    init_resp = get_transport().get(WORLDPOP_STATS_URL, params=_worldpop_params(lon, lat, radius_m, year, api_key))
     init_resp.raise_for_status()
 
     data = init_resp.json()
-    task_id = data["taskid"]
+    return data["taskid"]
+
+
+def _worldpop_totals(responses, task_ids):
+    return [int(responses[task_id]["data"]["total_population"]) for task_id in task_ids]
+
+
+def _await_worldpop_tasks(task_ids):
+    # Poll all tasks together so several circles cost about as much as one
+    responses = {}
+
+    def poll(task_id):
+        return get_transport().get(f"{WORLDPOP_TASKS_URL}{task_id}").json()
+
+    for _ in range(WORLDPOP_POLLS):
+        pending = [task_id for task_id in task_ids if responses.get(task_id, {}).get("status") != "finished"]
+        responses.update(zip(pending, WORLDPOP_EXECUTOR.map(poll, pending)))
+        if all(task_resp["status"] == "finished" for task_resp in responses.values()):
+            break
+        time.sleep(WORLDPOP_POLL_INTERVAL)
+
+    return _worldpop_totals(responses, task_ids)
+
+
+def get_population_worldpop(lon, lat, radius_m, year=2020, api_key=None):
+    task_id = _submit_worldpop_task(lon, lat, radius_m, year, api_key)
+    return _await_worldpop_tasks([task_id])[0]
 
-    for _ in range(5):
-        task_resp = requests.get(f"https://www.api.worldpop.org/v1/tasks/{task_id}").json()
-        if task_resp["status"] == "finished":
+
+def get_population_rings_worldpop(lon, lat, radii_m, year=2020, api_key=None):
+    task_ids = list(WORLDPOP_EXECUTOR.map(
+        lambda radius_m: _submit_worldpop_task(lon, lat, radius_m, year, api_key), radii_m,
+    ))
+    return _await_worldpop_tasks(task_ids)
+
+
+async def _submit_worldpop_task_async(lon, lat, radius_m, year=2020, api_key=None):
+    params = _worldpop_params(lon, lat, radius_m, year, api_key)
+    init_resp = await get_async_transport().get(WORLDPOP_STATS_URL, params=params)
+    init_resp.raise_for_status()
+    return init_resp.json()["taskid"]
+
+
+async def _await_worldpop_tasks_async(task_ids):
+    # Unfinished tasks are polled concurrently, and the wait in between yields to other requests
+    responses = {}
+
+    async def poll(task_id):
+        responses[task_id] = (await get_async_transport().get(f"{WORLDPOP_TASKS_URL}{task_id}")).json()
+
+    for _ in range(WORLDPOP_POLLS):
+        await asyncio.gather(*(
+            poll(task_id) for task_id in task_ids
+            if responses.get(task_id, {}).get("status") != "finished"
+        ))
+        if all(task_resp["status"] == "finished" for task_resp in responses.values()):
             break
-        time.sleep(1)
+        await asyncio.sleep(WORLDPOP_POLL_INTERVAL)
+
+    return _worldpop_totals(responses, task_ids)
+
+
+async def get_population_worldpop_async(lon, lat, radius_m, year=2020, api_key=None):
+    task_id = await _submit_worldpop_task_async(lon, lat, radius_m, year, api_key)
+    return (await _await_worldpop_tasks_async([task_id]))[0]
+
+
+async def get_population_rings_worldpop_async(lon, lat, radii_m, year=2020, api_key=None):
+    task_ids = await asyncio.gather(*(
+        _submit_worldpop_task_async(lon, lat, radius_m, year, api_key) for radius_m in radii_m
+    ))
+    return await _await_worldpop_tasks_async(task_ids)
+
+
+class PopulationRaster:
+    """
+    Population counts on a regular lon/lat grid, stored as per-row prefix sums.
+
+    The population inside a circle is the sum over the rows it crosses of
+    ``prefix[row, j_hi + 1] - prefix[row, j_lo]``, so a query only touches two
+    values per row and never scans the cells in between. Prepared rasters are
+    memory-mapped, so only the rows around a query are paged in from disk.
+    """
+
+    def __init__(self, prefix, lon0, lat0, cell_size):
+        # (lon0, lat0) is the north-west corner of the grid, cell_size in degrees
+        self.prefix = prefix
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.cell_size = cell_size
+        self.rows, self.cols = prefix.shape[0], prefix.shape[1] - 1
+        self.is_global = abs(self.cols * cell_size - 360) < cell_size / 2
+
+    @classmethod
+    def from_array(cls, grid, lon0, lat0, cell_size):
+        grid = np.nan_to_num(np.asarray(grid, dtype=np.float64))
+        prefix = np.zeros((grid.shape[0], grid.shape[1] + 1))
+        np.cumsum(np.clip(grid, 0, None), axis=1, out=prefix[:, 1:])
+        return cls(prefix, lon0, lat0, cell_size)
+
+    @classmethod
+    def from_geotiff(cls, tif_path, out_path, block_rows=256):
+        """
+        Build a prepared raster from a WorldPop/GPW GeoTIFF, one block of rows at a time.
+
+        Needs rasterio, the optional ``raster`` extra (uv sync --extra raster). The
+        server only loads the prepared raster and does not depend on it.
+        """
+        import rasterio
+        from rasterio.windows import Window
+
+        with rasterio.open(tif_path) as src:
+            transform = src.transform
+            prefix = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float64,
+                                               shape=(src.height, src.width + 1))
+            prefix[:, 0] = 0
+            for row in range(0, src.height, block_rows):
+                window = Window(0, row, src.width, min(block_rows, src.height - row))
+                block = src.read(1, window=window, masked=True).astype(np.float64)
+                block = np.clip(block.filled(0), 0, None)
+                np.cumsum(block, axis=1, out=prefix[row:row + block.shape[0], 1:])
+            prefix.flush()
+
+        meta = {"lon0": transform.c, "lat0": transform.f, "cell_size": transform.a}
+        with open(out_path + ".json", "w") as f:
+            json.dump(meta, f)
+        return cls.load(out_path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        prefix = np.load(path, mmap_mode="r")
+        return cls(prefix, meta["lon0"], meta["lat0"], meta["cell_size"])
+
+    def _row_sums(self, rows, j_lo, j_hi):
+        """Sum cells j_lo..j_hi (inclusive) of each row, wrapping around in longitude for global grids."""
+        rows, j_lo, j_hi = np.broadcast_arrays(rows, j_lo, j_hi)
+        prefix = self.prefix
+        totals = prefix[rows, self.cols]
+
+        if self.is_global:
+            full = (j_hi - j_lo + 1) >= self.cols
+            lo = np.mod(j_lo, self.cols)
+            hi = np.mod(j_hi, self.cols)
+            wrapped = lo > hi
+            sums = np.where(
+                wrapped,
+                totals - prefix[rows, lo] + prefix[rows, np.where(wrapped, hi + 1, 0)],
+                prefix[rows, hi + 1] - prefix[rows, lo],
+            )
+            sums = np.where(full, totals, sums)
+        else:
+            lo = np.clip(j_lo, 0, self.cols)
+            hi = np.clip(j_hi, -1, self.cols - 1)
+            sums = np.where(hi >= lo, prefix[rows, np.maximum(hi + 1, lo)] - prefix[rows, lo], 0.0)
+
+        return np.where(j_hi >= j_lo, sums, 0.0)
+
+    def _circle_rows(self, lon, lat, radius_m):
+        """
+        Rows crossed by a circle and the column span of the circle in each of them.
+
+        ``radius_m`` may be an array of radii, in which case the spans have
+        shape (rows, radii) and cover the rows of the largest circle.
+        """
+        d = np.minimum(np.asarray(radius_m, dtype=np.float64) / EARTH_RADIUS_M, np.pi)
+        d_deg = np.rad2deg(np.max(d))
+
+        first = max(int(np.floor((self.lat0 - (lat + d_deg)) / self.cell_size)), 0)
+        last = min(int(np.floor((self.lat0 - (lat - d_deg)) / self.cell_size)), self.rows - 1)
+        rows = np.arange(first, last + 1).reshape((-1,) + (1,) * d.ndim)
+
+        row_lat = np.deg2rad(self.lat0 - (rows + 0.5) * self.cell_size)
+        lat_rad = np.deg2rad(lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            c = (np.cos(d) - np.sin(row_lat) * np.sin(lat_rad)) / (np.cos(row_lat) * np.cos(lat_rad))
+        c = np.nan_to_num(c, nan=2.0)
+        half_width = np.rad2deg(np.arccos(np.clip(c, -1, 1)))
+        half_width = np.where(c <= -1, 180.0, half_width)
+
+        j_lo = np.ceil((lon - half_width - self.lon0) / self.cell_size - 0.5).astype(np.int64)
+        j_hi = np.floor((lon + half_width - self.lon0) / self.cell_size - 0.5).astype(np.int64)
+        j_hi = np.where(c > 1, j_lo - 1, j_hi)
+        return rows, j_lo, j_hi
+
+    def population(self, lon, lat, radius_m):
+        rows, j_lo, j_hi = self._circle_rows(lon, lat, radius_m)
+        return float(self._row_sums(rows, j_lo, j_hi).sum())
+
+    def population_many(self, lons, lats, radius_m, chunk=4096):
+        """Population within the same radius around many centres, vectorized over centres and rows."""
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        d = min(radius_m / EARTH_RADIUS_M, np.pi)
+        d_deg = np.rad2deg(d)
+        n_rows = int(np.ceil(2 * d_deg / self.cell_size)) + 2
+
+        result = np.empty(lons.shape)
+        for start in range(0, len(lons), chunk):
+            lon = lons[start:start + chunk, None]
+            lat = lats[start:start + chunk, None]
+
+            first = np.floor((self.lat0 - (lat + d_deg)) / self.cell_size).astype(np.int64)
+            rows = first + np.arange(n_rows)
+            valid = (rows >= 0) & (rows < self.rows)
+            rows = np.clip(rows, 0, self.rows - 1)
+
+            row_lat = np.deg2rad(self.lat0 - (rows + 0.5) * self.cell_size)
+            lat_rad = np.deg2rad(lat)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                c = (np.cos(d) - np.sin(row_lat) * np.sin(lat_rad)) / (np.cos(row_lat) * np.cos(lat_rad))
+            c = np.nan_to_num(c, nan=2.0)
+            half_width = np.where(c <= -1, 180.0, np.rad2deg(np.arccos(np.clip(c, -1, 1))))
+
+            j_lo = np.ceil((lon - half_width - self.lon0) / self.cell_size - 0.5).astype(np.int64)
+            j_hi = np.floor((lon + half_width - self.lon0) / self.cell_size - 0.5).astype(np.int64)
+            j_hi = np.where((c > 1) | ~valid, j_lo - 1, j_hi)
+
+            result[start:start + chunk] = self._row_sums(rows, j_lo, j_hi).sum(axis=1)
+        return result
+
+    def population_rings(self, lon, lat, radii_m):
+        """Cumulative population within each radius, in one pass over the rows of the largest circle."""
+        rows, j_lo, j_hi = self._circle_rows(lon, lat, np.asarray(radii_m, dtype=np.float64))
+        return self._row_sums(rows, j_lo, j_hi).sum(axis=0)
+
+
+# population_source is either "worldpop" or the path of a raster prepared with PopulationRaster.from_geotiff
+POPULATION_SOURCE = os.environ.get("population_source", "worldpop")
+POPULATION_RASTER = Lazy(
+    "population_raster",
+    lambda: PopulationRaster.load(POPULATION_SOURCE) if POPULATION_SOURCE != "worldpop" else None,
+)
+
+
+def get_population(lon, lat, radius_m):
+    raster = POPULATION_RASTER.get()
+    if raster is not None:
+        return int(round(raster.population(lon, lat, radius_m)))
+    return get_population_worldpop(lon, lat, radius_m)
+
+
+def get_population_many(lons, lats, radius_m):
+    """Population within radius_m around each centre. Needs a local raster, WorldPop is one call per point."""
+    raster = POPULATION_RASTER.get()
+    if raster is None:
+        raise RuntimeError("Batched population lookups need a local population raster (population_source)")
+    return np.rint(raster.population_many(lons, lats, radius_m)).astype(np.int64)
+
+
+def get_population_rings(lon, lat, radii_m):
+    """
+    Population inside each of a sorted list of radii around (lon, lat).
+
+    Returns the cumulative population within each radius and the population of
+    each annulus between a radius and the previous one.
+    """
+    raster = POPULATION_RASTER.get()
+    if raster is not None:
+        return _rings(raster.population_rings(lon, lat, radii_m))
+    return _rings(get_population_rings_worldpop(lon, lat, radii_m))
+
+
+async def get_population_rings_async(lon, lat, radii_m):
+    """get_population_rings without blocking the event loop on WorldPop."""
+    raster = POPULATION_RASTER.get()
+    if raster is not None:
+        return _rings(raster.population_rings(lon, lat, radii_m))
+    return _rings(await get_population_rings_worldpop_async(lon, lat, radii_m))
+
+
+def _rings(cumulative):
+    cumulative = np.rint(np.asarray(cumulative, dtype=np.float64)).astype(np.int64)
+    rings = np.diff(cumulative, prepend=0)
+    return {"cumulative": cumulative.tolist(), "rings": rings.tolist()}
+
 
-    return int(task_resp["data"]["total_population"])
+if __name__ == "__main__":
+    # python population.py <worldpop.tif> <prepared.npy>, with the raster extra installed
+    PopulationRaster.from_geotiff(sys.argv[1], sys.argv[2])
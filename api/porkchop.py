@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+
+import utils
+from cache import LRUCache
+from clients.mission_design import MissionDesignClient
+from orbits import EARTH_ELEMENTS, lambert, orbit_elements, propagate_kepler_state
+
+AU_PER_DAY_KM_S = 149597870.7 / 86400
+MJD_TO_JD = 2400000.5
+OBLIQUITY = np.deg2rad(23.4392911)
+
+# Porkchop grid, in days, matching the JPL mdesign query (step=2, tof-min=10). Single
+# revolution transfers longer than TOF_MAX are not considered.
+DEPARTURE_STEP = 2
+TOF_STEP = 2
+TOF_MIN = 10
+TOF_MAX = int(os.environ.get("porkchop_tof_max", "730"))
+# Widest window (days) searched, time and memory grow with its square
+MAX_SPAN = MissionDesignClient.MAX_SPAN
+
+# Missions per (elements, window)
+MISSION_CACHE = LRUCache(maxsize=256)
+
+
+def _angle(a, b):
+    cos = (a * b).sum(-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+    return np.rad2deg(np.arccos(np.clip(cos, -1, 1)))
+
+
+def mission_window(start_date: str, end_date: str) -> tuple[int, int]:
+    """MJD window of a local missions query, ValueError for unparsable or reversed dates or a span over MAX_SPAN."""
+    mjd_start, mjd_end = utils.modified_julian_day(start_date), utils.modified_julian_day(end_date)
+    if mjd_end < mjd_start:
+        raise ValueError("end_date is before start_date")
+    if mjd_end - mjd_start > MAX_SPAN:
+        raise ValueError(f"windows are limited to {MAX_SPAN} days")
+    return mjd_start, mjd_end
+
+
+def porkchop(data, mjd_start: int, mjd_end: int):
+    """
+    Departure x time-of-flight grid of Earth to object transfers within a window.
+
+    Returns departure days (D,), times of flight (T,) and the departure and
+    arrival hyperbolic excess speeds in km/s as (D, T) arrays, NaN where the
+    arrival falls after ``mjd_end`` or no transfer was found.
+    """
+    if mjd_end - mjd_start > MAX_SPAN:
+        raise ValueError(f"windows are limited to {MAX_SPAN} days")
+    a, e, i, raan, argp, M0, jd1, jd2 = orbit_elements(data)
+    earth = orbit_elements(EARTH_ELEMENTS)
+
+    departures = np.arange(mjd_start, mjd_end - TOF_MIN + 1, DEPARTURE_STEP)
+    tofs = np.arange(TOF_MIN, min(TOF_MAX, mjd_end - mjd_start) + 1, TOF_STEP)
+    shape = (len(departures), len(tofs))
+    if not all(shape):
+        return departures, tofs, np.full(shape, np.nan), np.full(shape, np.nan)
+
+    # Both bodies once per day of the window, transfers then index into these tables
+    days = np.arange(mjd_start, mjd_end + 1)
+    r_earth, v_earth = propagate_kepler_state(*earth[:6], earth[6] + earth[7], days + MJD_TO_JD)
+    r_object, v_object = propagate_kepler_state(a, e, i, raan, argp, M0, jd1 + jd2, days + MJD_TO_JD)
+
+    departure_rows, tof_columns = np.nonzero(departures[:, None] + tofs[None, :] <= mjd_end)
+    start = departures[departure_rows] - mjd_start
+    end = start + tofs[tof_columns]
+
+    v1, v2 = lambert(r_earth[start], r_object[end], tofs[tof_columns])
+    v_departure = np.full(shape, np.nan)
+    v_arrival = np.full(shape, np.nan)
+    v_departure[departure_rows, tof_columns] = np.linalg.norm(v1 - v_earth[start], axis=-1) * AU_PER_DAY_KM_S
+    v_arrival[departure_rows, tof_columns] = np.linalg.norm(v2 - v_object[end], axis=-1) * AU_PER_DAY_KM_S
+    return departures, tofs, v_departure, v_arrival
+
+
+def select_missions(data, mjd_start: int, mjd_end: int) -> list[list]:
+    """
+    Select missions from the porkchop grid, in the row layout of JPL mdesign's
+    selectedMissions (see MissionDesignClient.parse_mission).
+
+    For every departure day the time of flight with the lowest total excess
+    speed is kept, and departures are selected where that total is a local
+    minimum, one mission per launch opportunity.
+    """
+    departures, tofs, v_departure, v_arrival = porkchop(data, mjd_start, mjd_end)
+    if not v_departure.size:
+        return []
+
+    total = np.where(np.isnan(v_departure + v_arrival), np.inf, v_departure + v_arrival)
+    best_tof = total.argmin(axis=1)
+    best = total[np.arange(len(departures)), best_tof]
+    padded = np.concatenate([[np.inf], best, [np.inf]])
+    selected = np.flatnonzero(np.isfinite(best) & (best <= padded[:-2]) & (best < padded[2:]))
+    if not len(selected):
+        return []
+
+    # Geometry of the selected transfers only
+    a, e, i, raan, argp, M0, jd1, jd2 = orbit_elements(data)
+    earth = orbit_elements(EARTH_ELEMENTS)
+    departure = departures[selected].astype(np.float64)
+    tof = tofs[best_tof[selected]].astype(np.float64)
+    arrival = departure + tof
+    r_earth_departure, v_earth_departure = propagate_kepler_state(*earth[:6], earth[6] + earth[7], departure + MJD_TO_JD)
+    r_earth_arrival, _ = propagate_kepler_state(*earth[:6], earth[6] + earth[7], arrival + MJD_TO_JD)
+    r_object, v_object = propagate_kepler_state(a, e, i, raan, argp, M0, jd1 + jd2, arrival + MJD_TO_JD)
+    v1, v2 = lambert(r_earth_departure, r_object, tof)
+
+    v_inf_departure = v1 - v_earth_departure
+    v_inf_arrival = v2 - v_object
+    # Ecliptic to equatorial z component gives the departure declination
+    z_equatorial = v_inf_departure[:, 1] * np.sin(OBLIQUITY) + v_inf_departure[:, 2] * np.cos(OBLIQUITY)
+    declination = np.rad2deg(np.arcsin(z_equatorial / np.linalg.norm(v_inf_departure, axis=-1)))
+
+    columns = [
+        departure.astype(int),
+        arrival.astype(int),
+        v_departure[selected, best_tof[selected]],
+        v_arrival[selected, best_tof[selected]],
+        # Sun-object-Earth angle at arrival
+        _angle(-r_object, r_earth_arrival - r_object),
+        np.linalg.norm(r_object - r_earth_arrival, axis=-1),
+        # Sun-Earth-object angle at arrival
+        _angle(-r_earth_arrival, r_object - r_earth_arrival),
+        declination,
+        # Approach direction relative to the direction of the Sun, seen from the object
+        _angle(v_inf_arrival, -r_object),
+        tof.astype(int),
+    ]
+    return [list(row) for row in zip(*(column.tolist() for column in columns))]
+
+
+def design_missions(data, mjd_start: int, mjd_end: int) -> dict:
+    """Missions in the response format of MissionDesignClient.get_from_id, computed in process."""
+    key = (orbit_elements(data), int(mjd_start), int(mjd_end))
+    result = MISSION_CACHE.get(key)
+    if result is None:
+        missions = [MissionDesignClient.parse_mission(mission) for mission in select_missions(data, mjd_start, mjd_end)]
+        missions.sort(key=lambda m: m["departure_date"])
+        # The low-thrust estimate is a JPL product with no local equivalent
+        result = {"dv_lowthrust": None, "missions": missions}
+        MISSION_CACHE.set(key, result)
+    return result
@@ -0,0 +1,113 @@
+import os
+import sys
+
+import pytest
+
+# The API modules import each other as top-level modules, as when run from api/
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, API_DIR)
+
+
+@pytest.fixture(autouse=True)
+def api_dir(monkeypatch):
+    # Bundled datasets are opened relative to api/
+    monkeypatch.chdir(API_DIR)
+
+
+@pytest.fixture
+def fake_transport(monkeypatch):
+    """FakeTransport answering every client that uses the shared transport."""
+    from clients import transport
+
+    fake = transport.FakeTransport()
+    monkeypatch.setattr(transport, "_transport", fake)
+    return fake
+
+
+class FakeSnapshot:
+    def __init__(self, key: str, data: dict):
+        self.id = key
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        return self._data[field]
+
+
+class FakeDocumentReference:
+    def __init__(self, db, collection: str, key: str):
+        self.db = db
+        self.collection = collection
+        self.id = key
+
+    def get(self):
+        self.db.reads += 1
+        return FakeSnapshot(self.id, self.db.documents[self.collection].get(self.id))
+
+    def set(self, data: dict):
+        self.db.writes += 1
+        self.db.documents[self.collection][self.id] = dict(data)
+
+
+class FakeCollection:
+    def __init__(self, db, name: str):
+        self.db = db
+        self.name = name
+
+    def document(self, key: str):
+        return FakeDocumentReference(self.db, self.name, key)
+
+
+class FakeBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref: FakeDocumentReference, data: dict):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        for ref, data in self.writes:
+            ref.set(data)
+
+
+class FakeFirestore:
+    """In-memory stand-in for the google.cloud.firestore client, for the calls FirestoreMiddleware makes."""
+
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, name: str):
+        self.documents.setdefault(name, {})
+        return FakeCollection(self, name)
+
+    def get_all(self, refs):
+        for ref in refs:
+            yield ref.get()
+
+    def batch(self):
+        return FakeBatch()
+
+
+@pytest.fixture
+def fake_firestore():
+    return FakeFirestore()
+
+
+@pytest.fixture
+def use_firestore(monkeypatch):
+    """Connects a FirestoreMiddleware to the given client (None runs it without Firestore)."""
+
+    def use(middleware, db):
+        monkeypatch.setattr(middleware.client, "_value", db)
+        monkeypatch.setattr(middleware.client, "loaded", True)
+        return middleware
+
+    return use
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import pytest
+
+import asgi
+from lazy import Lazy
+
+
+def run_lifespan():
+    messages = asyncio.Queue()
+    sent = []
+
+    async def send(message):
+        sent.append(message["type"])
+
+    async def main():
+        for message in ("lifespan.startup", "lifespan.shutdown"):
+            messages.put_nowait({"type": message})
+        await asgi.app({"type": "lifespan"}, messages.get, send)
+        return threading.current_thread()
+
+    return asyncio.run(main()), sent
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Lazy resources made by a test register themselves, keep them out of the shared registry
+    monkeypatch.setattr(Lazy, "registry", dict(Lazy.registry))
+
+
+def test_startup_loads_resources_off_the_event_loop(monkeypatch):
+    monkeypatch.setenv("firestore", "0")
+    loaded_in = []
+    Lazy("probe", lambda: loaded_in.append(threading.current_thread()))
+
+    loop_thread, sent = run_lifespan()
+
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert all(status["loaded"] for status in Lazy.status().values())
+    assert loaded_in and loaded_in[0] is not loop_thread
+
+
+def test_startup_fails_when_loading_fails(monkeypatch):
+    def fail():
+        raise OSError("ne_110m_land.shp not found")
+
+    Lazy("broken", fail)
+    _, sent = run_lifespan()
+    assert sent == ["lifespan.startup.failed"]
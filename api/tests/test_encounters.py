@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+import encounters
+from clients.local_store import AsteroidStore
+from encounters import close_approaches, moid_many, rank_by_moid
+from orbits import EARTH_ELEMENTS, orbit_elements, perifocal_basis, propagate_kepler_state
+
+# (a, e, i, raan, argp) in AU and degrees: 433 Eros, 99942 Apophis, 1566 Icarus and a retrograde orbit
+ORBITS = np.array([
+    [1.458, 0.2228, 10.83, 304.3, 178.9],
+    [0.9224, 0.1914, 3.34, 203.96, 126.6],
+    [1.078, 0.8269, 22.8, 87.95, 31.4],
+    [2.1, 0.45, 160.0, 40.0, 250.0],
+])
+
+ELEMENT_NAMES = ("a", "e", "i", "raan", "argp")
+EARTH = [EARTH_ELEMENTS[name] for name in ELEMENT_NAMES]
+
+# Earth's orbit tilted about its line of nodes: both bodies meet there twice a year
+TILTED_EARTH = {**EARTH_ELEMENTS, "i": 10.0}
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    encounters.MOID_CACHE.clear()
+    encounters.APPROACH_CACHE.clear()
+
+
+def points(a, e, i, raan, argp, anomalies):
+    P, Q = perifocal_basis(i, raan, argp)
+    return a * (np.cos(anomalies) - e)[:, None] * P + a * np.sqrt(1 - e**2) * np.sin(anomalies)[:, None] * Q
+
+
+def brute_force_moid(elements, samples=2000, zoom=3):
+    """Smallest distance between the orbits over a grid of both eccentric anomalies, refined around the best pair."""
+    u = v = np.linspace(0, 2 * np.pi, samples, endpoint=False)
+    for _ in range(zoom):
+        d = np.linalg.norm(points(*elements, u)[:, None] - points(*EARTH, v)[None], axis=-1)
+        row, column = np.unravel_index(d.argmin(), d.shape)
+        width = 2 * (u[1] - u[0])
+        u = np.linspace(u[row] - width, u[row] + width, 400)
+        v = np.linspace(v[column] - width, v[column] + width, 400)
+    return d.min()
+
+
+def test_moid_matches_brute_force():
+    result = moid_many(*ORBITS.T)
+    expected = [brute_force_moid(elements) for elements in ORBITS]
+    np.testing.assert_allclose(result, expected, rtol=1e-6, atol=1e-9)
+    # Served from the cache the second time, also one at a time
+    assert moid_many(*ORBITS[1]) == pytest.approx(result[1])
+
+
+def test_moid_of_crossing_and_open_orbits():
+    tilted = [TILTED_EARTH[name] for name in ELEMENT_NAMES]
+    assert moid_many(*tilted)[0] < 1e-9
+    assert np.isnan(moid_many([1.0, -2.0], [0.5, 1.2], 5.0, 10.0, 20.0)[1])
+    assert np.isnan(moid_many(np.nan, 0.1, 5.0, 10.0, 20.0)[0])
+
+
+def test_close_approaches_at_the_shared_node():
+    approaches = close_approaches(TILTED_EARTH, "2030-01-01T00:00:00", days=730, max_au=1e-6)
+    assert len(approaches) == 4
+
+    epochs = np.array([approach["jd_tdb"] for approach in approaches])
+    earth = orbit_elements(EARTH_ELEMENTS)
+    r_earth, _ = propagate_kepler_state(*earth[:6], earth[6] + earth[7], epochs)
+    # Earth is on the line of nodes, alternately at the ascending and descending node
+    node = np.array([np.cos(np.deg2rad(EARTH_ELEMENTS["raan"])), np.sin(np.deg2rad(EARTH_ELEMENTS["raan"])), 0.0])
+    np.testing.assert_allclose(np.cross(r_earth, node), 0, atol=1e-7)
+    assert np.all(np.diff(np.sign(r_earth @ node)) != 0)
+    # At the raan Earth passes the ascending node around 9 March (heliocentric longitude 348.7°)
+    assert approaches[0]["date"].startswith("2030-03-0")
+    assert [approach["date"][:4] for approach in approaches] == ["2030", "2030", "2031", "2031"]
+
+
+def test_close_approaches_match_sampled_minimum():
+    eros = {"a": 1.458, "e": 0.2228, "i": 10.83, "raan": 304.3, "argp": 178.9, "M0": 310.6, "epoch0": 2460600.5}
+    approaches = close_approaches(eros, "2030-01-01T00:00:00", days=3650, max_au=np.inf)
+    assert approaches
+
+    a, e, i, raan, argp, M0, jd1, jd2 = orbit_elements(eros)
+    earth = orbit_elements(EARTH_ELEMENTS)
+    for approach in approaches:
+        epochs = approach["jd_tdb"] + np.linspace(-3, 3, 6001)
+        r, _ = propagate_kepler_state(a, e, i, raan, argp, M0, jd1 + jd2, epochs)
+        r_earth, _ = propagate_kepler_state(*earth[:6], earth[6] + earth[7], epochs)
+        distance = np.linalg.norm(r - r_earth, axis=-1)
+        assert approach["distance_au"] == pytest.approx(distance.min(), rel=1e-9)
+        assert approach["jd_tdb"] == pytest.approx(epochs[distance.argmin()], abs=1e-3)
+
+
+def store(orbits) -> AsteroidStore:
+    records = [{"id": str(2_000_000 + row), "name": f"object {row}"} for row in range(len(orbits))]
+    columns = AsteroidStore.from_records(records).columns
+    for name, values in zip(ELEMENT_NAMES, np.asarray(orbits, dtype=np.float64).T):
+        columns[name] = values
+    columns["M0"] = np.zeros(len(orbits))
+    columns["epoch"] = np.full(len(orbits), 2461000.5)
+    return AsteroidStore(columns)
+
+
+def test_rank_by_moid():
+    catalogue = store(np.vstack([ORBITS, [[1.0, 1.5, 5.0, 10.0, 20.0]]]))
+    moids = moid_many(*ORBITS.T)
+    order = np.argsort(moids)
+
+    ranked = rank_by_moid(catalogue)
+    # The open orbit has no MOID and is left out
+    assert [record["id"] for record in ranked] == [str(2_000_000 + row) for row in order]
+    assert [record["moid_au"] for record in ranked] == pytest.approx(moids[order])
+    assert [record["id"] for record in rank_by_moid(catalogue, limit=2)] == [str(2_000_000 + row) for row in order[:2]]
+    assert len(rank_by_moid(catalogue, max_au=moids[order[1]])) == 2
+    assert rank_by_moid(catalogue, limit=0) == []
+    with pytest.raises(ValueError):
+        rank_by_moid(catalogue, limit=-1)
+    assert rank_by_moid(AsteroidStore.from_records([{"id": "1"}])) is None
+
+
+@pytest.mark.parametrize("query", ["limit=-5", "limit=abc", "limit=1.5", "max_au=abc"])
+def test_moid_route_rejects_invalid_parameters(query, monkeypatch):
+    import main
+
+    catalogue = main.asteroid_collector.neo_client.store
+    monkeypatch.setattr(catalogue, "_value", store(ORBITS))
+    monkeypatch.setattr(catalogue, "loaded", True)
+    client = main.app.test_client()
+    assert client.get(f"/api/objects/moid/?{query}").status_code == 400
+    assert len(client.get("/api/objects/moid/?limit=2&max_au=10").get_json()) == 2
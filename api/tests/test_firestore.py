@@ -0,0 +1,74 @@
+import time
+
+from clients.firestore import FirestoreMiddleware
+
+
+def middleware(use_firestore, db):
+    fs = use_firestore(FirestoreMiddleware(), db)
+    fs.stale_while_revalidate = False
+    return fs
+
+
+def stored(db, key):
+    return db.documents[FirestoreMiddleware.ASTEROID_COLLECTION].get(key)
+
+
+def test_refresh_ahead_pass_refreshes_expiring_first(use_firestore, fake_firestore, monkeypatch):
+    fs = middleware(use_firestore, fake_firestore)
+    monkeypatch.setattr(fs, "REFRESH_AHEAD_LIMIT", 3)
+    now = time.time()
+    collection = fake_firestore.collection(fs.ASTEROID_COLLECTION)
+    for key, expiration in [("fresh", now + 2 * fs.REFRESH_MARGIN), ("soon", now + 60), ("sooner", now + 30),
+                            ("later", now + fs.REFRESH_MARGIN / 2)]:
+        collection.document(key).set({"payload": {"id": key}, "expiration": expiration})
+
+    fetched = []
+    due = fs.refresh_ahead_pass(["fresh", "soon", "missing", "sooner", "later"], lambda key: fetched.append(key) or {"id": key})
+    fs.refresher.shutdown(wait=True)
+
+    # Missing documents first, then by expiration, and no more than the limit per pass
+    assert due == ["missing", "sooner", "soon"]
+    assert sorted(fetched) == sorted(due)
+    assert stored(fake_firestore, "missing")["expiration"] > now + fs.REFRESH_MARGIN
+    assert stored(fake_firestore, "later")["expiration"] < now + fs.REFRESH_MARGIN
+
+
+def test_refresh_ahead_runs_in_one_process(use_firestore, fake_firestore, tmp_path):
+    lock_path = str(tmp_path / "refresh_ahead.lock")
+    first, second = middleware(use_firestore, fake_firestore), middleware(use_firestore, fake_firestore)
+    assert first._hold_lock(lock_path)
+    assert not second._hold_lock(lock_path)
+    assert first._hold_lock(lock_path)
+
+    # Once the holder is gone another one takes over
+    first._refresh_ahead_lock.close()
+    assert second._hold_lock(lock_path)
+
+
+def test_stale_refresh_fetches_upstream_again(use_firestore, fake_firestore, fake_transport):
+    from clients.asteroid_collector import AsteroidCollector
+    from clients.neo import NeoClient
+    from clients.sbdb import SBDBClient
+
+    fs = use_firestore(FirestoreMiddleware(should_store=AsteroidCollector.is_complete), fake_firestore)
+    collector = AsteroidCollector("DEMO_KEY")
+    versions = iter(range(1, 100))
+    fake_transport.add(SBDBClient.BASE_URL, lambda url, params: {"object": {"fullname": "(2020 GA2)"}, "version": next(versions)})
+    fake_transport.add(NeoClient.BASE_URL, {"id": "54016489"})
+
+    fake_firestore.collection(fs.ASTEROID_COLLECTION).document("54016489").set({
+        "payload": collector.get("54016489"), "expiration": time.time() - 60,
+    })
+    calls = len(fake_transport.calls)
+
+    # The expired document is served while it is refreshed in the background
+    assert fs.get_or_create("54016489", collector.get)["sbdb"]["version"] == 1
+    fs.refresher.shutdown(wait=True)
+
+    assert len(fake_transport.calls) == calls + 2
+    document = stored(fake_firestore, "54016489")
+    assert document["payload"]["sbdb"]["version"] == 2
+    assert document["expiration"] > time.time()
+    assert fs.get_or_create("54016489", collector.get)["sbdb"]["version"] == 2
+    # Another refresh goes upstream again
+    assert fs.refresh("54016489", collector.get)["sbdb"]["version"] == 3
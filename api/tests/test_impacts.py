@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import impacts
+import population
+from population import PopulationRaster
+
+NEO = {
+    "estimated_diameter": {"meters": {"estimated_diameter_min": 157.2, "estimated_diameter_max": 351.6}},
+    "relative_velocity_km_s": 30.04,
+}
+
+
+@pytest.fixture
+def raster(monkeypatch):
+    grid = np.random.default_rng(4).integers(0, 1000, size=(180, 360)).astype(np.float64)
+    raster = PopulationRaster.from_array(grid, lon0=-180, lat0=90, cell_size=1.0)
+    monkeypatch.setattr(population.POPULATION_RASTER, "_value", raster)
+    monkeypatch.setattr(population.POPULATION_RASTER, "loaded", True)
+    return raster
+
+
+@pytest.fixture
+def no_raster(monkeypatch):
+    monkeypatch.setattr(population.POPULATION_RASTER, "_value", None)
+    monkeypatch.setattr(population.POPULATION_RASTER, "loaded", True)
+
+
+def test_batch_casualties_match_single_lookups(raster):
+    lats, lons = [48.14, -33.9, 0.0, 64.1], [11.58, 151.2, -179.9, -21.9]
+    result = impacts.calculate_impact_batch(NEO, lats, lons, population=True)
+
+    radius_heavy_m = impacts.simulate_impact(*impacts.impact_parameters(NEO))["radius_heavy_km"] * 1000
+    assert result["casualties"] == [round(raster.population(lon, lat, radius_heavy_m)) for lat, lon in zip(lats, lons)]
+    assert result["lat"] == lats and len(result["on_land"]) == 4
+
+
+def test_batch_casualties_need_raster(no_raster):
+    with pytest.raises(RuntimeError):
+        impacts.calculate_impact_batch(NEO, [48.14], [11.58], population=True)
+    # Without casualties the raster is not needed
+    assert impacts.calculate_impact_batch(NEO, [48.14], [11.58])["on_land"] == [True]
+
+
+def test_batch_size_is_capped():
+    too_many = np.zeros(impacts.MAX_BATCH_SIZE + 1).tolist()
+    with pytest.raises(ValueError):
+        impacts.calculate_impact_batch(NEO, too_many, too_many)
+    with pytest.raises(ValueError):
+        impacts.simulate_impact_batch(too_many, impacts.DENSITY, 20.0)
+    with pytest.raises(ValueError):
+        impacts.calculate_impact_batch(NEO, [1.0, 2.0], [1.0])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.fs, "get_or_create", lambda key, func: {"neo": NEO})
+    monkeypatch.setattr(main.asteroid_collector, "get_merge", lambda data: data["neo"])
+    return main.app.test_client()
+
+
+def test_batch_route_errors(client, no_raster):
+    points = {"key": "2000433", "lat": [48.14], "lon": [11.58]}
+    assert client.post("/api/impacts/batch", json={**points, "population": True}).status_code == 503
+    assert client.post("/api/impacts/batch", json=points).status_code == 200
+
+    too_many = [0.0] * (impacts.MAX_BATCH_SIZE + 1)
+    assert client.post("/api/impacts/batch", json={"key": "2000433", "lat": too_many, "lon": too_many}).status_code == 400
+    assert client.post("/api/impacts/batch", json={"diameter": too_many, "velocity": 20.0}).status_code == 400
+
+
+def test_uncertainty_without_lower_diameter_bound(raster):
+    for d_min in (0.0, -5.0, 1000.0):
+        neo = {**NEO, "estimated_diameter": {"meters": {"estimated_diameter_min": d_min, "estimated_diameter_max": 351.6}}}
+        result = impacts.calculate_impact_uncertainty(neo, 48.14, 11.58, 1000, seed=1)
+        assert all(np.isfinite(list(result[field].values())).all() for field in impacts.UNCERTAINTY_FIELDS)
+        assert result["energy_megaton"]["p5"] < result["energy_megaton"]["p95"]
+
+
+def test_uncertainty_casualties_from_raster(raster):
+    result = impacts.calculate_impact_uncertainty(NEO, 48.14, 11.58, 1000, seed=1)
+    heavy_km = result["radius_heavy_km"]
+    # Percentiles of casualties follow those of the heavy-damage radius, within the interpolation error
+    for p in ("p5", "p50", "p95"):
+        assert result["casualties"][p] == pytest.approx(raster.population(11.58, 48.14, heavy_km[p] * 1000), rel=0.1)
+
+
+def test_uncertainty_reuses_impact_rings(no_raster, monkeypatch):
+    circles = [
+        {"radius": 40e3, "casualties": 4000},
+        {"radius": 20e3, "casualties": 1000},
+        {"radius": 10e3, "casualties": 300},
+    ]
+
+    def no_lookup(*args):
+        raise AssertionError("the casualty spread must not look up population")
+
+    monkeypatch.setattr(impacts, "get_population_rings", no_lookup)
+    result = impacts.calculate_impact_uncertainty(NEO, 48.14, 11.58, 1000, seed=1, circles=circles)
+    assert 0 < result["casualties"]["p5"] <= result["casualties"]["p50"] <= result["casualties"]["p95"] <= 4000
+
+
+@pytest.mark.parametrize("path", [
+    "/api/objects/2000433/heatmap/4/8/5?size=0",
+    "/api/objects/2000433/heatmap/4/8/5?size=-3",
+    "/api/objects/2000433/heatmap/4/8/5?format=gif",
+    "/api/objects/2000433/heatmap/4/16/5",
+])
+def test_heatmap_rejects_invalid_tiles(client, path):
+    assert client.get(path).status_code == 400
@@ -0,0 +1,177 @@
+import json
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import requests
+
+from clients.local_store import AsteroidStore
+from clients.transport import FakeResponse
+from ingest import NEO_URL, SBDB_URL, Ingestion, to_record
+
+PAGES = 5
+PAGE_SIZE = 3
+
+
+def neo_object(i: int) -> dict:
+    earth = {
+        "orbiting_body": "Earth",
+        "close_approach_date": f"2030-01-{i + 1:02d}",
+        "miss_distance": {"kilometers": str(1e6 * (i + 1))},
+        "relative_velocity": {"kilometers_per_second": str(10.0 + i)},
+    }
+    mars = {**earth, "orbiting_body": "Mars", "miss_distance": {"kilometers": "10"}}
+    return {
+        "id": str(3_000_000 + i),
+        "name": f"(2020 AB{i})",
+        "absolute_magnitude_h": 20 + i / 10,
+        "estimated_diameter": {"meters": {"estimated_diameter_max": 100.0 + i}},
+        "is_potentially_hazardous_asteroid": i % 3 != 2,
+        # Object 4 never comes close to Earth
+        "close_approach_data": [mars] if i == 4 else [mars, earth],
+    }
+
+
+# Hazardous objects with an Earth approach
+EXPECTED_IDS = [str(3_000_000 + i) for i in range(PAGES * PAGE_SIZE) if i % 3 != 2 and i != 4]
+
+
+def rate_limited():
+    return FakeResponse({"error": {"code": "OVER_RATE_LIMIT"}}, 429, {"Retry-After": "3600"})
+
+
+@pytest.fixture
+def neo(fake_transport):
+    """Fake NEO browse, feed and SBDB; a page, week or object in ``fail`` is answered with a 429 once."""
+    fail = set()
+
+    def browse(url, params):
+        page = params["page"]
+        if page in fail:
+            fail.discard(page)
+            return rate_limited()
+        objects = [neo_object(i) for i in range(page * PAGE_SIZE, (page + 1) * PAGE_SIZE)]
+        return {"page": {"total_pages": PAGES}, "near_earth_objects": objects}
+
+    def feed(url, params):
+        if params["start_date"] in fail:
+            fail.discard(params["start_date"])
+            return rate_limited()
+        week = (date.fromisoformat(params["start_date"]) - date(2030, 1, 1)).days // 7
+        objects = [neo_object(i) for i in range(week * PAGE_SIZE, (week + 1) * PAGE_SIZE)]
+        return {"near_earth_objects": {params["start_date"]: objects}}
+
+    def sbdb(url, params):
+        i = int(params["sstr"]) - 3_000_000
+        elements = [{"name": name, "value": str(value)} for name, value in [
+            ("e", 0.1 + i / 100), ("a", 1.2), ("i", 5.0), ("om", 80.0), ("w", 300.0), ("ma", 10.0 * i),
+        ]]
+        return {"orbit": {"epoch": "2461000.5", "elements": elements}}
+
+    fake_transport.add(f"{NEO_URL}neo/browse", browse)
+    fake_transport.add(f"{NEO_URL}feed", feed)
+    fake_transport.add(SBDB_URL, sbdb)
+    return fail
+
+
+def ingestion(out_dir, **options) -> Ingestion:
+    return Ingestion(str(out_dir), "DEMO_KEY", **{"workers": 2, "interval": 0, "since": date(2030, 1, 1), **options})
+
+
+def record_ids(ingestion: Ingestion) -> list[str]:
+    with open(ingestion.records_path) as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+def requested(fake_transport, path: str, param: str) -> list:
+    return [params[param] for url, params in fake_transport.calls if url == f"{NEO_URL}{path}"]
+
+
+def test_browse_resumes_after_rate_limit(tmp_path, neo, fake_transport):
+    neo.add(3)
+    with pytest.raises(requests.HTTPError):
+        ingestion(tmp_path).browse()
+    # Pages are committed a window at a time, the window holding page 3 is fetched again
+    assert requested(fake_transport, "neo/browse", "page") == [0, 1, 2, 3]
+    with open(os.path.join(tmp_path, "state", "progress.json")) as f:
+        assert json.load(f) == {"next_page": 2, "total_pages": PAGES}
+
+    fake_transport.calls.clear()
+    resumed = ingestion(tmp_path)
+    resumed.browse()
+    assert requested(fake_transport, "neo/browse", "page") == [2, 3, 4]
+    assert record_ids(resumed) == EXPECTED_IDS
+
+
+def test_browse_rerun_adds_nothing(tmp_path, neo, fake_transport):
+    ingestion(tmp_path).browse(max_pages=2)
+    fake_transport.calls.clear()
+    rerun = ingestion(tmp_path)
+    rerun.browse(max_pages=2)
+    assert fake_transport.calls == []
+    rerun.browse()
+    assert record_ids(rerun) == EXPECTED_IDS
+
+
+def test_low_quota_slows_down(tmp_path, fake_transport):
+    page = {"page": {"total_pages": 1}, "near_earth_objects": [neo_object(0)]}
+    fake_transport.add(f"{NEO_URL}neo/browse", lambda url, params: FakeResponse(page, 200, {"X-RateLimit-Remaining": "10"}))
+    run = ingestion(tmp_path, workers=1)
+    run.browse()
+    # What is left of the hourly quota is spread over the hour
+    assert run.limiter.interval == 360
+
+
+def test_feed_resumes_from_original_start(tmp_path, neo, fake_transport):
+    start = date(2030, 1, 1)
+    neo.add((start + timedelta(days=14)).isoformat())
+    with pytest.raises(requests.HTTPError):
+        ingestion(tmp_path).feed(start, weeks=PAGES)
+
+    fake_transport.calls.clear()
+    resumed = ingestion(tmp_path)
+    resumed.feed(date(2031, 6, 1), weeks=PAGES)
+    assert requested(fake_transport, "feed", "start_date") == [(start + timedelta(days=7 * week)).isoformat() for week in range(2, PAGES)]
+    assert record_ids(resumed) == EXPECTED_IDS
+
+
+def test_write_catalogue_loads_in_store(tmp_path, neo):
+    run = ingestion(tmp_path / "catalogue", with_sbdb=True)
+    run.browse()
+    json_path = str(tmp_path / "hazardous_asteroid_list.json")
+    version_dir = run.write_catalogue(json_path)
+
+    store = AsteroidStore.from_catalogue(str(tmp_path / "catalogue"))
+    assert os.path.dirname(version_dir) == str(tmp_path / "catalogue")
+    assert [record["id"] for record in store.records()] == EXPECTED_IDS
+    assert store.get("3000001") == {
+        "id": "3000001",
+        "name": "(2020 AB1)",
+        "absolutemagnitude_h": 20.1,
+        "max_diameter_km": 101.0,
+        "closest_approach_date": "2030-01-02",
+        "closest_miss_km": 2e6,
+        "relative_velocity_km_s": 11.0,
+    }
+    assert store.query(sort="closest_miss_km", descending=True, limit=1)[0]["id"] == EXPECTED_IDS[-1]
+
+    orbits = store.orbit_columns()
+    rows = np.array([int(key) - 3_000_000 for key in EXPECTED_IDS])
+    np.testing.assert_allclose(orbits["e"], 0.1 + rows / 100)
+    np.testing.assert_allclose(orbits["M0"], 10.0 * rows)
+    np.testing.assert_allclose(orbits["epoch"], 2461000.5)
+
+    # The legacy JSON list holds the same records
+    assert AsteroidStore.from_json(json_path).records() == store.records()
+
+
+def test_closest_approach_is_ahead_of_ingestion():
+    neo = neo_object(0)
+    past = {**neo["close_approach_data"][1], "close_approach_date": "1914-03-02", "miss_distance": {"kilometers": "5"}}
+    neo["close_approach_data"].append(past)
+    assert to_record(neo, since="2030-01-01")["closest_approach_date"] == "2030-01-01"
+    assert to_record(neo)["closest_approach_date"] == "1914-03-02"
+    # Objects that only came close in the past are left out
+    assert to_record(neo, since="2030-01-02") is None
+
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+import main
+from lazy import Lazy
+
+NEO = {"estimated_diameter": {"meters": {"estimated_diameter_max": 351.6}}}
+
+
+@pytest.fixture
+def fetched(monkeypatch, use_firestore, fake_firestore):
+    # Fresh in-process cache and flights, backed by the in-memory Firestore
+    fs = use_firestore(main.FirestoreMiddleware(should_store=main.AsteroidCollector.is_complete), fake_firestore)
+    monkeypatch.setattr(main, "fs", fs)
+    fetched = []
+
+    def get(key):
+        fetched.append(key)
+        return {"sbdb": {"object": {"fullname": key}}, "neo": NEO}
+
+    monkeypatch.setattr(main.asteroid_collector, "get", get)
+    return fetched
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize("query", ["limit=-1", "offset=-5", "limit=2&offset=-1", "limit=1.5", "offset=abc"])
+def test_list_rejects_invalid_pages(client, query):
+    assert client.get(f"/api/objects/?{query}").status_code == 400
+
+
+def test_store_rejects_negative_pages():
+    for limit, offset in [(-1, 0), (None, -1)]:
+        with pytest.raises(ValueError):
+            main.asteroid_collector.query(limit=limit, offset=offset)
+    assert len(main.asteroid_collector.query(limit=0)) == 0
+
+
+@pytest.mark.parametrize("query", ["expand=1", "expand=1&limit=0", f"expand=1&limit={main.MAX_EXPAND + 1}",
+                                   "expand=1&limit=ten"])
+def test_expand_needs_bounded_limit(client, fetched, query):
+    assert client.get(f"/api/objects/?{query}").status_code == 400
+    assert fetched == []
+
+
+def test_expand_fetches_only_the_page_once(client, fetched):
+    ids = [obj["id"] for obj in main.asteroid_collector.query(limit=5, offset=2)]
+    response = client.get("/api/objects/?limit=5&offset=2&expand=1")
+    assert response.status_code == 200
+    assert [obj["object"]["fullname"] for obj in response.get_json()] == ids
+    assert all("feasibility" in obj for obj in response.get_json())
+    assert sorted(fetched) == sorted(ids)
+
+    # Served from the stores from now on, also to other processes
+    assert client.get("/api/objects/?limit=5&offset=2&expand=1").get_json() == response.get_json()
+    main.fs.l1.clear()
+    assert client.get("/api/objects/?limit=5&offset=2&expand=1").get_json() == response.get_json()
+    assert len(fetched) == 5
+
+
+def test_get_many_shares_in_flight_loads(fetched, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    get = main.asteroid_collector.get
+
+    def slow_get(key):
+        started.set()
+        release.wait(5)
+        return get(key)
+
+    loader = threading.Thread(target=main.fs.get_or_create, args=("2000433", slow_get))
+    loader.start()
+    started.wait(5)
+    many = threading.Thread(target=lambda: results.update(main.fs.get_many(["2000433"], slow_get)))
+    results = {}
+    many.start()
+    # Let get_many reach the flight before the first load finishes
+    while main.fs.flight.coalesced == 0 and many.is_alive():
+        many.join(0.01)
+    release.set()
+    loader.join(5)
+    many.join(5)
+
+    assert fetched == ["2000433"]
+    assert results["2000433"]["neo"] == NEO
+
+
+def test_ready_once_everything_is_loaded(client, monkeypatch):
+    monkeypatch.setattr(Lazy, "registry", {})
+    dataset = Lazy("dataset", dict)
+    response = client.get("/api/ready/")
+    assert response.status_code == 503
+    assert response.get_json()["ready"] is False
+
+    dataset.get()
+    response = client.get("/api/ready/")
+    assert response.status_code == 200
+    assert response.get_json()["ready"] is True
@@ -0,0 +1,72 @@
+import astropy.units as u
+import numpy as np
+import pytest
+from astropy.time import Time
+
+from orbits import ORBIT_CACHE, orbit_positions, propagate_kepler
+
+
+def scalar_propagate(a, e, i, raan, argp, M0, epoch0, epoch):
+    """The original per-epoch astropy propagator, kept as the reference for the vectorized one."""
+    from astropy.constants import G, M_sun
+
+    mu = (G * M_sun).to(u.AU**3 / u.day**2).value
+    n = np.sqrt(mu / a.to(u.AU).value**3)
+    dt = (epoch - epoch0).to(u.day).value
+    M = np.deg2rad(M0.value) + n * dt
+
+    # Danby's starting value, Newton from E = M does not always converge at high eccentricity
+    E = M + 0.85 * e * np.sign(np.sin(M))
+    for _ in range(50):
+        E -= (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+
+    nu = 2 * np.arctan2(np.sqrt(1 + e) * np.sin(E / 2), np.sqrt(1 - e) * np.cos(E / 2))
+    r_mag = a.to(u.AU).value * (1 - e * np.cos(E))
+
+    Ω = np.deg2rad(raan.value)
+    ω = np.deg2rad(argp.value)
+    i_rad = np.deg2rad(i.value)
+    x = r_mag * (np.cos(Ω) * np.cos(ω + nu) - np.sin(Ω) * np.sin(ω + nu) * np.cos(i_rad))
+    y = r_mag * (np.sin(Ω) * np.cos(ω + nu) + np.cos(Ω) * np.sin(ω + nu) * np.cos(i_rad))
+    z = r_mag * (np.sin(i_rad) * np.sin(ω + nu))
+    return np.stack([x, y, z], axis=-1)
+
+
+ELEMENTS = [
+    # 433 Eros, Earth, a near-circular orbit and a comet-like e≈0.97 one
+    dict(a=1.458, e=0.2228, i=10.83, raan=304.3, argp=178.9, M0=310.6),
+    dict(a=1.00000018, e=0.01673163, i=0.0, raan=0.0, argp=102.93, M0=357.5),
+    dict(a=2.5, e=1e-6, i=5.0, raan=80.0, argp=10.0, M0=0.0),
+    dict(a=17.8, e=0.967, i=162.3, raan=58.4, argp=111.3, M0=38.4),
+]
+
+
+@pytest.mark.parametrize("elements", ELEMENTS)
+def test_propagate_kepler_matches_scalar(elements):
+    epoch0 = Time(2460600.5, format="jd", scale="tdb")
+    days = np.linspace(-5000, 5000, 401)
+    expected = scalar_propagate(
+        elements["a"] * u.AU, elements["e"], elements["i"] * u.deg, elements["raan"] * u.deg,
+        elements["argp"] * u.deg, elements["M0"] * u.deg, epoch0, epoch0 + days * u.day,
+    )
+
+    positions = propagate_kepler(**elements, epoch0=epoch0.jd, epochs=epoch0.jd + days)
+
+    assert positions.shape == (len(days), 3)
+    np.testing.assert_allclose(positions, expected, rtol=0, atol=1e-9 * elements["a"])
+
+
+@pytest.mark.parametrize("elements", ELEMENTS)
+def test_orbit_positions_matches_scalar(elements):
+    ORBIT_CACHE.clear()
+    epoch0 = Time(2460600.5, format="jd", scale="tdb")
+    start = Time("2026-01-01", scale="tdb")
+    steps, dt = 500, 3
+
+    positions = orbit_positions({**elements, "epoch0": epoch0}, "2026-01-01", dt=dt, steps=steps)
+
+    expected = scalar_propagate(
+        elements["a"] * u.AU, elements["e"], elements["i"] * u.deg, elements["raan"] * u.deg,
+        elements["argp"] * u.deg, elements["M0"] * u.deg, epoch0, start + np.arange(steps) * dt * u.day,
+    )
+    np.testing.assert_allclose(positions, expected, rtol=0, atol=1e-9 * elements["a"])
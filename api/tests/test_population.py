@@ -0,0 +1,112 @@
+import threading
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import population
+from population import EARTH_RADIUS_M, PopulationRaster
+
+
+def brute_force(grid, lon0, lat0, cell_size, lon, lat, radius_m):
+    """Sum of every cell whose centre lies within radius_m (great-circle) of (lon, lat)."""
+    rows, cols = grid.shape
+    cell_lat = np.deg2rad(lat0 - (np.arange(rows) + 0.5) * cell_size)[:, None]
+    cell_lon = np.deg2rad(lon0 + (np.arange(cols) + 0.5) * cell_size)[None, :]
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    cos_d = np.sin(cell_lat) * np.sin(lat) + np.cos(cell_lat) * np.cos(lat) * np.cos(cell_lon - lon)
+    inside = np.arccos(np.clip(cos_d, -1, 1)) <= min(radius_m / EARTH_RADIUS_M, np.pi)
+    return float(grid[inside].sum())
+
+
+@pytest.fixture(scope="module")
+def world():
+    grid = np.random.default_rng(1).integers(0, 1000, size=(180, 360)).astype(np.float64)
+    return grid, PopulationRaster.from_array(grid, lon0=-180, lat0=90, cell_size=1.0)
+
+
+@pytest.fixture(scope="module")
+def region():
+    # Half-degree cells over 10°W-20°E, 40°N-60°N
+    grid = np.random.default_rng(2).integers(0, 1000, size=(40, 60)).astype(np.float64)
+    return grid, PopulationRaster.from_array(grid, lon0=-10, lat0=60, cell_size=0.5)
+
+
+CIRCLES = [
+    (11.58, 48.14, 500e3),
+    # Across the dateline, from either side
+    (179.7, 10.2, 800e3),
+    (-179.9, -30.3, 300e3),
+    # Around the poles, the circle covers whole rows
+    (3.1, 88.6, 600e3),
+    (-45.2, -89.4, 200e3),
+    # Smaller than a cell, and the whole Earth
+    (20.3, 0.1, 30e3),
+    (0.3, 0.2, 21_000e3),
+]
+
+
+@pytest.mark.parametrize("lon, lat, radius_m", CIRCLES)
+def test_population_matches_brute_force(world, lon, lat, radius_m):
+    grid, raster = world
+    assert raster.is_global
+    assert raster.population(lon, lat, radius_m) == pytest.approx(brute_force(grid, -180, 90, 1.0, lon, lat, radius_m))
+
+
+@pytest.mark.parametrize("lon, lat, radius_m", CIRCLES)
+def test_population_rings_matches_brute_force(world, lon, lat, radius_m):
+    grid, raster = world
+    radii = radius_m * np.array([0.1, 0.5, 1.0])
+    expected = [brute_force(grid, -180, 90, 1.0, lon, lat, r) for r in radii]
+    np.testing.assert_allclose(raster.population_rings(lon, lat, radii), expected)
+
+
+def test_population_many_matches_brute_force(world):
+    grid, raster = world
+    rng = np.random.default_rng(3)
+    lons = np.concatenate([rng.uniform(-180, 180, 40), [179.9, -179.9, 0.0, 90.0]])
+    lats = np.concatenate([rng.uniform(-90, 90, 40), [0.0, 45.0, 89.9, -89.9]])
+    expected = [brute_force(grid, -180, 90, 1.0, lon, lat, 700e3) for lon, lat in zip(lons, lats)]
+    # A small chunk runs the chunked loop several times
+    np.testing.assert_allclose(raster.population_many(lons, lats, 700e3, chunk=7), expected)
+
+
+@pytest.mark.parametrize("lon, lat, radius_m", [
+    (5.2, 50.1, 300e3),
+    # Partly or entirely outside the raster
+    (-10.4, 45.3, 400e3),
+    (19.8, 59.9, 250e3),
+    (40.0, 50.0, 200e3),
+])
+def test_regional_raster_matches_brute_force(region, lon, lat, radius_m):
+    grid, raster = region
+    assert not raster.is_global
+    expected = brute_force(grid, -10, 60, 0.5, lon, lat, radius_m)
+    assert raster.population(lon, lat, radius_m) == pytest.approx(expected)
+    np.testing.assert_allclose(raster.population_rings(lon, lat, [radius_m / 2, radius_m])[-1], expected)
+    np.testing.assert_allclose(raster.population_many([lon], [lat], radius_m), [expected])
+
+
+
+def test_worldpop_rings_submit_concurrently(fake_transport, monkeypatch):
+    monkeypatch.setattr(population, "WORLDPOP_POLL_INTERVAL", 0)
+    radii = [1e3, 5e3, 20e3, 80e3]
+    radius_of = {population._worldpop_params(11.58, 48.14, r, 2020, None)["geojson"]: r for r in radii}
+    # Fails unless all four tasks are being submitted at the same time
+    barrier = threading.Barrier(len(radii), timeout=5)
+    polls = Counter()
+
+    def submit(url, params):
+        barrier.wait()
+        return {"taskid": str(int(radius_of[params["geojson"]]))}
+
+    def poll(url, params):
+        task_id = url.rsplit("/", 1)[1]
+        polls[task_id] += 1
+        return {"status": "finished" if polls[task_id] > 1 else "started", "data": {"total_population": task_id}}
+
+    fake_transport.add(population.WORLDPOP_STATS_URL, submit)
+    fake_transport.add(population.WORLDPOP_TASKS_URL, poll)
+
+    assert population.get_population_rings_worldpop(11.58, 48.14, radii) == [int(r) for r in radii]
+    assert polls == {str(int(r)): 2 for r in radii}
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import porkchop
+import utils
+from orbits import EARTH_ELEMENTS, lambert, orbit_elements, propagate_kepler_state
+from porkchop import MJD_TO_JD, design_missions, mission_window
+
+# 433 Eros, SBDB elements (AU, deg, JD)
+EROS = {"e": 0.2228, "a": 1.458, "i": 10.83, "raan": 304.3, "argp": 178.9, "M0": 310.6, "epoch0": 2460600.5}
+
+
+def test_lambert_known_transfer():
+    # Curtis, Orbital Mechanics for Engineering Students, example 5.2 (km, s)
+    v1, v2 = lambert([5000, 10000, 2100], [-14600, 2500, 7000], 3600, mu=398600)
+    np.testing.assert_allclose(v1, [-5.9925, 1.9254, 3.2456], rtol=1e-3)
+    np.testing.assert_allclose(v2, [-3.3125, -4.1966, -0.38529], rtol=1e-3)
+
+
+def test_lambert_recovers_orbit_velocities():
+    # Between two points of one orbit, the transfer with the same time of flight is that orbit
+    a, e, i, raan, argp, M0, jd1, jd2 = orbit_elements(EROS)
+    epochs = 2461000.5 + np.array([0.0, 50.0, 200.0, 400.0])
+    r, v = propagate_kepler_state(a, e, i, raan, argp, M0, jd1 + jd2, epochs)
+    tof = epochs[1:] - epochs[0]
+    v1, v2 = lambert(np.broadcast_to(r[0], (3, 3)), r[1:], tof)
+    np.testing.assert_allclose(v1, np.broadcast_to(v[0], (3, 3)), rtol=1e-7)
+    np.testing.assert_allclose(v2, v[1:], rtol=1e-7)
+
+
+def test_design_missions_picks_cheapest_transfers():
+    mjd_start, mjd_end = mission_window("2026-01-01", "2028-01-01")
+    porkchop.MISSION_CACHE.clear()
+    missions = design_missions(EROS, mjd_start, mjd_end)["missions"]
+    assert missions
+    departures, tofs, v_departure, v_arrival = porkchop.porkchop(EROS, mjd_start, mjd_end)
+    # Departures late in the window have no transfer arriving within it
+    total = np.where(np.isnan(v_departure + v_arrival), np.inf, v_departure + v_arrival).min(axis=1)
+
+    assert [m["departure_date"] for m in missions] == sorted(m["departure_date"] for m in missions)
+    for mission in missions:
+        departure = utils.modified_julian_day(mission["departure_date"])
+        arrival = utils.modified_julian_day(mission["arrival_date"])
+        assert mjd_start <= departure < arrival <= mjd_end
+        assert arrival - departure == mission["time_of_flight"]
+        # Each is the cheapest time of flight of its departure day, and a local minimum over departures
+        row = np.flatnonzero(departures == departure)[0]
+        assert mission["departure_speed"] + mission["arrival_relative_speed"] == pytest.approx(total[row])
+        assert total[row] <= min(total[max(row - 1, 0)], total[min(row + 1, len(total) - 1)])
+
+    # The departure speed is the hyperbolic excess speed of the transfer orbit
+    mission = missions[0]
+    departure = utils.modified_julian_day(mission["departure_date"]) + MJD_TO_JD
+    earth = orbit_elements(EARTH_ELEMENTS)
+    eros = orbit_elements(EROS)
+    r_earth, v_earth = propagate_kepler_state(*earth[:6], earth[6] + earth[7], np.array([departure]))
+    r_eros, _ = propagate_kepler_state(*eros[:6], eros[6] + eros[7], np.array([departure + mission["time_of_flight"]]))
+    v1, _ = lambert(r_earth, r_eros, mission["time_of_flight"])
+    assert np.linalg.norm(v1 - v_earth) * porkchop.AU_PER_DAY_KM_S == pytest.approx(mission["departure_speed"])
+
+
+@pytest.mark.parametrize("start_date, end_date", [
+    ("2026-01-01", "2025-12-31"),
+    ("2026-01-01", "2046-01-01"),
+    ("2026-13-01", "2027-01-01"),
+    ("2026-01-01", "soon"),
+])
+def test_mission_window_rejects(start_date, end_date):
+    with pytest.raises(ValueError):
+        mission_window(start_date, end_date)
+
+
+def test_porkchop_rejects_wide_windows():
+    with pytest.raises(ValueError):
+        porkchop.porkchop(EROS, 60000, 60000 + porkchop.MAX_SPAN + 1)
+
+
+@pytest.mark.parametrize("query", [
+    "start_date=2026-01-01&end_date=2080-01-01",
+    "start_date=2026-01-01&end_date=2025-01-01",
+    "start_date=2026-01-01&end_date=tomorrow",
+])
+def test_local_missions_route_rejects_windows(query, monkeypatch):
+    import main
+
+    def no_fetch(key, func):
+        raise AssertionError("an invalid window must not load the object")
+
+    monkeypatch.setattr(main.fs, "get_or_create", no_fetch)
+    response = main.app.test_client().get(f"/api/objects/2000433/missions/?engine=local&{query}")
+    assert response.status_code == 400
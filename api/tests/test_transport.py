@@ -0,0 +1,138 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from clients.asteroid_collector import AsteroidCollector
+from clients.transport import CircuitBreaker, CircuitOpenError, FakeTransport, HttpTransport
+
+HOST = "ssd-api.jpl.nasa.gov"
+COOLDOWN = 0.05
+
+
+def opened():
+    circuit = CircuitBreaker(threshold=2, cooldown=COOLDOWN)
+    for _ in range(2):
+        circuit.check(HOST)
+        circuit.record(HOST, ok=False)
+    with pytest.raises(CircuitOpenError):
+        circuit.check(HOST)
+    return circuit
+
+
+def test_half_open_lets_one_probe_through():
+    circuit = opened()
+    time.sleep(COOLDOWN)
+    circuit.check(HOST)
+    # Everything else fails fast while the probe is in flight
+    for _ in range(3):
+        with pytest.raises(CircuitOpenError):
+            circuit.check(HOST)
+
+
+def test_successful_probe_closes():
+    circuit = opened()
+    time.sleep(COOLDOWN)
+    circuit.check(HOST)
+    circuit.record(HOST, ok=True)
+    for _ in range(3):
+        circuit.check(HOST)
+    # Closed again, so it takes threshold failures to reopen
+    circuit.record(HOST, ok=False)
+    circuit.check(HOST)
+
+
+def test_failed_probe_reopens():
+    circuit = opened()
+    time.sleep(COOLDOWN)
+    circuit.check(HOST)
+    circuit.record(HOST, ok=False)
+    with pytest.raises(CircuitOpenError):
+        circuit.check(HOST)
+    time.sleep(COOLDOWN)
+    circuit.check(HOST)
+
+
+def test_lost_probe_is_replaced():
+    circuit = opened()
+    time.sleep(COOLDOWN)
+    circuit.check(HOST)
+    time.sleep(COOLDOWN)
+    # The first probe never reported, a new one goes through after another cooldown
+    circuit.check(HOST)
+    with pytest.raises(CircuitOpenError):
+        circuit.check(HOST)
+
+
+def test_hosts_are_independent():
+    circuit = opened()
+    circuit.check("api.nasa.gov")
+
+
+@pytest.fixture
+def upstream():
+    """Local server answering 503 with the headers in ``headers``, after ``delay`` seconds; counts requests."""
+    state = {"requests": 0, "delay": 0.0, "headers": {}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"] += 1
+            time.sleep(state["delay"])
+            self.send_response(503)
+            for name, value in state["headers"].items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_address[1]}/"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_with_backoff(upstream):
+    transport = HttpTransport(timeout=1, retries=3)
+    transport.BACKOFF = 0.01
+    assert transport.get(upstream["url"]).status_code == 503
+    assert upstream["requests"] == 4
+
+
+def test_timeout_bounds_retries(upstream):
+    transport = HttpTransport(timeout=5, retries=3)
+    upstream["headers"] = {"Retry-After": "2"}
+    started = time.monotonic()
+    # Waiting for the next attempt would overrun the timeout, the last answer is returned instead
+    assert transport.get(upstream["url"], timeout=1).status_code == 503
+    assert time.monotonic() - started < 1
+    assert upstream["requests"] == 1
+
+
+def test_timeout_bounds_slow_attempts(upstream):
+    transport = HttpTransport(timeout=5, retries=3)
+    upstream["delay"] = 0.4
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        transport.get(upstream["url"], timeout=0.3)
+    assert time.monotonic() - started < 1
+
+
+def test_collector_passes_its_deadline_down():
+    timeouts = []
+
+    class Recording(FakeTransport):
+        def get(self, url, params=None, timeout=None):
+            timeouts.append(timeout)
+            return super().get(url, params, timeout)
+
+    collector = AsteroidCollector("DEMO_KEY")
+    collector.sbdb_client.transport = collector.neo_client.transport = Recording({"https://": {}})
+    collector.get("2000433")
+    assert len(timeouts) == 2
+    assert all(0 < timeout <= AsteroidCollector.SBDB_TIMEOUT for timeout in timeouts)
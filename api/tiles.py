@@ -0,0 +1,49 @@
+import struct
+import zlib
+
+import numpy as np
+
+
+def tile_grid(z: int, x: int, y: int, size: int = 64):
+    """Lat/lon of a size x size grid of sample points covering slippy map tile z/x/y (Web Mercator)."""
+    n = 2 ** z
+    steps = (np.arange(size) + 0.5) / size
+
+    lons = (x + steps) / n * 360.0 - 180.0
+    mercator_y = np.pi * (1 - 2 * (y + steps) / n)
+    lats = np.rad2deg(np.arctan(np.sinh(mercator_y)))
+
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    return lat_grid, lon_grid
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Encode an (H, W, 4) uint8 array as a PNG."""
+    height, width, _ = rgba.shape
+    # Every scanline starts with filter type 0 (None)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def heatmap_png(values: np.ndarray, opaque: np.ndarray, max_value: float = 1e7) -> bytes:
+    """Render values on a log scale from transparent yellow to opaque red, dimming cells outside ``opaque``."""
+    level = np.clip(np.log10(np.maximum(values, 1)) / np.log10(max_value), 0, 1)
+
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = np.round(255 * (1 - level)).astype(np.uint8)
+    rgba[..., 2] = 0
+    alpha = np.where(values > 0, 64 + 191 * level, 0)
+    rgba[..., 3] = np.round(np.where(opaque, alpha, alpha / 2)).astype(np.uint8)
+    return encode_png(rgba)
@@ -0,0 +1,189 @@
+"""
+Load test of the CPU-heavy endpoints: python benchmarks/load_test.py [options]
+
+By default starts gunicorn (api/gunicorn.conf.py) once per --workers value and
+reports, per scenario, throughput and latency with twice as many client
+processes as workers, plus the resident (RSS) and proportional (PSS) memory
+of the master and its workers. With --url an already running server is
+tested instead, without memory figures.
+
+Throughput should grow with workers up to the number of cores, while PSS
+(shared pages split between the processes that map them) stays close to a
+single worker's.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+import requests
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "api")
+
+
+def orbit_request(session, url, key):
+    year = random.randint(1950, 2150)
+    return session.get(f"{url}/api/earth/orbit/", params={"start_date": f"{year}-01-01", "steps": 2000})
+
+
+def impact_request(session, url, key):
+    diameter = [random.uniform(10, 1000) for _ in range(2000)]
+    velocity = [random.uniform(11, 70) for _ in range(2000)]
+    return session.post(f"{url}/api/impacts/batch", json={"diameter": diameter, "velocity": velocity})
+
+
+def object_orbit_request(session, url, key):
+    return session.get(f"{url}/api/objects/{key}/orbit/", params={"steps": 2000, "format": "f32"})
+
+
+def object_impact_request(session, url, key):
+    lat, lon = random.uniform(-60, 70), random.uniform(-180, 180)
+    return session.get(f"{url}/api/objects/{key}/impact/", params={"lat": lat, "lon": lon})
+
+
+SCENARIOS = {
+    "orbit": orbit_request,
+    "impact": impact_request,
+    # Need the object's SBDB/NEO data, i.e. upstream access or a warm cache
+    "object_orbit": object_orbit_request,
+    "object_impact": object_impact_request,
+}
+
+
+def run_client(args):
+    scenario, url, key, duration = args
+    session = requests.Session()
+    request = SCENARIOS[scenario]
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        response = request(session, url, key)
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+    return latencies, errors
+
+
+def load(scenario: str, url: str, key: str, clients: int, duration: float) -> dict:
+    with Pool(clients) as pool:
+        results = pool.map(run_client, [(scenario, url, key, duration)] * clients)
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+
+    def percentile(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None
+
+    return {
+        "requests_per_second": len(latencies) / duration,
+        "p50_ms": percentile(0.5),
+        "p99_ms": percentile(0.99),
+        "errors": errors,
+    }
+
+
+def memory(pid: int) -> dict:
+    """RSS and PSS in MiB summed over a process and its children (Linux only)."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+
+    totals = {"rss_mib": 0.0, "pss_mib": 0.0}
+    for process in pids:
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                for line in f:
+                    name, value = line.split(":", 1)
+                    if name in ("Rss", "Pss"):
+                        totals[f"{name.lower()}_mib"] += int(value.split()[0]) / 1024
+        except OSError:
+            continue
+    totals["processes"] = len(pids)
+    return totals
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(server, url: str, processes: int):
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            # Ready once the app answers and every worker has forked
+            requests.get(f"{url}/api/ready/", timeout=1).raise_for_status()
+            if memory(server.pid)["processes"] >= processes:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    server.kill()
+    raise RuntimeError("Server did not become ready")
+
+
+def start_server(workers: int, threads: int, env: dict | None = None):
+    port = free_port()
+    env = {**os.environ, **(env or {}), "PORT": str(port), "workers": str(workers), "threads": str(threads)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "main:app"],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_until_ready(server, url, workers + 1)
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the orbit and impact endpoints")
+    parser.add_argument("--url", default=None, help="Test a running server instead of starting gunicorn")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="Comma separated worker counts")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=None, help="Client processes (default 2 per worker)")
+    parser.add_argument("--scenarios", default="orbit,impact", help=f"Comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--key", default="2000433", help="Object for the object_* scenarios")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    results = []
+    if args.url:
+        for scenario in scenarios:
+            result = load(scenario, args.url, args.key, args.clients or 8, args.duration)
+            results.append({"scenario": scenario, **result})
+    else:
+        for workers in sorted({int(w) for w in args.workers.split(",")}):
+            server, url = start_server(workers, args.threads)
+            try:
+                for scenario in scenarios:
+                    load(scenario, url, args.key, 1, 1)  # warm up
+                    result = load(scenario, url, args.key, args.clients or 2 * workers, args.duration)
+                    results.append({"workers": workers, "scenario": scenario, **result, **memory(server.pid)})
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print("  ".join(
+            f"{name}={value:.1f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in result.items()
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Offline benchmarks of the API hot paths: python benchmarks/suite.py [options]
+
+Times orbit propagation, land lookups, the impact model, population circles,
+payload merging and every Flask route (through the test client) in process,
+and reports throughput and p50/p99 latency per benchmark. Upstream APIs are
+replaced by a FakeTransport, Firestore is disabled, and population and the
+asteroid catalogue are synthetic (seeded), so runs are reproducible without
+network access.
+
+    --save baseline.json     store the results as a baseline
+    --compare baseline.json  exit with status 1 if a p50 is more than
+                             --threshold (default 25%) slower than the baseline
+
+Baselines are only comparable on the same machine and Python version.
+Routes are measured warm (caches filled by the warm-up call). Routes that
+cache what they compute are also measured cold, as route:<name>[cold] with
+the orbit, encounter, MOID, deflection, mission and heatmap caches cleared
+before every call (upstream payloads stay cached). The compute benchmarks
+clear their caches before every call.
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+from functools import partial
+
+import numpy as np
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "api")
+
+ORBIT_STEPS = (100, 1_000, 10_000, 100_000)
+EARTH_ORBIT_STEPS = (366, 3_660, 36_600)
+
+# Upstream payloads of an object from the bundled list, SBDB elements are 433 Eros'
+KEY = "54016489"
+SBDB_PAYLOAD = {
+    "object": {"fullname": "(2020 GA2)", "neo": True, "pha": True},
+    "orbit": {
+        "epoch": "2460600.5",
+        "elements": [
+            {"name": "e", "value": "0.2228"},
+            {"name": "a", "value": "1.458"},
+            {"name": "q", "value": "1.133"},
+            {"name": "i", "value": "10.83"},
+            {"name": "om", "value": "304.3"},
+            {"name": "w", "value": "178.9"},
+            {"name": "ma", "value": "310.6"},
+        ],
+    },
+}
+NEO_PAYLOAD = {
+    "id": KEY,
+    "name": "(2020 GA2)",
+    "estimated_diameter": {"meters": {"estimated_diameter_max": 351.59}},
+    "is_potentially_hazardous_asteroid": True,
+}
+MDESIGN_PAYLOAD = {
+    "dv_lowthrust": 8.2,
+    "selectedMissions": [
+        [61000 + day, 61190 + day, 5.1, 4.2, 40.0, 0.3, 60.0, 12.0, 80.0, 190] for day in range(0, 3650, 60)
+    ],
+}
+
+# One request per Flask endpoint, as (name, method, path, options for the test client)
+ROUTE_REQUESTS = {
+    "index": [("index", "GET", "/", {})],
+    "get_api": [("get_api", "GET", "/api/", {})],
+    "get_ready": [("get_ready", "GET", "/api/ready/", {})],
+    "get_cache_stats": [("get_cache_stats", "GET", "/api/cache/stats/", {})],
+    "list_objects": [
+        ("list_objects", "GET", "/api/objects/", {}),
+        ("list_objects[query]", "GET", "/api/objects/?min_diameter=0.1&sort=closest_miss_km&limit=20", {}),
+        ("list_objects[expand]", "GET", "/api/objects/?limit=20&expand=1", {}),
+    ],
+    "get_object": [("get_object", "GET", f"/api/objects/{KEY}/", {})],
+    "get_missions": [
+        ("get_missions[jpl]", "GET", f"/api/objects/{KEY}/missions/?start_date=2026-01-01&end_date=2030-01-01&engine=jpl", {}),
+        ("get_missions[local]", "GET", f"/api/objects/{KEY}/missions/?start_date=2026-01-01&end_date=2029-01-01&engine=local", {}),
+    ],
+    "get_object_orbit": [
+        ("get_object_orbit", "GET", f"/api/objects/{KEY}/orbit/?steps=1000", {}),
+        ("get_object_orbit[f32]", "GET", f"/api/objects/{KEY}/orbit/?steps=10000&format=f32", {}),
+    ],
+    "get_object_encounters": [("get_object_encounters", "GET", f"/api/objects/{KEY}/encounters/?start_date=2026-01-01", {})],
+    "get_moid_ranking": [("get_moid_ranking", "GET", "/api/objects/moid/?limit=20", {})],
+    "get_object_deflection": [
+        ("get_object_deflection", "GET", f"/api/objects/{KEY}/deflection/?encounter_date=2030-01-01", {}),
+    ],
+    "get_earth_orbit": [("get_earth_orbit", "GET", "/api/earth/orbit/?start_date=2026-01-01&steps=366", {})],
+    "get_object_impact": [("get_object_impact", "GET", f"/api/objects/{KEY}/impact/?lat=48.14&lon=11.58", {})],
+    "post_impacts_batch": [
+        ("post_impacts_batch[scenarios]", "POST", "/api/impacts/batch", {"json": {
+            "diameter": np.linspace(10, 1000, 1000).tolist(), "velocity": np.linspace(11, 70, 1000).tolist(),
+        }}),
+        ("post_impacts_batch[points]", "POST", "/api/impacts/batch", {"json": {
+            "key": KEY, "lat": np.linspace(-60, 70, 1000).tolist(), "lon": np.linspace(-180, 180, 1000).tolist(),
+            "population": True,
+        }}),
+    ],
+    "get_object_heatmap": [("get_object_heatmap", "GET", f"/api/objects/{KEY}/heatmap/4/8/5?size=64", {})],
+}
+# Served by Flask itself
+SKIPPED_ENDPOINTS = {"static"}
+# Routes that cache computed results, also measured with those caches cleared
+CACHED_ENDPOINTS = {
+    "get_missions",
+    "get_object_orbit",
+    "get_object_encounters",
+    "get_moid_ranking",
+    "get_object_deflection",
+    "get_earth_orbit",
+    "get_object_heatmap",
+}
+
+# name -> (function to time, setup run untimed before every call)
+BENCHMARKS = {}
+
+
+def add(name: str, func, setup=None):
+    BENCHMARKS[name] = (func, setup)
+
+
+def write_population_raster(path: str):
+    """A global 0.25° raster of random population, in the format of PopulationRaster.from_geotiff."""
+    from population import PopulationRaster
+
+    grid = np.random.default_rng(0).gamma(0.5, 400, size=(720, 1440))
+    raster = PopulationRaster.from_array(grid, lon0=-180, lat0=90, cell_size=0.25)
+    np.save(path, raster.prefix)
+    with open(path + ".json", "w") as f:
+        json.dump({"lon0": -180, "lat0": 90, "cell_size": 0.25}, f)
+
+
+def write_catalogue(path: str):
+    """The bundled asteroid list with random SBDB elements, in the catalogue format of ingest.py --sbdb."""
+    from clients.local_store import AsteroidStore
+
+    columns = dict(AsteroidStore.from_json("hazardous_asteroid_list.json").columns)
+    rng = np.random.default_rng(0)
+    size = len(columns["id"])
+    columns.update({
+        "a": rng.uniform(0.8, 3.0, size),
+        "e": rng.uniform(0, 0.7, size),
+        "i": rng.uniform(0, 30, size),
+        "raan": rng.uniform(0, 360, size),
+        "argp": rng.uniform(0, 360, size),
+        "M0": rng.uniform(0, 360, size),
+        "epoch": np.full(size, 2460600.5),
+    })
+    os.makedirs(path)
+    for column, values in columns.items():
+        np.save(os.path.join(path, f"{column}.npy"), values)
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump({"version": "benchmark", "count": size, "columns": list(columns)}, f)
+
+
+def register():
+    # Imported only now, main.py reads its configuration from the environment at import
+    import main
+    from clients.asteroid_collector import AsteroidCollector
+    from clients.transport import FakeTransport, set_transport
+    from deflection import DEFLECTION_CACHE
+    from encounters import APPROACH_CACHE, MOID_CACHE
+    from impacts import calculate_impact, is_on_land, simulate_impact
+    from lazy import Lazy
+    from orbits import ORBIT_CACHE, compute_earth_orbit, compute_orbit
+    from population import circle_geojson
+    from porkchop import MISSION_CACHE
+
+    set_transport(FakeTransport({
+        "https://ssd-api.jpl.nasa.gov/sbdb.api": SBDB_PAYLOAD,
+        "https://api.nasa.gov/neo/rest/v1/neo/": NEO_PAYLOAD,
+        "https://ssd-api.jpl.nasa.gov/mdesign.api": MDESIGN_PAYLOAD,
+    }))
+
+    rng = np.random.default_rng(0)
+    data = main.orbit_data(SBDB_PAYLOAD)
+    for steps in ORBIT_STEPS:
+        add(f"compute_orbit[steps={steps}]", partial(compute_orbit, data, "2026-01-01", steps=steps), ORBIT_CACHE.clear)
+    for steps in EARTH_ORBIT_STEPS:
+        add(f"compute_earth_orbit[steps={steps}]", partial(compute_earth_orbit, "2026-01-01", steps=steps),
+            ORBIT_CACHE.clear)
+    # Beyond the precomputed ephemeris, propagated like any other orbit
+    add("compute_earth_orbit[steps=366,propagated]", partial(compute_earth_orbit, "2300-01-01", steps=366),
+        ORBIT_CACHE.clear)
+
+    points = itertools.cycle(list(zip(rng.uniform(-60, 70, 4096).tolist(), rng.uniform(-180, 180, 4096).tolist())))
+    add("is_on_land", lambda: is_on_land(*next(points)))
+
+    add("simulate_impact", partial(simulate_impact, 351.59, 3000, 30.04))
+    add("simulate_impact[n=10000]", partial(
+        simulate_impact, rng.uniform(10, 1000, 10_000), 3000, rng.uniform(11, 70, 10_000),
+    ))
+
+    neo_data = AsteroidCollector.get_merge({"sbdb": SBDB_PAYLOAD, "neo": dict(NEO_PAYLOAD, relative_velocity_km_s=30.04)})
+    add("calculate_impact", lambda: calculate_impact(neo_data, *next(points)))
+
+    for radius_km in (1, 100):
+        add(f"circle_geojson[radius={radius_km}km]", partial(circle_geojson, 11.58, 48.14, radius_km * 1000))
+
+    add("get_merge", partial(AsteroidCollector.get_merge, {"sbdb": SBDB_PAYLOAD, "neo": NEO_PAYLOAD}))
+
+    endpoints = {rule.endpoint for rule in main.app.url_map.iter_rules()} - SKIPPED_ENDPOINTS
+    missing = sorted(endpoints - set(ROUTE_REQUESTS))
+    if missing:
+        raise RuntimeError(f"No benchmark request for the routes {', '.join(missing)}")
+
+    def clear_route_caches():
+        for cache in (ORBIT_CACHE, APPROACH_CACHE, MOID_CACHE, DEFLECTION_CACHE, MISSION_CACHE,
+                      main.mission_design.cache, main.heatmap_tiles):
+            cache.clear()
+
+    client = main.app.test_client()
+    for endpoint in sorted(endpoints):
+        for name, method, path, options in ROUTE_REQUESTS[endpoint]:
+            # The readiness route answers 503 until every Lazy resource has loaded
+            add(f"route:{name}", partial(request, client, method, path, options),
+                Lazy.preload if endpoint == "get_ready" else None)
+            if endpoint in CACHED_ENDPOINTS:
+                add(f"route:{name}[cold]", partial(request, client, method, path, options), clear_route_caches)
+
+
+def request(client, method: str, path: str, options: dict):
+    response = client.open(path, method=method, **options)
+    if response.status_code != 200:
+        raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    # Read streamed bodies to the end
+    response.get_data()
+
+
+def measure(func, setup=None, min_time: float = 0.5, min_rounds: int = 5, max_rounds: int = 100_000) -> dict:
+    if setup:
+        setup()
+    func()  # warm up
+
+    samples = []
+    total = 0
+    while (total < min_time * 1e9 or len(samples) < min_rounds) and len(samples) < max_rounds:
+        if setup:
+            setup()
+        started = time.perf_counter_ns()
+        func()
+        elapsed = time.perf_counter_ns() - started
+        samples.append(elapsed)
+        total += elapsed
+
+    samples.sort()
+    return {
+        "ops_per_second": len(samples) / (total / 1e9),
+        "p50_ms": samples[len(samples) // 2] / 1e6,
+        "p99_ms": samples[min(int(0.99 * len(samples)), len(samples) - 1)] / 1e6,
+        "rounds": len(samples),
+    }
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Relative change of p50 against the baseline, for benchmarks present in both."""
+    return {
+        name: result["p50_ms"] / baseline["results"][name]["p50_ms"] - 1
+        for name, result in results.items() if name in baseline["results"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the API hot paths")
+    parser.add_argument("-k", "--select", default="*", help="Only run benchmarks matching this glob pattern")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds to time each benchmark for")
+    parser.add_argument("--save", default=None, help="Write the results as a baseline to this file")
+    parser.add_argument("--compare", default=None, help="Baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed p50 slowdown against the baseline")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    # Relative to where the suite was started, it runs from the api directory
+    save = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(API_DIR)
+        sys.path.insert(0, API_DIR)
+        os.environ.update({
+            "firestore": "0",
+            "neo_api_key": "offline",
+            "refresh_ahead": "0",
+            "preload": "0",
+            "mission_engine": "jpl",
+        })
+        # Read by population.py at import
+        os.environ["population_source"] = os.path.join(directory, "population.npy")
+        write_population_raster(os.environ["population_source"])
+        os.environ["asteroid_catalogue"] = os.path.join(directory, "catalogue")
+        write_catalogue(os.environ["asteroid_catalogue"])
+        # astropy warns about leap seconds for dates decades ahead, once per process
+        warnings.filterwarnings("ignore", module="erfa")
+        register()
+
+        results = {}
+        for name, (func, setup) in BENCHMARKS.items():
+            if fnmatch.fnmatch(name, args.select):
+                results[name] = measure(func, setup, min_time=args.min_time)
+                if not args.json:
+                    result = results[name]
+                    print(f"{name:<48} {result['ops_per_second']:>12.1f} ops/s  "
+                          f"p50 {result['p50_ms']:>10.3f} ms  p99 {result['p99_ms']:>10.3f} ms")
+
+    changes = compare(results, baseline) if baseline else {}
+    regressions = [name for name, change in changes.items() if change > args.threshold]
+    if args.json:
+        print(json.dumps({"results": results, "changes": changes}, indent=2))
+    else:
+        for name, change in changes.items():
+            flag = "  REGRESSION" if name in regressions else ""
+            before, after = baseline["results"][name]["p50_ms"], results[name]["p50_ms"]
+            print(f"{name:<48} p50 {before:>10.3f} -> {after:>10.3f} ms ({change:+.0%}){flag}")
+
+    if save:
+        with open(save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "cpus": os.cpu_count(),
+                "results": results,
+            }, f, indent=2)
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
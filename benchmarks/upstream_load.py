@@ -0,0 +1,254 @@
+"""
+Load test of the upstream-bound endpoints: python benchmarks/upstream_load.py [options]
+
+Starts local stub servers standing in for SBDB, NeoWs, WorldPop and JPL
+mdesign, each answering after --latency seconds (WorldPop tasks finish
+--task-seconds after they are submitted, so impact requests also poll), and
+points the app at them. Then runs the same load against one gunicorn worker
+(main:app, sync) and one uvicorn worker (asgi:app, async) and reports
+throughput, latency and the most upstream requests the stubs saw in flight.
+
+Every request uses a new object id so that none is answered from a cache.
+The sync worker is capped at --threads concurrent requests, the async one
+should keep close to --concurrency in flight.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from load_test import API_DIR, free_port, wait_until_ready
+
+
+class Upstream(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency: float, task_seconds: float):
+        super().__init__(("127.0.0.1", free_port()), UpstreamHandler)
+        self.latency = latency
+        self.task_seconds = task_seconds
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        # Clients given up on by an overloaded server close their connections early
+        pass
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def enter(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def reset(self):
+        with self.lock:
+            self.peak_in_flight = self.in_flight
+            self.requests = 0
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.enter()
+        try:
+            time.sleep(self.server.latency)
+            self.send_json(self.answer())
+        finally:
+            self.server.leave()
+
+    def answer(self):
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == "/sbdb.api":
+            return {"object": {"fullname": query["sstr"], "neo": True}}
+        if url.path.startswith("/neo/rest/v1/neo/"):
+            return {
+                "id": url.path.rsplit("/", 1)[1],
+                "estimated_diameter": {"meters": {"estimated_diameter_max": 300.0}},
+                "relative_velocity_km_s": 20.0,
+            }
+        if url.path == "/worldpop/stats":
+            task_id = uuid.uuid4().hex
+            self.server.tasks[task_id] = time.monotonic()
+            return {"taskid": task_id}
+        if url.path.startswith("/worldpop/tasks/"):
+            submitted = self.server.tasks[url.path.rsplit("/", 1)[1]]
+            finished = time.monotonic() - submitted >= self.server.task_seconds
+            return {"status": "finished" if finished else "started", "data": {"total_population": 123456}}
+        if url.path == "/mdesign.api":
+            mjd0 = int(query["mjd0"])
+            return {"dv_lowthrust": 8.2, "selectedMissions": [[mjd0 + 10, mjd0 + 200, 5.1, 4.2, 40.0, 0.3, 60.0, 12.0, 80.0, 190]]}
+        return {"message": f"No stub for {url.path}"}
+
+    def send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def upstream_env(upstream: Upstream) -> dict:
+    return {
+        "sbdb_url": f"{upstream.url}/sbdb.api",
+        "neo_url": f"{upstream.url}/neo/rest/v1/",
+        "neo_api_key": "stub",
+        "worldpop_stats_url": f"{upstream.url}/worldpop/stats",
+        "worldpop_tasks_url": f"{upstream.url}/worldpop/tasks/",
+        "mdesign_url": f"{upstream.url}/mdesign.api",
+        "population_source": "worldpop",
+        "refresh_ahead": "0",
+    }
+
+
+def start(mode: str, threads: int, env: dict):
+    port = free_port()
+    env = {**os.environ, **env, "PORT": str(port), "workers": "1", "threads": str(threads)}
+    if mode == "sync":
+        command = ["-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "main:app"]
+        processes = 2
+    else:
+        command = ["-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port), "--no-access-log",
+                   "--backlog", "4096"]
+        processes = 1
+    server = subprocess.Popen(
+        [sys.executable, *command], cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_until_ready(server, url, processes)
+    return server, url
+
+
+ids = itertools.count()
+
+
+def impact_request(client: httpx.AsyncClient, url: str):
+    return client.get(f"{url}/api/objects/bench{next(ids)}/impact/", params={"lat": 48.1, "lon": 11.6})
+
+
+def missions_request(client: httpx.AsyncClient, url: str):
+    params = {"start_date": "2030-01-01", "end_date": "2031-01-01", "engine": "jpl"}
+    return client.get(f"{url}/api/objects/bench{next(ids)}/missions/", params=params)
+
+
+SCENARIOS = {
+    "impact": impact_request,
+    "missions": missions_request,
+}
+
+
+async def load(scenario: str, url: str, concurrency: int, duration: float) -> dict:
+    request = SCENARIOS[scenario]
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def client_loop(client):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await request(client, url)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None
+
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(0.5),
+        "p99_ms": percentile(0.99),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the upstream-bound endpoints against local stubs")
+    parser.add_argument("--modes", default="sync,async", help="Comma separated, from sync (gunicorn) and async (uvicorn)")
+    parser.add_argument("--scenarios", default="impact,missions", help=f"Comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--threads", type=int, default=8, help="Threads of the sync worker")
+    parser.add_argument("--concurrency", type=int, default=256, help="Concurrent client requests")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds every stub request takes")
+    parser.add_argument("--task-seconds", type=float, default=0.5, help="Seconds until a WorldPop task finishes")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    upstream = Upstream(args.latency, args.task_seconds)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    results = []
+    try:
+        for mode in args.modes.split(","):
+            server, url = start(mode, args.threads, upstream_env(upstream))
+            try:
+                for scenario in args.scenarios.split(","):
+                    asyncio.run(load(scenario, url, 1, 1))  # warm up
+                    upstream.reset()
+                    result = asyncio.run(load(scenario, url, args.concurrency, args.duration))
+                    results.append({
+                        "mode": mode,
+                        "scenario": scenario,
+                        **result,
+                        "upstream_requests": upstream.requests,
+                        "peak_upstream_in_flight": upstream.peak_in_flight,
+                    })
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+    finally:
+        upstream.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print("  ".join(
+            f"{name}={value:.1f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in result.items()
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 def get_float(prompt, min_value=None, max_value=None, default=None):
     """Prompt for a float. If the user presses Enter and `default` is not None,
     return the default value."""
@@ -63,7 +65,7 @@ def simulate_impact( diameter, density, velocity):
     Fwood = 1_464_400.0  # dry wood ignites (~35 cal/cm²)
  
     def r_for_fluence(F):
-        return math.sqrt(E_th / (4 * math.pi * F)) / 1000.0
+        return np.sqrt(E_th / (4 * math.pi * F)) / 1000.0
 
     r_th_1deg = r_for_fluence(F1)
     r_th_2deg = r_for_fluence(F2)